@@ -0,0 +1,162 @@
+"""
+Tweet counts for figures and summaries: per time bucket, per time bucket and field value
+(eg: language), and per user.
+
+Given a pymongo collection, each count is one aggregation pipeline ($match on the time
+range, $group on the timestamp truncated to the bucket), so only the counts cross the
+network. Given any other iterable of tweets (eg: a file archive read with
+json_util.NonListStreamJsonListLoader or bson.decode_file_iter), tweets are streamed
+and counted client-side, with the same results.
+
+Time buckets are 'step'-long (a timedelta), starting at 'start'. Tweets without a
+'timestamp' field are bucketed by their parsed 'created_at' when streamed (Mongo
+aggregation only considers 'timestamp').
+
+Time bucket counts can also be given a rollup.TweetRollup of the collection: when it
+covers the requested range, counts are read from it instead of the tweets.
+"""
+
+from collections import OrderedDict, defaultdict
+from smappPy.tweet_util import TIMESTAMP_FIELD, get_timestamp
+
+
+def _is_collection(source):
+    """Mongo collections are aggregated server-side, anything else is iterated"""
+    return hasattr(source, "aggregate")
+
+def _step_ms(step):
+    return int(step.total_seconds() * 1000)
+
+def _bucket_expression(start, step, field=TIMESTAMP_FIELD):
+    """
+    Aggregation expression for a document's bucket offset from start, in ms (a multiple
+    of step). Uses $subtract/$mod, so works on servers without $dateTrunc or $floor.
+    """
+    elapsed = {"$subtract": ["$" + field, start]}
+    return {"$subtract": [elapsed, {"$mod": [elapsed, _step_ms(step)]}]}
+
+def _range_match(start, step, num_steps, query=None, field=TIMESTAMP_FIELD):
+    match = dict(query or {})
+    match[field] = {"$gte": start, "$lt": start + num_steps * step}
+    return match
+
+def _bucket_index(timestamp, start, step, num_steps):
+    """Returns bucket index of timestamp, or None if out of range"""
+    if timestamp < start:
+        return None
+    index = int((timestamp - start).total_seconds() // step.total_seconds())
+    return index if index < num_steps else None
+
+def _get_field(doc, path):
+    """Returns value of (dotted) field path in doc, or None"""
+    for key in path.split("."):
+        if not isinstance(doc, dict) or key not in doc:
+            return None
+        doc = doc[key]
+    return doc
+
+
+def _use_rollup(rollup, query, start, step, num_steps):
+    return rollup is not None and not query and rollup.covers(start, start + num_steps * step, step)
+
+def bucket_counts(source, start, step, num_steps, query=None, rollup=None):
+    """
+    Takes a pymongo collection or iterable of tweets. Returns list of num_steps tweet
+    counts, for buckets [start + i*step, start + (i+1)*step). 'query' (Mongo only)
+    further filters tweets. 'rollup' is an optional TweetRollup of the collection.
+    """
+    counts = [0] * num_steps
+    if _use_rollup(rollup, query, start, step, num_steps):
+        return rollup.bucket_counts(start, step, num_steps)
+    if _is_collection(source):
+        pipeline = [
+            {"$match": _range_match(start, step, num_steps, query)},
+            {"$group": {"_id": _bucket_expression(start, step), "count": {"$sum": 1}}},
+        ]
+        for group in source.aggregate(pipeline, allowDiskUse=True):
+            counts[int(group["_id"] // _step_ms(step))] = group["count"]
+    else:
+        for tweet in source:
+            index = _bucket_index(get_timestamp(tweet), start, step, num_steps)
+            if index is not None:
+                counts[index] += 1
+    return counts
+
+def bucket_counts_by(source, start, step, num_steps, field="lang", values=None, other="other",
+    missing="unk", query=None, rollup=None):
+    """
+    Takes a pymongo collection or iterable of tweets. Returns OrderedDict of field value ->
+    list of num_steps tweet counts (as bucket_counts), split by the value of (dotted)
+    'field'. Tweets without the field count as value 'missing'. If 'values' is given, the
+    dict has those keys (in order), plus 'other' for tweets with any other value.
+    'field' may also be one of the rollup's boolean dimensions ("retweet", "geocoded",
+    "has_url"), computed from the tweet as rollup.TweetRollup does. 'rollup' (optional
+    TweetRollup) is used if 'field' is one of its dimensions.
+    """
+    from smappPy.rollup import DIMENSIONS, DIMENSION_EXPRESSIONS, DIMENSION_FUNCTIONS, MISSING_LANG
+    flag = field in DIMENSIONS and field != "lang"
+    if (field in DIMENSIONS and (field != "lang" or missing == MISSING_LANG) and
+        _use_rollup(rollup, query, start, step, num_steps)):
+        return rollup.bucket_counts_by(start, step, num_steps, field, values, other)
+
+    counts = OrderedDict((v, [0] * num_steps) for v in (values or []))
+    if values:
+        counts[other] = [0] * num_steps
+
+    def add(value, index, count):
+        value = missing if value is None else value
+        if values and value not in counts:
+            value = other
+        if value not in counts:
+            counts[value] = [0] * num_steps
+        counts[value][index] += count
+
+    if _is_collection(source):
+        value = DIMENSION_EXPRESSIONS[field] if flag else {"$ifNull": ["$" + field, missing]}
+        pipeline = [
+            {"$match": _range_match(start, step, num_steps, query)},
+            {"$group": {"_id": {"t": _bucket_expression(start, step), "v": value},
+                        "count": {"$sum": 1}}},
+        ]
+        for group in source.aggregate(pipeline, allowDiskUse=True):
+            add(group["_id"]["v"], int(group["_id"]["t"] // _step_ms(step)), group["count"])
+    else:
+        get = DIMENSION_FUNCTIONS[field] if flag else lambda tweet: _get_field(tweet, field)
+        for tweet in source:
+            index = _bucket_index(get_timestamp(tweet), start, step, num_steps)
+            if index is not None:
+                add(get(tweet), index, 1)
+    return counts
+
+def user_counts(source, start=None, end=None, user_field="user.id", query=None):
+    """
+    Takes a pymongo collection or iterable of tweets. Returns dict of user (value of
+    dotted 'user_field') -> number of tweets, for tweets in [start, end) (if given).
+    Tweets without the user field are skipped.
+    """
+    counts = defaultdict(int)
+    if _is_collection(source):
+        match = dict(query or {})
+        if start or end:
+            match[TIMESTAMP_FIELD] = {}
+            if start:
+                match[TIMESTAMP_FIELD]["$gte"] = start
+            if end:
+                match[TIMESTAMP_FIELD]["$lt"] = end
+        match[user_field] = {"$exists": True}
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": "$" + user_field, "count": {"$sum": 1}}},
+        ]
+        for group in source.aggregate(pipeline, allowDiskUse=True, batchSize=10000):
+            counts[group["_id"]] = group["count"]
+    else:
+        for tweet in source:
+            if start or end:
+                timestamp = get_timestamp(tweet)
+                if (start and timestamp < start) or (end and timestamp >= end):
+                    continue
+            user = _get_field(tweet, user_field)
+            if user is not None:
+                counts[user] += 1
+    return dict(counts)
@@ -3,9 +3,16 @@ Utility functions for pymongo Collections (most functions take pymongo Collectio
 objects)
 """
 
+import logging
+from pymongo.errors import BulkWriteError
 from smappPy.tweet_util import ID_FIELD, RANDOM_FIELD, TIMESTAMP_FIELD
 from smappPy.twitteruser_util import USER_ID, USER_RANDOM, ACCOUNT_CREATED_TIMESTAMP
 
+DUPLICATE_KEY_ERROR = 11000
+CURSOR_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
 def create_tweet_indexes(collection, index_id=True, index_random=True, index_timestamp=True):
     """
     Creates standard indexes on given collection of tweets. Flags for:
@@ -48,4 +55,53 @@ def create_user_indexes(collection, index_id=True, index_random=True, index_time
     if index_timestamp:
         collection.ensure_index(ACCOUNT_CREATED_TIMESTAMP,
                                 name="index_timestamp",
-                                background=True)
\ No newline at end of file
+                                background=True)
+
+def bulk_write_ignore_duplicates(collection, requests):
+    """
+    Sends given list of pymongo write requests (InsertOne, UpdateOne, etc) to collection
+    as one unordered bulk write. Duplicate key errors are expected and skipped; other
+    write errors are logged. Returns the raw bulk result dict (keys 'nInserted',
+    'nUpserted', 'nModified', 'upserted', 'writeErrors', etc), also when writes failed.
+    """
+    if not requests:
+        return {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0,
+            "upserted": [], "writeErrors": []}
+    try:
+        return collection.bulk_write(requests, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            if error["code"] != DUPLICATE_KEY_ERROR:
+                logger.error("Bulk write to {0} failed for op {1}: {2}".format(
+                    collection.full_name, error["index"], error["errmsg"]))
+        return e.details
+
+def field_projection(fields):
+    """
+    Takes a list of (dotted) field paths. Returns a pymongo projection dict including only
+    those fields (and not _id, unless listed). Paths under another listed path are dropped
+    (eg: "user" covers "user.id"), as servers reject overlapping projections.
+    """
+    fields = sorted(set(fields))
+    projection = {"_id": False}
+    for f in fields:
+        if not any(f.startswith(parent + ".") for parent in projection if parent != "_id"):
+            projection[f] = True
+    return projection
+
+def tweet_cursor(collection, query=None, fields=None, batch_size=CURSOR_BATCH_SIZE, sort=None,
+    hint=None, **kwargs):
+    """
+    Returns a cursor over documents of collection matching query, fetching only the given
+    (dotted) fields (all fields if None) in batches of batch_size. 'sort' is a list of
+    (field, direction) tuples, 'hint' an index name or spec for the query planner; other
+    keyword arguments are passed to find (eg: no_cursor_timeout=True).
+    Declaring the fields a scan needs keeps full tweets (embedded user, retweeted_status,
+    entities) from being sent over the network.
+    """
+    cursor = collection.find(query or {},
+        projection=field_projection(fields) if fields is not None else None,
+        batch_size=batch_size, sort=sort, **kwargs)
+    if hint is not None:
+        cursor = cursor.hint(hint)
+    return cursor
@@ -0,0 +1,346 @@
+"""
+Columnar tweet storage: a configurable list of fields flattened into one column each,
+so analyses read (memory-map) only the columns they use rather than parsing whole
+tweets. Written by store_tweets.tweets_to_columns (or ColumnarWriter), read with
+read_columns.
+
+Two formats:
+- "numpy" (default): a directory with a raw binary file per column (plus offset
+  files for strings and lists) and a manifest.json. read_columns memory-maps the
+  requested columns as numpy arrays, without copying or parsing.
+- "parquet": one Parquet file, a row group per chunk, dictionary encoded (requires
+  pyarrow). read_columns returns a pyarrow Table (table.to_pandas() for pandas).
+
+Columns are (name, kind, field) tuples, where field is a dotted path into the tweet or
+a function of the tweet. Kinds, and their numpy representation (and missing value):
+    "int"           int64 (-1)
+    "float"         float64 (NaN)
+    "bool"          bool (False)
+    "timestamp"     datetime64[ms] (NaT)
+    "string"        StringColumn: utf8 bytes with offsets ("")
+    "category"      CategoryColumn: int32 codes into a dictionary of strings (-1 / None),
+                    for repeated values like languages
+    "category_list" ListColumn of a CategoryColumn, for lists like hashtags
+"""
+
+import os
+import json
+import numpy as np
+from datetime import datetime
+
+from smappPy.tweet_util import get_timestamp
+from smappPy.entities import get_hashtags
+from smappPy.geo_tweet import get_coordinates
+
+MANIFEST_FILE = "manifest.json"
+MISSING_INT = -1
+EPOCH = datetime(1970, 1, 1)
+
+
+def _is_retweet(tweet):
+    return tweet.get("retweeted_status") is not None
+
+def _longitude(tweet):
+    coordinates = get_coordinates(tweet)
+    return coordinates[0] if coordinates else None
+
+def _latitude(tweet):
+    coordinates = get_coordinates(tweet)
+    return coordinates[1] if coordinates else None
+
+DEFAULT_COLUMNS = [
+    ("id", "int", "id"),
+    ("user_id", "int", "user.id"),
+    ("timestamp", "timestamp", get_timestamp),
+    ("lang", "category", "lang"),
+    ("text", "string", "text"),
+    ("is_retweet", "bool", _is_retweet),
+    ("retweeted_user_id", "int", "retweeted_status.user.id"),
+    ("hashtags", "category_list", get_hashtags),
+    ("longitude", "float", _longitude),
+    ("latitude", "float", _latitude),
+]
+
+KINDS = ["int", "float", "bool", "timestamp", "string", "category", "category_list"]
+
+
+def _getter(field):
+    """Returns function of a tweet returning field (dotted path or function) or None"""
+    if callable(field):
+        return field
+    path = field.split(".")
+    def get(tweet):
+        value = tweet
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+def _as_unicode(value):
+    return value.decode("utf8") if isinstance(value, str) else value
+
+def _timestamp_ms(value):
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+class StringColumn(object):
+    """Strings stored as concatenated utf8 bytes ('data') and int64 'offsets' (n+1)"""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tostring().decode("utf8")
+
+    def tolist(self):
+        return [self[i] for i in range(len(self))]
+
+
+class CategoryColumn(object):
+    """Strings stored as int32 'codes' into the list 'categories' (-1 for None)"""
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        return self.categories[code] if code >= 0 else None
+
+    def tolist(self):
+        return [self.categories[c] if c >= 0 else None for c in self.codes.tolist()]
+
+
+class ListColumn(object):
+    """Lists stored as int64 'offsets' (n+1) into a column of all list 'values'"""
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return [self.values[j] for j in range(self.offsets[i], self.offsets[i + 1])]
+
+    def tolist(self):
+        return [self[i] for i in range(len(self))]
+
+
+class ColumnarWriter(object):
+    """
+    Writes tweets to columnar 'path' (a directory for format "numpy", a file for
+    "parquet"), buffering 'chunk_size' tweets at a time. Use as a context manager, or
+    call close() when done (closing again does nothing).
+    """
+
+    def __init__(self, path, columns=DEFAULT_COLUMNS, format="numpy", chunk_size=50000):
+        if format not in ("numpy", "parquet"):
+            raise ValueError("Unknown columnar format '{0}'".format(format))
+        for name, kind, _ in columns:
+            if kind not in KINDS:
+                raise ValueError("Unknown kind '{0}' of column '{1}'".format(kind, name))
+        self.path = path
+        self.columns = list(columns)
+        self.format = format
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self._getters = [_getter(field) for _, _, field in self.columns]
+        self._buffer = [[] for _ in self.columns]
+        # Append-only dictionaries, so codes of written chunks stay valid
+        self._dictionaries = dict((name, {}) for name, kind, _ in self.columns
+                                  if kind in ("category", "category_list"))
+        self._files, self._parquet = {}, None
+        self.closed = False
+        if format == "numpy":
+            self._open_numpy()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, tweet):
+        if self.closed:
+            raise ValueError("Write to closed ColumnarWriter")
+        for values, get in zip(self._buffer, self._getters):
+            values.append(get(tweet))
+        if len(self._buffer[0]) >= self.chunk_size:
+            self.flush()
+
+    def write_all(self, tweets):
+        for tweet in tweets:
+            self.write(tweet)
+
+    def flush(self):
+        """Writes buffered tweets"""
+        if not self._buffer or not self._buffer[0]:
+            return
+        if self.format == "numpy":
+            self._flush_numpy()
+        else:
+            self._flush_parquet()
+        self.rows += len(self._buffer[0])
+        self._buffer = [[] for _ in self.columns]
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self.format == "numpy":
+            for handle, _ in self._files.values():
+                handle.close()
+            manifest = {
+                "rows": self.rows,
+                "columns": [[name, kind] for name, kind, _ in self.columns],
+                "categories": dict((name, sorted(d, key=d.get)) for name, d in self._dictionaries.items()),
+            }
+            temp = os.path.join(self.path, MANIFEST_FILE + ".tmp")
+            with open(temp, "w") as handle:
+                json.dump(manifest, handle)
+            os.rename(temp, os.path.join(self.path, MANIFEST_FILE))
+        else:
+            if self._parquet is None:
+                # No tweets: still write a file (with the schema)
+                self._flush_parquet()
+            self._parquet.close()
+        self._files, self._parquet = {}, None
+        self.closed = True
+
+    def _codes(self, name, values):
+        dictionary = self._dictionaries[name]
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            value = _as_unicode(value)
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+            codes.append(code)
+        return np.array(codes, dtype=np.int32)
+
+    def _open_numpy(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for name, kind, _ in self.columns:
+            parts = {"string": ["offsets", "data"], "category": ["codes"],
+                     "category_list": ["offsets", "codes"]}.get(kind, ["values"])
+            for part in parts:
+                # Offset files hold (running total, file) so chunks continue the offsets
+                handle = open(os.path.join(self.path, "{0}.{1}.bin".format(name, part)), "wb")
+                self._files[(name, part)] = [handle, 0]
+                if part == "offsets":
+                    np.zeros(1, dtype=np.int64).tofile(handle)
+
+    def _append(self, name, part, array):
+        entry = self._files[(name, part)]
+        array.tofile(entry[0])
+        entry[1] += len(array)
+
+    def _append_offsets(self, name, lengths):
+        """Appends offsets for lengths; base is the data written so far"""
+        data_part = "data" if (name, "data") in self._files else "codes"
+        base = self._files[(name, data_part)][1]
+        self._append(name, "offsets", base + np.cumsum(lengths, dtype=np.int64))
+
+    def _flush_numpy(self):
+        for (name, kind, _), values in zip(self.columns, self._buffer):
+            if kind == "int":
+                self._append(name, "values", np.array(
+                    [MISSING_INT if v is None else v for v in values], dtype=np.int64))
+            elif kind == "float":
+                self._append(name, "values", np.array(
+                    [np.nan if v is None else v for v in values], dtype=np.float64))
+            elif kind == "bool":
+                self._append(name, "values", np.array([bool(v) for v in values], dtype=np.bool_))
+            elif kind == "timestamp":
+                self._append(name, "values", np.array(
+                    [np.iinfo(np.int64).min if v is None else _timestamp_ms(v) for v in values],
+                    dtype=np.int64))
+            elif kind == "string":
+                encoded = [b"" if v is None else _as_unicode(v).encode("utf8") for v in values]
+                self._append_offsets(name, [len(e) for e in encoded])
+                self._append(name, "data", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            elif kind == "category":
+                self._append(name, "codes", self._codes(name, values))
+            elif kind == "category_list":
+                values = [v or [] for v in values]
+                self._append_offsets(name, [len(v) for v in values])
+                self._append(name, "codes", self._codes(name, [x for v in values for x in v]))
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        types = {"int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(),
+                 "timestamp": pa.timestamp("ms"), "string": pa.string(), "category": pa.string(),
+                 "category_list": pa.list_(pa.string())}
+        arrays = []
+        for (name, kind, _), values in zip(self.columns, self._buffer):
+            if kind in ("string", "category"):
+                values = [_as_unicode(v) for v in values]
+            elif kind == "category_list":
+                values = [[_as_unicode(x) for x in v] if v is not None else None for v in values]
+            arrays.append(pa.array(values, type=types[kind]))
+        batch = pa.Table.from_arrays(arrays, names=[name for name, _, _ in self.columns])
+        if self._parquet is None:
+            # Parquet dictionary encodes repeated strings on disk
+            dictionary_columns = [name for name, kind, _ in self.columns
+                                  if kind in ("category", "category_list")]
+            self._parquet = pq.ParquetWriter(self.path, batch.schema, use_dictionary=dictionary_columns)
+        self._parquet.write_table(batch)
+
+
+def _memmap(path, name, part, dtype, length):
+    filename = os.path.join(path, "{0}.{1}.bin".format(name, part))
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", shape=(length,))
+
+def read_columns(path, columns=None):
+    """
+    Reads columns (list of names, default all) of columnar tweets at 'path'. Returns a
+    pyarrow Table for a Parquet file, otherwise a dict of column name -> memory-mapped
+    numpy array (or String/Category/ListColumn, see module docstring).
+    """
+    if not os.path.isdir(path):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    with open(os.path.join(path, MANIFEST_FILE)) as handle:
+        manifest = json.load(handle)
+    rows, kinds = manifest["rows"], dict(manifest["columns"])
+    result = {}
+    for name in (columns or [name for name, _ in manifest["columns"]]):
+        if name not in kinds:
+            raise KeyError("No column '{0}' in {1}".format(name, path))
+        kind = kinds[name]
+        if kind in ("int", "float", "bool", "timestamp"):
+            dtype = {"int": np.int64, "float": np.float64, "bool": np.bool_, "timestamp": np.int64}[kind]
+            values = _memmap(path, name, "values", dtype, rows)
+            result[name] = values.view("datetime64[ms]") if kind == "timestamp" else values
+        elif kind == "string":
+            offsets = _memmap(path, name, "offsets", np.int64, rows + 1)
+            data = _memmap(path, name, "data", np.uint8, int(offsets[-1]))
+            result[name] = StringColumn(offsets, data)
+        elif kind == "category":
+            result[name] = CategoryColumn(_memmap(path, name, "codes", np.int32, rows),
+                                          manifest["categories"][name])
+        elif kind == "category_list":
+            offsets = _memmap(path, name, "offsets", np.int64, rows + 1)
+            codes = _memmap(path, name, "codes", np.int32, int(offsets[-1]))
+            result[name] = ListColumn(offsets, CategoryColumn(codes, manifest["categories"][name]))
+    return result
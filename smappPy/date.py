@@ -4,11 +4,116 @@ datetime.py contains datetime utilities and functionality for twitter and mongod
 Created by dpb on 8/21/2013
 """
 
+from datetime import datetime
 
 mongo_date_format = "%a %b %d %H:%M:%S +0000 %Y"
 
+MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+WEEKDAYS = frozenset(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+
+# Max number of date strings kept in each generation of the parse cache
+DATE_CACHE_SIZE = 4096
+_date_cache = {}
+_date_cache_old = {}
+
+
+def parse_twitter_date(date_str):
+    """
+    Parses a twitter/Mongo-format date string ("Wed Aug 27 13:08:45 +0000 2008") by
+    slicing its fixed-width fields. Returns a python datetime. Strings not exactly in that
+    layout (separators, zero-padded digit fields) are left to strptime with
+    mongo_date_format, which raises ValueError if they are malformed.
+    """
+    try:
+        if not (len(date_str) == 30 and date_str[19:26] == " +0000 " and
+                date_str[3] == date_str[7] == date_str[10] == " " and
+                date_str[13] == date_str[16] == ":" and date_str[:3] in WEEKDAYS and
+                (date_str[8:10] + date_str[11:13] + date_str[14:16] + date_str[17:19] +
+                 date_str[26:30]).isdigit()):
+            raise ValueError
+        return datetime(int(date_str[26:30]), MONTHS[date_str[4:7]], int(date_str[8:10]),
+            int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19]))
+    except (ValueError, KeyError, TypeError):
+        # Let strptime produce the standard error
+        return datetime.strptime(date_str, mongo_date_format)
+
 def mongodate_to_datetime(mongodate):
-    """Takes a Mongo/BSON-format date string, returns a corresponding python datetime object"""
-    from datetime import datetime
-    return datetime.strptime(mongodate, mongo_date_format)
+    """
+    Takes a Mongo/BSON-format date string, returns a corresponding python datetime object.
+    Results are cached: tweets arriving together share the same date strings. The cache
+    is bounded, approximately least-recently-used (two generations of DATE_CACHE_SIZE).
+    """
+    global _date_cache, _date_cache_old
+    parsed = _date_cache.get(mongodate)
+    if parsed is None:
+        parsed = _date_cache_old.get(mongodate)
+        if parsed is None:
+            parsed = parse_twitter_date(mongodate)
+        if len(_date_cache) >= DATE_CACHE_SIZE:
+            _date_cache_old, _date_cache = _date_cache, {}
+        _date_cache[mongodate] = parsed
+    return parsed
+
+def _name_key(name):
+    return ord(name[0]) * 65536 + ord(name[1]) * 256 + ord(name[2])
+
+_MONTH_NAMES = sorted(MONTHS, key=_name_key)
+_DIGIT_COLUMNS = [8, 9, 11, 12, 14, 15, 17, 18, 26, 27, 28, 29]
+# Column -> separator character, for columns between fields
+_SEPARATOR_COLUMNS = [(3, " "), (7, " "), (10, " "), (13, ":"), (16, ":"), (19, " "), (25, " ")]
+
+def _is_name(name_keys, chars, column):
+    """Returns tuple (boolean array, position in sorted name_keys) of 3-letter names at column"""
+    import numpy as np
+    keys = chars[:, column] * 65536 + chars[:, column + 1] * 256 + chars[:, column + 2]
+    pos = np.minimum(np.searchsorted(name_keys, keys), len(name_keys) - 1)
+    return name_keys[pos] == keys, pos
+
+def mongodates_to_datetime64(mongodates):
+    """
+    Vectorized parse of a sequence of Mongo/BSON-format date strings. Returns numpy
+    datetime64[s] array. Raises ValueError if any string is malformed (including days
+    past the end of the month).
+    """
+    import numpy as np
+    month_keys = np.array([_name_key(m) for m in _MONTH_NAMES])
+    month_numbers = np.array([MONTHS[m] for m in _MONTH_NAMES])
+    weekday_keys = np.array(sorted(_name_key(d) for d in WEEKDAYS))
+
+    # One extra byte, to catch strings longer than 30 characters
+    raw = np.asarray([d.encode("ascii") if isinstance(d, unicode) else d for d in mongodates],
+        dtype="S31")
+    chars = raw.view(np.uint8).reshape(len(raw), 31).astype(np.int64)
+    digits = chars - ord("0")
+
+    is_month, pos = _is_name(month_keys, chars, 4)
+    is_weekday, _ = _is_name(weekday_keys, chars, 0)
+    valid = (is_month & is_weekday &
+             ((digits[:, _DIGIT_COLUMNS] >= 0) & (digits[:, _DIGIT_COLUMNS] <= 9)).all(axis=1) &
+             (chars[:, 20:25] == [ord(c) for c in "+0000"]).all(axis=1) &
+             (chars[:, [c for c, _ in _SEPARATOR_COLUMNS]] ==
+                [ord(s) for _, s in _SEPARATOR_COLUMNS]).all(axis=1) &
+             (chars[:, 30] == 0))
+    if not valid.all():
+        raise ValueError("Malformed date string: '{0}'".format(raw[~valid][0]))
+
+    def number(start, stop):
+        value = np.zeros(len(raw), dtype=np.int64)
+        for i in range(start, stop):
+            value = value * 10 + digits[:, i]
+        return value
 
+    months = ((number(26, 30) - 1970).astype("datetime64[Y]") +
+              (month_numbers[pos] - 1).astype("timedelta64[M]"))
+    days = number(8, 10)
+    dates = months.astype("datetime64[D]") + (days - 1).astype("timedelta64[D]")
+    hours, minutes, seconds = number(11, 13), number(14, 16), number(17, 19)
+    valid = ((days >= 1) & (dates.astype("datetime64[M]") == months) &
+             (hours < 24) & (minutes < 60) & (seconds < 60))
+    if not valid.all():
+        raise ValueError("Malformed date string: '{0}'".format(raw[~valid][0]))
+    seconds = hours * 3600 + minutes * 60 + seconds
+    return dates.astype("datetime64[s]") + seconds.astype("timedelta64[s]")
@@ -0,0 +1,318 @@
+"""
+Compiles a declarative filter spec, an AND/OR tree of smappPy.tweet_filter predicates,
+into one callable taking a tweet and returning True/False.
+
+A spec is either a predicate, given as a list [function name, arg, ...] or a dict
+{"function": name, "args": [...], "kwargs": {...}}, or a combination {"and": [spec, ...]}
+or {"or": [spec, ...]}. Eg:
+
+    tweet_passes = compile_filter({"or": [
+        ["user_location_contains", "kiev", "kyiv"],
+        ["place_name_contains", "Kiev"],
+        {"and": [["within_geobox", 30.2, 50.2, 30.8, 50.6], ["field_contains", "text", "maidan"]]},
+    ]})
+    tweets = (t for t in stream if tweet_passes(t))
+
+Compared to calling the tweet_filter functions, compiled filters split field paths and
+lowercase terms once, match all terms OR-ed on the same field with one matcher, and
+evaluate cheap predicates (eg: geoboxes) before expensive ones, short-circuiting.
+Unlike the tweet_filter functions, a missing or null field never matches (rather than
+raising an error).
+
+For stored collections, mongo_query translates a spec into a Mongo query (case-
+insensitive $regex for contains, $geoWithin $box for geoboxes) plus a residual Python
+check for the parts the query can only approximate, and find_matching runs both:
+
+    for tweet in find_matching(db.tweets, spec, fields=["id_str", "text"]):
+        ...
+
+The geobox translation queries 'coordinates.coordinates' (a [lon, lat] pair), which
+can use a "2d" index on that field; contains translations can use indexes only for
+case-sensitive, single-term prefix matches, but still filter server-side.
+"""
+
+import re
+from smappPy import tweet_filter
+from smappPy.keyword_matcher import KeywordMatcher
+from smappPy.collection_util import tweet_cursor
+
+# Term lists at least this long are matched with a KeywordMatcher rather than a regex
+KEYWORD_MATCHER_TERMS = 128
+
+# Relative per-tweet cost of predicates, for ordering
+GEOBOX_COST = 1
+CONTAINS_COST = 2
+CALL_COST = 10
+
+
+def _parse(spec):
+    """Returns node tree ("and"/"or", children) / (predicate, ...) of a filter spec"""
+    if isinstance(spec, dict) and len(spec) == 1 and list(spec)[0] in ("and", "or"):
+        op = list(spec)[0]
+        return (op, [_parse(s) for s in spec[op]])
+    if isinstance(spec, dict) and "function" in spec:
+        return _predicate(spec["function"], list(spec.get("args", [])), dict(spec.get("kwargs", {})))
+    if isinstance(spec, (list, tuple)) and spec and isinstance(spec[0], basestring):
+        return _predicate(spec[0], list(spec[1:]), {})
+    raise ValueError("Malformed filter spec: {0}".format(spec))
+
+def _predicate(name, args, kwargs):
+    """Returns node for a tweet_filter predicate (without the tweet argument)"""
+    if any(isinstance(a, KeywordMatcher) for a in args):
+        # Prebuilt matcher given as term: nothing to compile
+        return ("call", getattr(tweet_filter, name), args, kwargs)
+    if name == "field_contains":
+        return ("contains", args[0], args[1:], kwargs.get("case_sensitive", False))
+    elif name == "field_contains_case_sensitive":
+        return ("contains_case_sensitive", args[0], args[1:])
+    elif name == "user_location_contains":
+        return ("contains", "user.location", args, False)
+    elif name == "user_description_contains":
+        return ("contains", "user.description", args, False)
+    elif name == "place_name_contains":
+        return ("or", [("contains", "place.full_name", args, False),
+                       ("contains", "place.country", args, False)])
+    elif name == "within_geobox":
+        return ("geobox", tuple(float(b) for b in args))
+    elif callable(getattr(tweet_filter, name, None)) and not name.startswith("_"):
+        return ("call", getattr(tweet_filter, name), args, kwargs)
+    raise ValueError("Unknown filter function '{0}'".format(name))
+
+def _as_unicode(term):
+    return term.decode("utf8") if isinstance(term, str) else term
+
+
+def _optimize(node):
+    """
+    Flattens nested and/or nodes, merges contains predicates OR-ed on the same field,
+    and orders children cheapest first. Returns (cost, node).
+    """
+    if node[0] not in ("and", "or"):
+        cost = {"geobox": GEOBOX_COST, "contains": CONTAINS_COST,
+                "contains_case_sensitive": 2 * CONTAINS_COST}.get(node[0], CALL_COST)
+        return cost, node
+
+    op, children = node[0], []
+    for cost, child in (_optimize(c) for c in node[1]):
+        if child[0] == op:
+            children.extend(child[1])
+        else:
+            children.append((cost, child))
+
+    if op == "or":
+        merged, order = {}, []
+        for cost, child in children:
+            if child[0] == "contains":
+                key = (child[1], child[3])
+                if key not in merged:
+                    merged[key] = ("contains", child[1], [], child[3])
+                    order.append((CONTAINS_COST, merged[key]))
+                terms = merged[key][2]
+                terms.extend(t for t in child[2] if t not in terms)
+            else:
+                order.append((cost, child))
+        children = order
+
+    children.sort(key=lambda c: c[0])
+    if len(children) == 1:
+        return children[0]
+    return sum(c[0] for c in children), (op, children)
+
+
+def _field_getter(field):
+    """Returns function of a tweet returning value at dotted 'field', or None"""
+    path = field.split(".")
+    if len(path) == 1:
+        key = path[0]
+        def get(tweet):
+            return tweet.get(key)
+    elif len(path) == 2:
+        key0, key1 = path
+        def get(tweet):
+            value = tweet.get(key0)
+            return value.get(key1) if isinstance(value, dict) else None
+    else:
+        def get(tweet):
+            value = tweet
+            for key in path:
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(key)
+            return value
+    return get
+
+def term_matcher(terms, case_sensitive=False):
+    """
+    Returns function of a string returning True if it contains any of 'terms'. Unless
+    case_sensitive, the string must already be lowercase.
+    """
+    terms = [_as_unicode(t) if case_sensitive else _as_unicode(t).lower() for t in terms]
+    if len(terms) == 1:
+        term = terms[0]
+        return lambda value: term in value
+    if len(terms) >= KEYWORD_MATCHER_TERMS:
+        return KeywordMatcher(terms, case_sensitive=True).search
+    search = re.compile(u"|".join(re.escape(t) for t in terms), re.UNICODE).search
+    return lambda value: search(value) is not None
+
+def _build(node):
+    """Returns callable of a tweet for an optimized node"""
+    kind = node[0]
+    if kind == "and":
+        predicates = [_build(c) for _, c in node[1]]
+        def passes(tweet):
+            for predicate in predicates:
+                if not predicate(tweet):
+                    return False
+            return True
+        return passes
+    elif kind == "or":
+        predicates = [_build(c) for _, c in node[1]]
+        def passes(tweet):
+            for predicate in predicates:
+                if predicate(tweet):
+                    return True
+            return False
+        return passes
+    elif kind == "contains":
+        get, case_sensitive = _field_getter(node[1]), node[3]
+        matches = term_matcher(node[2], case_sensitive)
+        def passes(tweet):
+            value = get(tweet)
+            if not isinstance(value, basestring):
+                return False
+            return matches(value if case_sensitive else value.lower())
+        return passes
+    elif kind == "contains_case_sensitive":
+        # As tweet_filter.field_contains_case_sensitive: False only if terms match
+        # ignoring case, but not with case
+        get = _field_getter(node[1])
+        exact, folded = term_matcher(node[2], True), term_matcher(node[2], False)
+        def passes(tweet):
+            value = get(tweet)
+            if not isinstance(value, basestring):
+                return False
+            return exact(value) or not folded(value.lower())
+        return passes
+    elif kind == "geobox":
+        sw_lon, sw_lat, ne_lon, ne_lat = node[1]
+        def passes(tweet):
+            point = tweet.get("coordinates")
+            if not point or "coordinates" not in point:
+                return False
+            lon, lat = point["coordinates"]
+            return sw_lon < lon < ne_lon and sw_lat < lat < ne_lat
+        return passes
+    elif kind == "call":
+        function, args, kwargs = node[1:]
+        return lambda tweet: bool(function(tweet, *args, **kwargs))
+    raise ValueError("Unknown filter node '{0}'".format(kind))
+
+def compile_filter(spec):
+    """
+    Takes a filter spec (see module docstring). Returns function taking a tweet and
+    returning True if it passes the filter. An empty "and" passes every tweet, an
+    empty "or" none.
+    """
+    return _build(_optimize(_parse(spec))[1])
+
+
+_REGEX_SPECIAL = re.compile(r"([.^$*+?{}\[\]\\|()])")
+
+def _regex(terms, case_sensitive):
+    """Returns Mongo $regex query matching strings containing any of terms"""
+    query = {"$regex": u"|".join(_REGEX_SPECIAL.sub(r"\\\1", _as_unicode(t)) for t in terms)}
+    if not case_sensitive:
+        query["$options"] = "i"
+    return query
+
+def _is_ascii(term):
+    return all(ord(c) < 128 for c in _as_unicode(term))
+
+def _pushdown(node):
+    """
+    Returns (query, residual) for an optimized node: a Mongo query matching (at least)
+    the documents passing node, and the node documents matching the query still have
+    to pass, or None if the query is exact.
+    """
+    kind = node[0]
+    if kind == "contains":
+        # Mongo and python case folding only agree on ascii
+        exact = node[3] or all(_is_ascii(t) for t in node[2])
+        return {node[1]: _regex(node[2], node[3])}, None if exact else node
+    elif kind == "geobox":
+        # $box includes its edges, within_geobox does not
+        sw_lon, sw_lat, ne_lon, ne_lat = node[1]
+        return {"coordinates.coordinates": {"$geoWithin": {"$box": [[sw_lon, sw_lat], [ne_lon, ne_lat]]}}}, node
+    elif kind == "or" and not node[1]:
+        # Passes no document (Mongo rejects an empty $or)
+        return {"_id": {"$in": []}}, None
+    elif kind in ("and", "or"):
+        queries, residuals = [], []
+        for cost, child in node[1]:
+            query, residual = _pushdown(child)
+            queries.append(query)
+            if residual is not None:
+                residuals.append((cost, residual))
+        if kind == "and":
+            queries = [q for q in queries if q]
+            residual = None
+            if residuals:
+                residual = residuals[0][1] if len(residuals) == 1 else ("and", residuals)
+        else:
+            # Any inexact child can let through documents the other children reject
+            residual = node if residuals else None
+            if not all(queries):
+                queries = []
+        if not queries:
+            return {}, residual
+        return (queries[0] if len(queries) == 1 else {"$" + kind: queries}), residual
+    # Not translatable: match everything, check client-side
+    return {}, node
+
+def _node_fields(node):
+    """Returns set of (dotted) fields a node reads, or None if unknown"""
+    kind = node[0]
+    if kind in ("contains", "contains_case_sensitive"):
+        return set([node[1]])
+    elif kind == "geobox":
+        return set(["coordinates"])
+    elif kind in ("and", "or"):
+        fields = set()
+        for _, child in node[1]:
+            child_fields = _node_fields(child)
+            if child_fields is None:
+                return None
+            fields |= child_fields
+        return fields
+    return None
+
+def mongo_query(spec):
+    """
+    Takes a filter spec. Returns tuple (query, residual): a Mongo query selecting
+    documents that may pass the filter, and a function documents matching the query
+    must also pass (as compile_filter), or None if the query alone is exact.
+    """
+    query, residual = _pushdown(_optimize(_parse(spec))[1])
+    return query, residual and _build(residual)
+
+def find_matching(collection, spec, fields=None, **kwargs):
+    """
+    Yields documents of pymongo collection passing filter spec, filtering server-side
+    as far as possible (see mongo_query). 'fields' (list of dotted fields, default all)
+    is extended with the fields the residual check needs. Other keyword arguments are
+    passed to collection_util.tweet_cursor.
+    """
+    query, residual_node = _pushdown(_optimize(_parse(spec))[1])
+    if fields is not None and residual_node is not None:
+        residual_fields = _node_fields(residual_node)
+        fields = None if residual_fields is None else list(set(fields) | residual_fields)
+    cursor = tweet_cursor(collection, query, fields=fields, **kwargs)
+    if residual_node is None:
+        for doc in cursor:
+            yield doc
+    else:
+        passes = _build(residual_node)
+        for doc in cursor:
+            if passes(doc):
+                yield doc
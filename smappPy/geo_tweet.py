@@ -97,6 +97,8 @@ def get_tweet_region(tweet, regions=ContinentsGeoBoxes):
     if not is_geocoded(tweet):
         return -1
     lon, lat = get_coordinates(tweet)
+    if isinstance(regions, GeoBoxSet):
+        return regions.region(lon, lat)
     for i in range(len(regions)):
         box = check_geobox(regions[i])
         if lon > box[0] and lon < box[2] and lat > box[1] and lat < box[3]:
@@ -121,7 +123,259 @@ def check_geobox(box):
     return box
 
 
+class GeoBoxSet(object):
+    """
+    An ordered set of geoboxes (as for get_tweet_region), validated once and held as
+    numpy arrays, for classifying many coordinates at a time. Eg:
+
+        boxes = GeoBoxSet(ContinentsGeoBoxes)
+        lons, lats = get_coordinate_arrays(tweets)
+        regions = boxes.classify(lons, lats)
+    """
+
+    def __init__(self, boxes):
+        import numpy as np
+        boxes = [check_geobox(box) for box in boxes]
+        self.boxes = np.array(boxes, dtype=np.float64).reshape(len(boxes), 4)
+        self.sw_lon, self.sw_lat, self.ne_lon, self.ne_lat = [self.boxes[:, i].copy() for i in range(4)]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def region(self, lon, lat):
+        """Returns index of the first box containing (lon, lat), or -1"""
+        for i, (sw_lon, sw_lat, ne_lon, ne_lat) in enumerate(self.boxes.tolist()):
+            if lon > sw_lon and lon < ne_lon and lat > sw_lat and lat < ne_lat:
+                return i
+        return -1
+
+    def classify(self, lons, lats, chunk_size=100000):
+        """
+        Takes equal-length arrays of longitudes and latitudes. Returns int array of the
+        index of the first box containing each point, or -1 (also for NaN coordinates).
+        Points are classified 'chunk_size' at a time, to bound memory use.
+        """
+        import numpy as np
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        if lons.shape != lats.shape:
+            raise ValueError("Longitude and latitude arrays differ in shape")
+        result = np.empty(len(lons), dtype=np.int64)
+        for start in range(0, len(lons), chunk_size):
+            lon = lons[start:start + chunk_size, np.newaxis]
+            lat = lats[start:start + chunk_size, np.newaxis]
+            inside = (lon > self.sw_lon) & (lon < self.ne_lon) & (lat > self.sw_lat) & (lat < self.ne_lat)
+            first = inside.argmax(axis=1) if len(self) else np.zeros(len(lon), dtype=np.int64)
+            first[~inside.any(axis=1)] = -1
+            result[start:start + chunk_size] = first
+        return result
+
+
+def _polygon_rings(polygon):
+    """
+    Returns list of rings (lists of [lon, lat] points) of a polygon given as a ring, a
+    list of rings, or a GeoJSON Polygon / MultiPolygon geometry dict
+    """
+    import numpy as np
+    if isinstance(polygon, dict):
+        if polygon.get("type") == "Polygon":
+            return polygon["coordinates"]
+        elif polygon.get("type") == "MultiPolygon":
+            return [ring for part in polygon["coordinates"] for ring in part]
+        raise GeoboxException("Unsupported geometry type '{0}'".format(polygon.get("type")))
+    if len(polygon) and np.ndim(polygon[0]) == 1:
+        return [polygon]
+    return polygon
+
+def _polygon_edges(polygon):
+    """Returns (num_edges, 4) array of edges (lon1, lat1, lon2, lat2) of polygon's rings"""
+    import numpy as np
+    edges = []
+    for ring in _polygon_rings(polygon):
+        ring = np.asarray(ring, dtype=np.float64)[:, :2]
+        if len(ring) < 3:
+            raise GeoboxException("Polygon ring has fewer than 3 points")
+        edges.append(np.hstack([ring, np.roll(ring, -1, axis=0)]))
+    return np.vstack(edges) if edges else np.empty((0, 4))
+
+def _points_in_edges(lons, lats, edges, max_pairs=4000000):
+    """Even-odd rule point in polygon test of points against a polygon's edges"""
+    import numpy as np
+    inside = np.zeros(len(lons), dtype=bool)
+    chunk = max(1, max_pairs // max(1, len(edges)))
+    x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, len(lons), chunk):
+            x = lons[start:start + chunk, np.newaxis]
+            y = lats[start:start + chunk, np.newaxis]
+            crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+            inside[start:start + chunk] = crosses.sum(axis=1) % 2 == 1
+    return inside
+
+
+class GeoIndex(GeoBoxSet):
+    """
+    Uniform-grid spatial index over a large ordered set of regions (eg: thousands of
+    counties), for classifying points to the first region containing them, as
+    GeoBoxSet does, without testing every region. Each region is a geobox, optionally
+    refined by a polygon: a ring of [lon, lat] points, a list of rings (even-odd rule,
+    so holes and multiple parts work), or a GeoJSON Polygon/MultiPolygon geometry.
 
+        index = GeoIndex(polygons=[county["geometry"] for county in counties])
+        index.save("counties.npz")
+        ...
+        index = GeoIndex.load("counties.npz")
+        regions = index.classify(lons, lats)
 
+    Each point is only tested against the regions overlapping its grid cell.
+    'grid_size' is the number of cells per side (default scales with number of regions).
+    """
+
+    def __init__(self, boxes=None, polygons=None, grid_size=None):
+        import numpy as np
+        if boxes is None and polygons is None:
+            raise GeoboxException("GeoIndex needs boxes and/or polygons")
+        edges = [_polygon_edges(p) if p is not None else np.empty((0, 4)) for p in (polygons or [])]
+        if boxes is None:
+            boxes = [[e[:, 0].min(), e[:, 1].min(), e[:, 0].max(), e[:, 1].max()] if len(e) else []
+                     for e in edges]
+        if polygons is not None and len(polygons) != len(boxes):
+            raise GeoboxException("Different number of boxes and polygons")
+        super(GeoIndex, self).__init__(boxes)
+
+        edges = edges or [np.empty((0, 4))] * len(self)
+        self.edge_offsets = np.cumsum([0] + [len(e) for e in edges])
+        self.edges = np.vstack(edges) if len(self) else np.empty((0, 4))
+        if grid_size is None:
+            grid_size = min(1024, max(1, int(2 * np.sqrt(len(self)))))
+        self._build_grid(grid_size)
+
+    def _build_grid(self, grid_size):
+        """Builds CSR-style lists of region indices (in order) overlapping each cell"""
+        import numpy as np
+        self.grid_size = grid_size
+        if len(self):
+            self.extent = np.array([self.sw_lon.min(), self.sw_lat.min(),
+                                    self.ne_lon.max(), self.ne_lat.max()])
+        else:
+            self.extent = np.array([0.0, 0.0, 1.0, 1.0])
+        col0, row0 = self._cell_coords(self.sw_lon, self.sw_lat)
+        col1, row1 = self._cell_coords(self.ne_lon, self.ne_lat)
+
+        cells, regions = [], []
+        for i in range(len(self)):
+            cols, rows = np.meshgrid(np.arange(col0[i], col1[i] + 1), np.arange(row0[i], row1[i] + 1))
+            cells.append((rows * grid_size + cols).ravel())
+            regions.append(np.repeat(i, cells[-1].size))
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        regions = np.concatenate(regions) if regions else np.empty(0, dtype=np.int64)
+        # Stable sort keeps regions in first-match order within each cell
+        order = np.argsort(cells, kind="mergesort")
+        self.cell_regions = regions[order]
+        self.cell_offsets = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=grid_size ** 2))])
+
+    def _cell_coords(self, lons, lats):
+        """Returns (column, row) grid cell coordinates, clipped to the grid"""
+        import numpy as np
+        min_lon, min_lat, max_lon, max_lat = self.extent
+        cols = np.floor((lons - min_lon) / (max_lon - min_lon) * self.grid_size)
+        rows = np.floor((lats - min_lat) / (max_lat - min_lat) * self.grid_size)
+        return (np.clip(cols, 0, self.grid_size - 1).astype(np.int64),
+                np.clip(rows, 0, self.grid_size - 1).astype(np.int64))
+
+    def region(self, lon, lat):
+        """Returns index of the first region containing (lon, lat), or -1"""
+        return int(self.classify([lon], [lat])[0])
+
+    def classify(self, lons, lats):
+        """
+        Takes equal-length arrays of longitudes and latitudes. Returns int array of the
+        index of the first region containing each point, or -1 (also for NaN coordinates).
+        """
+        import numpy as np
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        if lons.shape != lats.shape:
+            raise ValueError("Longitude and latitude arrays differ in shape")
+        result = np.full(len(lons), -1, dtype=np.int64)
+        min_lon, min_lat, max_lon, max_lat = self.extent
+        points = np.nonzero((lons > min_lon) & (lons < max_lon) & (lats > min_lat) & (lats < max_lat))[0]
+        cols, rows = self._cell_coords(lons[points], lats[points])
+        cells = rows * self.grid_size + cols
+        first, last = self.cell_offsets[cells], self.cell_offsets[cells + 1]
+
+        # k-th candidate region of every point still unmatched, until candidates run out
+        k = 0
+        while len(points):
+            pending = first + k < last
+            points, first, last = points[pending], first[pending], last[pending]
+            candidates = self.cell_regions[first + k]
+            lon, lat = lons[points], lats[points]
+            hit = ((lon > self.sw_lon[candidates]) & (lon < self.ne_lon[candidates]) &
+                   (lat > self.sw_lat[candidates]) & (lat < self.ne_lat[candidates]))
+            refine = hit & (self.edge_offsets[candidates + 1] > self.edge_offsets[candidates])
+            if refine.any():
+                hit[refine] = self._in_polygons(lon[refine], lat[refine], candidates[refine])
+            result[points[hit]] = candidates[hit]
+            points, first, last = points[~hit], first[~hit], last[~hit]
+            k += 1
+        return result
 
+    def _in_polygons(self, lons, lats, regions):
+        """Point in polygon test of each point against the polygon of its region"""
+        import numpy as np
+        inside = np.zeros(len(lons), dtype=bool)
+        order = np.argsort(regions, kind="mergesort")
+        bounds = np.nonzero(np.diff(regions[order]))[0] + 1
+        for group in np.split(order, bounds):
+            region = regions[group[0]]
+            edges = self.edges[self.edge_offsets[region]:self.edge_offsets[region + 1]]
+            inside[group] = _points_in_edges(lons[group], lats[group], edges)
+        return inside
 
+    def save(self, path):
+        """Saves index to numpy .npz file 'path', to be loaded with GeoIndex.load"""
+        import numpy as np
+        np.savez(path, boxes=self.boxes, edges=self.edges, edge_offsets=self.edge_offsets,
+                 extent=self.extent, cell_regions=self.cell_regions, cell_offsets=self.cell_offsets,
+                 grid_size=self.grid_size)
+
+    @classmethod
+    def load(cls, path):
+        """Loads index saved with save(), without revalidating or regridding regions"""
+        import numpy as np
+        data = np.load(path)
+        index = cls.__new__(cls)
+        index.boxes = data["boxes"]
+        index.sw_lon, index.sw_lat, index.ne_lon, index.ne_lat = [index.boxes[:, i].copy() for i in range(4)]
+        for name in ["edges", "edge_offsets", "extent", "cell_regions", "cell_offsets"]:
+            setattr(index, name, data[name])
+        index.grid_size = int(data["grid_size"])
+        return index
+
+
+def get_coordinate_arrays(tweets):
+    """
+    Takes an iterable of tweets. Returns tuple of float arrays (longitudes, latitudes),
+    with coordinates as from get_coordinates, NaN for tweets that are not geocoded.
+    """
+    import numpy as np
+    lons, lats = [], []
+    for tweet in tweets:
+        point = tweet.get("coordinates") or tweet.get("geo")
+        if point:
+            lon, lat = point["coordinates"]
+        else:
+            lon = lat = np.nan
+        lons.append(lon)
+        lats.append(lat)
+    return np.array(lons, dtype=np.float64), np.array(lats, dtype=np.float64)
+
+def get_tweet_regions(tweets, regions=ContinentsGeoBoxes):
+    """
+    Batch get_tweet_region: takes an iterable of tweets and a list of geoboxes (or a
+    GeoBoxSet or GeoIndex). Returns int array of the first-matching region index per tweet, or -1.
+    """
+    if not isinstance(regions, GeoBoxSet):
+        regions = GeoBoxSet(regions)
+    return regions.classify(*get_coordinate_arrays(tweets))
@@ -11,9 +11,7 @@ def it_to_csv(it_of_its, outfile, mode="w"):
     Can set 'mode' for appending ("a"). Default: write ("w")
     """
     with open(outfile, mode) as handle:
-        writer = UnicodeWriter(handle)
-        for row in it_of_its:
-            writer.writerow(list(row))
+        UnicodeWriter(handle).writerows(it_of_its)
 
 def get_ngrams(input_list, n):
     """
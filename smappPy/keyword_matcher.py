@@ -0,0 +1,124 @@
+"""
+Multi-keyword matching for large tracking lists (thousands of keywords and handles).
+
+KeywordMatcher builds an Aho-Corasick automaton from a term list once; matching a text
+then costs time proportional to the text length (plus matches), however many terms
+there are. Eg:
+
+    matcher = KeywordMatcher(["ukraine", "#euromaidan", "@kyivpost"], word_boundaries=True)
+    matcher.search(tweet["text"])       # True if any term occurs
+    matcher.matches(tweet["text"])      # terms that occur, eg: for tagging tweets
+
+A matcher can be passed as the only term to tweet_filter.field_contains (and the
+functions built on it), and is used by filter_compiler for long term lists.
+"""
+
+import re
+
+# Characters that are part of a word, for word boundaries (as regex \w)
+_WORD_CHAR = re.compile(r"\w", re.UNICODE)
+
+
+def _is_word_char(c):
+    return _WORD_CHAR.match(c) is not None
+
+
+class KeywordMatcher(object):
+    """
+    Aho-Corasick matcher for 'terms' (strings, utf8 byte strings are decoded). Unless
+    case_sensitive, terms and texts are compared lowercased. With word_boundaries, a
+    term only matches where it is not part of a longer word (as regex \\bterm\\b).
+    """
+
+    def __init__(self, terms, case_sensitive=False, word_boundaries=False):
+        self.terms = []
+        self.case_sensitive = case_sensitive
+        self.word_boundaries = word_boundaries
+
+        # State 0 is the root. goto: char -> next state, out: indices of terms ending here
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        seen = set()
+        for term in terms:
+            if isinstance(term, str):
+                term = term.decode("utf8")
+            key = self._fold(term)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            self._add(key, len(self.terms))
+            self.terms.append(term)
+        self._lengths = [len(self._fold(t)) for t in self.terms]
+        self._edges = [(_is_word_char(t[0]), _is_word_char(t[-1])) for t in self.terms]
+        self._link()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _fold(self, text):
+        return text if self.case_sensitive else text.lower()
+
+    def _add(self, key, index):
+        state = 0
+        for c in key:
+            if c not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][c] = len(self._goto) - 1
+            state = self._goto[state][c]
+        self._out[state] = (index,)
+
+    def _link(self):
+        """Sets failure links breadth-first, merging outputs of failure states"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for c, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and c not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(c, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _bounded(self, text, index, end):
+        """True if term 'index' ending at 'end' (exclusive) in text is delimited"""
+        start = end - self._lengths[index]
+        first_word, last_word = self._edges[index]
+        if first_word and start > 0 and _is_word_char(text[start - 1]):
+            return False
+        if last_word and end < len(text) and _is_word_char(text[end]):
+            return False
+        return True
+
+    def finditer(self, text):
+        """Yields (start, end, term) of each term occurrence in text, by end position"""
+        if isinstance(text, str):
+            text = text.decode("utf8")
+        text = self._fold(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for index in out[state]:
+                if not self.word_boundaries or self._bounded(text, index, i + 1):
+                    yield i + 1 - self._lengths[index], i + 1, self.terms[index]
+
+    def search(self, text):
+        """True if any term occurs in text"""
+        for _ in self.finditer(text):
+            return True
+        return False
+
+    def matches(self, text):
+        """Returns list of distinct terms occurring in text, in order of (end) position"""
+        found, seen = [], set()
+        for _, _, term in self.finditer(text):
+            if term not in seen:
+                seen.add(term)
+                found.append(term)
+        return found
@@ -0,0 +1,272 @@
+"""
+Compact adjacency storage for friend/follower networks.
+
+Instead of one Mongo document per edge ({from, to, timestamp} plus a compound unique
+index, ~150 bytes/edge), keeps documents per crawled user and direction, holding the
+user's sorted neighbor IDs as compressed blobs:
+
+    {"id": <user id>, "dir": "out"|"in", "chunk": <index>, "n": <num neighbors in chunk>,
+     "neighbors": <Binary blob>, "updated_timestamp": <datetime>}
+
+Chunk i holds the i-th run of CHUNK_SIZE sorted IDs (most users have a single chunk),
+so users with tens of millions of followers stay under Mongo's 16MB document limit.
+"out" neighbors are users the user follows (friends), "in" neighbors are its followers.
+Blobs are delta-encoded (sorted IDs -> gaps), byte-shuffled (all lowest bytes of the
+gaps, then all second bytes, etc. - high bytes of small gaps are all zero), and zlib
+compressed. Reading a neighborhood is one query and a vectorized decode per chunk.
+
+Whole networks can be exported to networkx, to a scipy.sparse CSR matrix, or to an
+on-disk CSR file (numpy .npz, loadable with memory-mapping).
+"""
+
+import zlib
+import logging
+import numpy as np
+from itertools import groupby
+from datetime import datetime
+from bson.binary import Binary
+from pymongo import ASCENDING, UpdateOne, DeleteMany
+
+logger = logging.getLogger(__name__)
+
+OUT = "out"
+IN = "in"
+ID_DTYPE = np.dtype("<u8")
+# IDs per document: at most 8MB before compression (and zlib barely expands the rest)
+CHUNK_SIZE = 1 << 20
+
+
+def encode_neighbors(ids):
+    """
+    Takes an iterable of (non-negative, int) user IDs. Returns compressed blob of the
+    sorted, de-duplicated IDs.
+    """
+    ids = np.unique(np.asarray(list(ids) if not isinstance(ids, np.ndarray) else ids,
+        dtype=ID_DTYPE))
+    gaps = np.empty_like(ids)
+    if len(ids):
+        gaps[0] = ids[0]
+        gaps[1:] = ids[1:] - ids[:-1]
+    shuffled = gaps.view(np.uint8).reshape(-1, ID_DTYPE.itemsize).T
+    return zlib.compress(shuffled.tobytes(), 6)
+
+def decode_neighbors(blob):
+    """Inverse of encode_neighbors. Returns sorted numpy uint64 array of IDs"""
+    raw = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    gaps = raw.reshape(ID_DTYPE.itemsize, -1).T.copy().view(ID_DTYPE).ravel()
+    return np.cumsum(gaps, dtype=ID_DTYPE)
+
+def _decode_chunks(docs):
+    """Returns sorted uint64 array of IDs in a user's chunk docs (in chunk order)"""
+    if not docs:
+        return np.empty(0, dtype=ID_DTYPE)
+    return np.concatenate([decode_neighbors(d["neighbors"]) for d in docs])
+
+
+class AdjacencyStore(object):
+    """
+    Mongo-backed compact adjacency store (see module docstring). Takes a fully
+    authenticated (read/write) pymongo collection, and the number of IDs per document.
+    """
+
+    def __init__(self, collection, ensure_indexes=True, chunk_size=CHUNK_SIZE):
+        self.collection = collection
+        self.chunk_size = chunk_size
+        if ensure_indexes:
+            self.ensure_indexes()
+
+    def ensure_indexes(self):
+        self.collection.ensure_index([("id", ASCENDING), ("dir", ASCENDING), ("chunk", ASCENDING)],
+            name="compound_unique", unique=True, background=True)
+
+    def neighbors(self, user_id, direction=OUT):
+        """Returns sorted uint64 array of user's neighbor IDs in direction (empty if none)"""
+        return _decode_chunks(list(self.collection.find({"id": user_id, "dir": direction},
+            projection={"neighbors": True}, sort=[("chunk", ASCENDING)])))
+
+    def add_neighbors(self, user_id, neighbor_ids, direction=OUT):
+        """
+        Merges given neighbor IDs into user's stored neighbors (re-crawls only add).
+        Returns number of neighbors stored for user.
+        """
+        return self.add_many({user_id: neighbor_ids}, direction)[user_id]
+
+    def add_many(self, neighbors_by_user, direction=OUT):
+        """
+        Merges a dict of user ID -> iterable of neighbor IDs into the store, with one read
+        and one bulk write for all users. Returns dict of user ID -> number of neighbors.
+        """
+        user_ids = list(neighbors_by_user.keys())
+        existing = dict((user_id, list(docs)) for user_id, docs in groupby(self.collection.find(
+            {"id": {"$in": user_ids}, "dir": direction}, projection={"id": True, "neighbors": True},
+            sort=[("id", ASCENDING), ("chunk", ASCENDING)]), lambda d: d["id"]))
+
+        counts, ops = {}, []
+        now = datetime.now()
+        for user_id in user_ids:
+            new_ids = np.unique(np.asarray(list(neighbors_by_user[user_id]), dtype=ID_DTYPE))
+            if user_id in existing:
+                new_ids = np.union1d(_decode_chunks(existing[user_id]), new_ids)
+            counts[user_id] = len(new_ids)
+            num_chunks = max(1, -(-len(new_ids) // self.chunk_size))
+            for chunk in range(num_chunks):
+                ids = new_ids[chunk * self.chunk_size:(chunk + 1) * self.chunk_size]
+                ops.append(UpdateOne({"id": user_id, "dir": direction, "chunk": chunk},
+                    {"$set": {"n": len(ids), "neighbors": Binary(encode_neighbors(ids)),
+                              "updated_timestamp": now}}, upsert=True))
+            if len(existing.get(user_id, [])) > num_chunks:
+                # Stored with a smaller chunk_size
+                ops.append(DeleteMany({"id": user_id, "dir": direction, "chunk": {"$gte": num_chunks}}))
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+        return counts
+
+    def add_edge_docs(self, edges, batch_size=10000):
+        """
+        Imports an iterable of edge docs ({"from": ID, "to": ID}, eg: an existing edge
+        collection cursor) as "out" adjacency of each 'from' user.
+        """
+        batch = {}
+        for i, edge in enumerate(edges):
+            batch.setdefault(edge["from"], []).append(edge["to"])
+            if (i + 1) % batch_size == 0:
+                self.add_many(batch, OUT)
+                batch = {}
+        if batch:
+            self.add_many(batch, OUT)
+
+    def iter_adjacency(self, direction=None):
+        """
+        Iterates over stored neighborhoods, yielding tuples (user ID, direction, sorted uint64
+        array of neighbor IDs). If direction is given, only that direction is read.
+        """
+        query = {"dir": direction} if direction else {}
+        docs = self.collection.find(query, projection={"id": True, "dir": True, "neighbors": True},
+            sort=[("id", ASCENDING), ("dir", ASCENDING), ("chunk", ASCENDING)])
+        for (user_id, user_direction), chunks in groupby(docs, lambda d: (d["id"], d["dir"])):
+            yield user_id, user_direction, _decode_chunks(list(chunks))
+
+    def user_ids(self, direction=None):
+        """Returns sorted int64 array of IDs of users with stored neighbors (in direction)"""
+        query = {"dir": direction} if direction else {}
+        return np.unique(np.fromiter((d["id"] for d in self.collection.find(query,
+            projection={"_id": False, "id": True})), dtype=np.int64))
+
+    def iter_edges(self):
+        """
+        Yields (from, to) tuples for all stored edges. An edge recorded from both its
+        endpoints (eg: A's friends and B's followers) is yielded twice; networkx and
+        scipy exports below de-duplicate.
+        """
+        for user_id, direction, neighbors in self.iter_adjacency():
+            if direction == OUT:
+                for n in neighbors:
+                    yield user_id, int(n)
+            else:
+                for n in neighbors:
+                    yield int(n), user_id
+
+    def to_scipy(self, node_ids=None):
+        """
+        Returns tuple (scipy.sparse csr_matrix A, node ID array), where A[i, j] = 1 if
+        node_ids[i] -> node_ids[j]. If node_ids (sorted array) is given, edges with an
+        endpoint not in it are dropped; otherwise all IDs in the store are nodes.
+        """
+        from scipy.sparse import coo_matrix
+        sources, targets = [], []
+        for user_id, direction, neighbors in self.iter_adjacency():
+            user_col = np.full(len(neighbors), user_id, dtype=ID_DTYPE)
+            if direction == OUT:
+                sources.append(user_col)
+                targets.append(neighbors)
+            else:
+                sources.append(neighbors)
+                targets.append(user_col)
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=ID_DTYPE)
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=ID_DTYPE)
+
+        if node_ids is None:
+            node_ids = np.union1d(sources, targets)
+        else:
+            node_ids = np.asarray(node_ids, dtype=ID_DTYPE)
+            keep = np.in1d(sources, node_ids) & np.in1d(targets, node_ids)
+            sources, targets = sources[keep], targets[keep]
+
+        rows = np.searchsorted(node_ids, sources)
+        cols = np.searchsorted(node_ids, targets)
+        n = len(node_ids)
+        matrix = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)).tocsr()
+        matrix.data[:] = 1      # duplicate edges were summed
+        return matrix, node_ids
+
+    def to_networkx(self, graph=None):
+        """Adds all stored edges to given (or a new) networkx DiGraph and returns it"""
+        import networkx as nx
+        graph = graph if graph is not None else nx.DiGraph()
+        graph.add_edges_from(self.iter_edges())
+        return graph
+
+    def write_csr(self, filename, node_ids=None):
+        """
+        Writes network to an on-disk CSR file (uncompressed numpy .npz with 'indptr',
+        'indices' and 'node_ids' arrays). See load_csr.
+        """
+        matrix, node_ids = self.to_scipy(node_ids)
+        write_csr(filename, matrix, node_ids)
+
+
+def write_csr(filename, matrix, node_ids):
+    """Writes a scipy CSR adjacency matrix and its node IDs to an .npz CSR file"""
+    np.savez(filename, indptr=matrix.indptr, indices=matrix.indices, node_ids=node_ids)
+
+def _mmap_npz_member(filename, name, mmap_mode):
+    """
+    Returns array 'name' of an .npz file memory-mapped in place, or None if the member is
+    compressed. np.savez stores members uncompressed, so each .npy is a contiguous run
+    of the archive file: its data starts after the zip local header and the .npy header.
+    """
+    import struct
+    import zipfile
+    from numpy.lib import format as npy_format
+
+    info = zipfile.ZipFile(filename).getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(filename, "rb") as handle:
+        # Local header: 30 fixed bytes, then file name and extra field (lengths at 26)
+        handle.seek(info.header_offset)
+        local_header = handle.read(30)
+        name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+        handle.seek(info.header_offset + 30 + name_length + extra_length)
+        version = npy_format.read_magic(handle)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(handle)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(handle)
+        offset = handle.tell()
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape,
+        order="F" if fortran_order else "C")
+
+def load_csr(filename, mmap_mode="r"):
+    """
+    Loads a CSR file written by write_csr. Returns tuple (scipy.sparse csr_matrix, node
+    ID array). Arrays are memory-mapped in place by default (mmap_mode=None reads them in
+    full), so neighborhood reads of large networks are sequential reads from disk.
+    """
+    from scipy.sparse import csr_matrix
+
+    arrays = {}
+    loaded = None
+    for k in ("indptr", "indices", "node_ids"):
+        if mmap_mode is not None:
+            arrays[k] = _mmap_npz_member(filename, k, mmap_mode)
+        if arrays.get(k) is None:
+            loaded = loaded if loaded is not None else np.load(filename)
+            arrays[k] = loaded[k]
+
+    n = len(arrays["node_ids"])
+    data = np.ones(len(arrays["indices"]), dtype=np.int8)
+    matrix = csr_matrix((data, arrays["indices"], arrays["indptr"]), shape=(n, n))
+    return matrix, arrays["node_ids"]
@@ -0,0 +1,253 @@
+"""
+Streaming builders for hashtag co-occurrence networks (undirected; nodes=hashtags, edge
+weight=number of tweets using both) and user-mention networks (directed; tweeter ->
+mentioned user, weight=number of mentions), from tweet cursors or any iterable of tweets.
+
+Strings (hashtags, screen names) are interned to int IDs, and each edge is counted as
+one int64 key (id_a << 32 | id_b). Keys are buffered, periodically collapsed to sorted
+(key, count) arrays, and when those outgrow memory they are spilled to disk in hash
+partitions. Final counts are produced one partition at a time, so memory is bounded by
+the buffer size, the interned strings and the largest partition.
+"""
+
+import os
+import shutil
+import tempfile
+import networkx as nx
+import numpy as np
+
+from smappPy.entities import get_hashtags
+
+PAIR_BUFFER_SIZE = 1000000
+MAX_PAIRS_IN_MEMORY = 20000000
+NUM_PARTITIONS = 64
+
+
+class StringInterner(object):
+    """Maps strings to consecutive int IDs (and back, via .strings[id])"""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+class PairCounter(object):
+    """
+    Counts (int a, int b) pairs in bounded memory (see module docstring). Pairs are
+    counted as given: to count unordered pairs, add them as (min, max).
+    spill_dir - directory for spilled partitions (default: a temp dir, removed on close)
+    """
+
+    def __init__(self, spill_dir=None, buffer_size=PAIR_BUFFER_SIZE,
+        max_pairs_in_memory=MAX_PAIRS_IN_MEMORY, num_partitions=NUM_PARTITIONS):
+        self.buffer_size = buffer_size
+        self.max_pairs_in_memory = max_pairs_in_memory
+        self.num_partitions = num_partitions
+        self._buffer = []
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._spill_dir = spill_dir
+        self._own_spill_dir = False
+        self._num_spills = 0
+
+    def add(self, a, b, count=1):
+        """Adds a pair (count times)"""
+        key = (a << 32) | b
+        if count == 1:
+            self._buffer.append(key)
+        else:
+            self._buffer.extend([key] * count)
+        if len(self._buffer) >= self.buffer_size:
+            self._collapse()
+
+    def _collapse(self):
+        """Merges buffered keys into the in-memory sorted (key, count) arrays"""
+        if self._buffer:
+            keys = np.fromiter(self._buffer, dtype=np.int64, count=len(self._buffer))
+            self._buffer = []
+            self._keys, self._counts = _merge_counts(
+                [self._keys, keys], [self._counts, np.ones(len(keys), dtype=np.int64)])
+        if len(self._keys) > self.max_pairs_in_memory:
+            self._spill()
+
+    def _spill(self):
+        """Writes in-memory counts to disk, one file per hash partition, and clears them"""
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="pair_counts_")
+            self._own_spill_dir = True
+        elif not os.path.isdir(self._spill_dir):
+            os.makedirs(self._spill_dir)
+        partitions = self._keys % self.num_partitions
+        for p in range(self.num_partitions):
+            in_part = partitions == p
+            if in_part.any():
+                np.savez(self._spill_file(p, self._num_spills), keys=self._keys[in_part],
+                    counts=self._counts[in_part])
+        self._num_spills += 1
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+
+    def _spill_file(self, partition, spill):
+        return os.path.join(self._spill_dir, "part{0}_{1}.npz".format(partition, spill))
+
+    def iter_counts(self, min_count=1):
+        """
+        Yields tuples (keys array, counts array) of final pair counts with count >=
+        min_count, one chunk per partition (or one chunk, if nothing was spilled). Use
+        split_keys to get (a, b) arrays from keys.
+        """
+        self._collapse()
+        if not self._num_spills:
+            keep = self._counts >= min_count
+            yield self._keys[keep], self._counts[keep]
+            return
+
+        self._spill()
+        for p in range(self.num_partitions):
+            keys, counts = [], []
+            for s in range(self._num_spills):
+                filename = self._spill_file(p, s)
+                if os.path.exists(filename):
+                    loaded = np.load(filename)
+                    keys.append(loaded["keys"])
+                    counts.append(loaded["counts"])
+            if keys:
+                keys, counts = _merge_counts(keys, counts)
+                keep = counts >= min_count
+                yield keys[keep], counts[keep]
+
+    def close(self):
+        """Removes spill files (and the spill dir, if it was created here)"""
+        if self._spill_dir is None or not os.path.isdir(self._spill_dir):
+            return
+        if self._own_spill_dir:
+            shutil.rmtree(self._spill_dir)
+        else:
+            for p in range(self.num_partitions):
+                for s in range(self._num_spills):
+                    if os.path.exists(self._spill_file(p, s)):
+                        os.remove(self._spill_file(p, s))
+
+
+def _merge_counts(keys_list, counts_list):
+    """Merges lists of key and count arrays. Returns (sorted unique keys, summed counts)"""
+    keys = np.concatenate(keys_list)
+    counts = np.concatenate(counts_list)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, np.bincount(inverse, weights=counts,
+        minlength=len(unique_keys)).astype(np.int64)
+
+def split_keys(keys):
+    """Inverse of pair key packing. Returns tuple of arrays (a, b)"""
+    return keys >> 32, keys & 0xFFFFFFFF
+
+
+def tweet_hashtags(tweet, lowercase=True):
+    """Returns sorted list of a tweet's distinct hashtags (lowercased by default)"""
+    tags = get_hashtags(tweet)
+    if lowercase:
+        tags = [t.lower() for t in tags]
+    return sorted(set(tags))
+
+def tweet_mentions(tweet, key="screen_name"):
+    """
+    Returns tuple (tweeting user, list of distinct mentioned users), users given by
+    'key' ("screen_name" or "id_str"). Self-mentions are dropped. Messages without a
+    user (eg: delete or limit notices) give (None, []).
+    """
+    user = (tweet.get("user") or {}).get(key)
+    if user is None:
+        return None, []
+    mentions = tweet.get("entities", {}).get("user_mentions") or []
+    return user, sorted(set(m[key] for m in mentions if m[key] != user))
+
+def count_hashtag_pairs(tweets, counter=None, interner=None, lowercase=True):
+    """
+    Counts hashtag co-occurrences in tweets (each pair of distinct hashtags in a tweet
+    counts once). Returns tuple (PairCounter, StringInterner of hashtags).
+    """
+    if counter is None:
+        counter = PairCounter()
+    if interner is None:
+        interner = StringInterner()
+    for tweet in tweets:
+        tags = [interner.intern(t) for t in tweet_hashtags(tweet, lowercase)]
+        tags.sort()
+        for i in range(len(tags)):
+            for j in range(i + 1, len(tags)):
+                counter.add(tags[i], tags[j])
+    return counter, interner
+
+def count_mention_pairs(tweets, counter=None, interner=None, key="screen_name"):
+    """
+    Counts (tweeter, mentioned user) pairs in tweets (once per tweet). Returns tuple
+    (PairCounter, StringInterner of users).
+    """
+    if counter is None:
+        counter = PairCounter()
+    if interner is None:
+        interner = StringInterner()
+    for tweet in tweets:
+        user, mentioned = tweet_mentions(tweet, key)
+        if not mentioned:
+            continue
+        user_id = interner.intern(user)
+        for m in mentioned:
+            counter.add(user_id, interner.intern(m))
+    return counter, interner
+
+def iter_weighted_edges(counter, interner, min_weight=1):
+    """Yields (string a, string b, weight) edges with weight >= min_weight"""
+    strings = interner.strings
+    for keys, counts in counter.iter_counts(min_weight):
+        sources, targets = split_keys(keys)
+        for s, t, w in zip(sources, targets, counts):
+            yield strings[s], strings[t], int(w)
+
+def iter_hashtag_edges(tweets, min_weight=1, lowercase=True, spill_dir=None):
+    """Streams tweets, yields (hashtag, hashtag, weight) co-occurrence edges"""
+    counter, interner = count_hashtag_pairs(tweets, PairCounter(spill_dir), lowercase=lowercase)
+    try:
+        for edge in iter_weighted_edges(counter, interner, min_weight):
+            yield edge
+    finally:
+        counter.close()
+
+def iter_mention_edges(tweets, min_weight=1, key="screen_name", spill_dir=None):
+    """Streams tweets, yields (tweeter, mentioned user, weight) mention edges"""
+    counter, interner = count_mention_pairs(tweets, PairCounter(spill_dir), key=key)
+    try:
+        for edge in iter_weighted_edges(counter, interner, min_weight):
+            yield edge
+    finally:
+        counter.close()
+
+def build_hashtag_network(tweets, min_weight=1, lowercase=True, spill_dir=None):
+    """
+    Takes a pymongo cursor (or iterable) of tweets. Returns undirected networkx Graph,
+    nodes=hashtags, edges=co-occurrence in a tweet, with 'weight' attribute (number of
+    tweets). Edges with weight < min_weight are pruned.
+    """
+    graph = nx.Graph()
+    graph.add_weighted_edges_from(iter_hashtag_edges(tweets, min_weight, lowercase, spill_dir))
+    return graph
+
+def build_mention_network(tweets, min_weight=1, key="screen_name", spill_dir=None):
+    """
+    Takes a pymongo cursor (or iterable) of tweets. Returns networkx DiGraph, nodes=users
+    (by 'key', "screen_name" or "id_str"), edges=tweeter -> mentioned user, with 'weight'
+    attribute (number of tweets). Edges with weight < min_weight are pruned.
+    """
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from(iter_mention_edges(tweets, min_weight, key, spill_dir))
+    return graph
@@ -4,15 +4,28 @@ To start from scratch (dropping existing db):
 
 To output GraphML:
     python build_follower_network.py -db test -uc stoltenberg_network --output > stoltenberg.graphml
+
+To output large networks without building them in memory (graphml, gexf, csv or csr):
+    python build_follower_network.py -db test -uc stoltenberg_network --output --stream --format gexf > stoltenberg.gexf
+
+Add --adjacency to either command to store edges compactly (compressed neighbor lists
+per user in prefix_adjacency, see smappPy.networks.adjacency_store) instead of one
+document per edge in prefix_edges.
 """
 
+import os
 import re
 import sys
+import json
 import math
+import Queue
 import random
 import logging
+import threading
 import argparse
+import numpy as np
 import networkx as nx
+from multiprocessing.pool import ThreadPool
 from tweepy import Cursor
 from datetime import datetime
 from pymongo import MongoClient, ASCENDING
@@ -21,6 +34,8 @@ from smappPy.iter_util import grouper
 from smappPy.tweepy_pool import APIPool
 from smappPy.date import mongodate_to_datetime
 from smappPy.tweepy_error_handling import call_with_error_handling
+from smappPy.networks.adjacency_store import AdjacencyStore, IN, OUT
+from smappPy.networks.stream_export import stream_network, USER_NODE_ATTRIBUTES, FORMATS
 
 def generate_output_file(users_collection, edges_collection, keep_empty_nodes):
     graph = nx.DiGraph()
@@ -29,29 +44,30 @@ def generate_output_file(users_collection, edges_collection, keep_empty_nodes):
     for user in users_collection.find():
         nonempty_user_ids.add(user['id'])
 
-        attrs_to_keep = [
-            'name',
-            'id',
-            'geo_enabled',
-            'followers_count',
-            'protected',
-            'lang',
-            'utc_offset',
-            'statuses_count',
-            'friends_count',
-            'screen_name',
-            'url',
-            'location',
-            ]
+        attrs_to_keep = [name for name, _ in USER_NODE_ATTRIBUTES]
         user_attrs = { key : user[key] or '' for key in attrs_to_keep }
         graph.add_node(user['id'], attr_dict=user_attrs)
 
-    for edge in edges_collection.find():
-        if keep_empty_nodes or edge['from'] in nonempty_user_ids and edge['to'] in nonempty_user_ids:
-            graph.add_edge(edge['from'], edge['to'])
+    if isinstance(edges_collection, AdjacencyStore):
+        edges = edges_collection.iter_edges()
+    else:
+        edges = ((edge['from'], edge['to']) for edge in edges_collection.find())
+    for from_id, to_id in edges:
+        if keep_empty_nodes or from_id in nonempty_user_ids and to_id in nonempty_user_ids:
+            graph.add_edge(from_id, to_id)
 
     nx.write_graphml(graph, sys.stdout)
 
+def stream_output_file(users_collection, edges_collection, keep_empty_nodes, fmt='graphml', outhandle=sys.stdout,
+                       csr_filename=None):
+    """
+    Like generate_output_file, but streams nodes and edges from the db to the output (see
+    smappPy.networks.stream_export), so memory stays bounded by the set of node ids.
+    `fmt` is one of graphml, gexf, csv (edge list) or csr (written to `csr_filename`).
+    """
+    stream_network(users_collection, edges_collection, outhandle, fmt=fmt, keep_empty_nodes=keep_empty_nodes,
+        csr_filename=csr_filename)
+
 def crawl(users_collection, edges_collection, user_ids, twitter_api, depth=1, percentage=1, sample_more=False, get_friends=False, get_followers=True):
     """
     For each user in `user_ids`, gets all followers_ids and friends_ids and stores the edges in db.
@@ -61,6 +77,8 @@ def crawl(users_collection, edges_collection, user_ids, twitter_api, depth=1, pe
     Do this for `depth` recursive iterations for each user that is stored in the database. The last level
     of users stored in the database will have edges for their friends/followers, but those won't be sampled
     and fetched to db.
+
+    `edges_collection` may be an AdjacencyStore, to store edges as compact per-user neighbor lists.
     """
     users, code = call_with_error_handling(ensure_users_in_db, user_ids, users_collection, twitter_api)
     if code != 0:
@@ -90,8 +108,191 @@ def crawl(users_collection, edges_collection, user_ids, twitter_api, depth=1, pe
             crawl(users_collection, edges_collection, other_user_ids, twitter_api, depth-1, percentage, sample_more, get_friends, get_followers)
 
 
+def crawl_bfs(users_collection, edges_collection, user_ids, twitter_api, depth=1, percentage=1, sample_more=False,
+              get_friends=False, get_followers=True, state_dir=None, num_workers=8, batch_size=1000):
+    """
+    Level-synchronous (breadth-first) version of `crawl`, same parameters and results. Instead of recursing
+    per user, keeps one de-duplicated frontier of user ids per depth (numpy id arrays, not nested python lists).
+    Each level is processed in batches of `batch_size` ids: users are looked up (100 per lookup_users call)
+    across the whole batch, then friends/followers ids are fetched by `num_workers` threads, each of which
+    samples its user's ids and keeps only the sample. Given an APIPool, each thread uses its own share of its
+    apis (see APIPool.partition), so they spread over tokens. If a lookup fails, the batch is split and
+    retried, down to single users.
+
+    If `state_dir` is given, the current level, frontier, visited ids and the next level's sampled ids (after
+    every batch) are persisted there, and a crawl started with the same `state_dir` resumes where it stopped.
+
+    Returns list of user ids that could not be looked up.
+    """
+    parts = {}      # next level's sampled ids, per batch (without a state_dir)
+    state = _load_bfs_state(state_dir)
+    if state:
+        level, frontier, visited = state
+        logging.info("Resuming crawl at depth {0}, frontier of {1} users".format(level, len(frontier)))
+        # Parts of the current level are already in the frontier, if a crash left them behind
+        _remove_bfs_parts(state_dir, level)
+    else:
+        level, frontier, visited = 0, np.unique(np.asarray(user_ids, dtype=np.int64)), np.empty(0, dtype=np.int64)
+        _save_bfs_state(state_dir, level, frontier, visited)
+
+    failed = []
+    # Each worker thread takes its own api from the queue as it starts
+    worker_apis, local = Queue.Queue(), threading.local()
+    for api in _worker_apis(twitter_api, num_workers):
+        worker_apis.put(api)
+    def init_worker():
+        local.api = worker_apis.get()
+    pool = ThreadPool(num_workers, init_worker)
+    try:
+        while level <= depth and len(frontier):
+            logging.info("Depth {0}: crawling frontier of {1} users".format(level, len(frontier)))
+            for start in range(0, len(frontier), batch_size):
+                if level < depth and _bfs_part_exists(state_dir, level + 1, start):
+                    continue
+                batch = [int(i) for i in frontier[start:start + batch_size]]
+                sampled, crawled, not_found = _crawl_bfs_batch(users_collection, edges_collection, batch,
+                    twitter_api, pool, lambda: local.api, percentage if level < depth else 0, sample_more, get_friends, get_followers)
+                failed += not_found
+                if level < depth:
+                    _save_bfs_part(state_dir, parts, level + 1, start, sampled)
+                # Only mark users sampled once their sample is persisted
+                if crawled:
+                    users_collection.update_many({'_id': {'$in': crawled}}, {'$set': {'sampled_followers': True}})
+
+            visited = np.union1d(visited, frontier)
+            if level < depth:
+                frontier = np.setdiff1d(_load_bfs_parts(state_dir, parts, level + 1), visited)
+            else:
+                frontier = np.empty(0, dtype=np.int64)
+            level += 1
+            # Parts are only removed once the frontier built from them is persisted
+            _save_bfs_state(state_dir, level, frontier, visited)
+            _remove_bfs_parts(state_dir, level)
+            parts.pop(level, None)
+    finally:
+        pool.close()
+        pool.join()
+    if failed:
+        logging.warn("Could not look up {0} users: {1}".format(len(failed), failed))
+    logging.info("Crawl complete, {0} users crawled".format(len(visited)))
+    return failed
+
+def _worker_apis(twitter_api, num_workers):
+    "Returns list of `num_workers` apis: disjoint shares of an APIPool (see APIPool.partition), else the same api"
+    if isinstance(twitter_api, APIPool):
+        return twitter_api.partition(num_workers)
+    return [twitter_api] * num_workers
+
+def _crawl_bfs_batch(users_collection, edges_collection, user_ids, twitter_api, pool, worker_api, percentage,
+                     sample_more, get_friends, get_followers):
+    """
+    Crawls one batch of a BFS level, fetching in `pool` threads, each with the api returned by `worker_api()`
+    (users are looked up with `twitter_api`). Only each user's sampled ids are kept. Returns tuple: (numpy array of sampled friend/follower ids, ie: the
+    batch's contribution to the next frontier, list of _ids of users whose edges were stored, list of ids
+    of users that could not be looked up)
+    """
+    users, not_found = _ensure_users_in_db_retrying(user_ids, users_collection, twitter_api)
+
+    todo = [u for u in users if sample_more or not u.get('sampled_followers')]
+    logging.info(".. {0} of {1} users not yet sampled".format(len(todo), len(users)))
+
+    def fetch(user):
+        "Returns tuple: (user, list of sampled friend/follower ids, or None if they could not be fetched)"
+        ids_tup, code = call_with_error_handling(ensure_users_edges_in_db, user, edges_collection, worker_api())
+        if code != 0:
+            return user, None
+        friends_ids, followers_ids = ids_tup
+        sample = []
+        if get_friends:
+            sample += random.sample(friends_ids, int(math.ceil(percentage * len(friends_ids))))
+        if get_followers:
+            sample += random.sample(followers_ids, int(math.ceil(percentage * len(followers_ids))))
+        return user, sample
+
+    sampled, crawled = [], []
+    for user, sample in pool.imap_unordered(fetch, todo):
+        if sample is None:
+            logging.warn(".. Some problem getting user {0}'s followers. Maybe she's protected or something. Skipping.".format(user['id']))
+            continue
+        crawled.append(user['_id'])
+        sampled += sample
+    return np.unique(np.asarray(sampled, dtype=np.int64)), crawled, not_found
+
+def _ensure_users_in_db_retrying(user_ids, users_collection, twitter_api):
+    """
+    Calls ensure_users_in_db, splitting user_ids in halves and retrying them if the lookup fails (eg: a slice
+    of only deleted users), so one bad id doesn't drop the others. Returns tuple: (user objects, list of ids
+    that could not be looked up)
+    """
+    users, code = call_with_error_handling(ensure_users_in_db, user_ids, users_collection, twitter_api)
+    if code == 0:
+        return users, []
+    if len(user_ids) == 1:
+        logging.warn("Could not look up user {0}, code {1}".format(user_ids[0], code))
+        return [], list(user_ids)
+    middle = len(user_ids) // 2
+    first_users, first_failed = _ensure_users_in_db_retrying(user_ids[:middle], users_collection, twitter_api)
+    second_users, second_failed = _ensure_users_in_db_retrying(user_ids[middle:], users_collection, twitter_api)
+    return first_users + second_users, first_failed + second_failed
+
+def _save_array(filename, array):
+    "Atomically writes a numpy array to filename"
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as handle:
+        np.save(handle, array)
+    os.rename(tmp_filename, filename)
+
+def _save_bfs_state(state_dir, level, frontier, visited):
+    if not state_dir:
+        return
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    _save_array(os.path.join(state_dir, "frontier.npy"), frontier)
+    _save_array(os.path.join(state_dir, "visited.npy"), visited)
+    _save_array(os.path.join(state_dir, "level.npy"), np.asarray([level]))
+
+def _load_bfs_state(state_dir):
+    "Returns (level, frontier, visited) persisted in state_dir, or None"
+    if not state_dir or not os.path.isfile(os.path.join(state_dir, "level.npy")):
+        return None
+    level = int(np.load(os.path.join(state_dir, "level.npy"))[0])
+    return (level, np.load(os.path.join(state_dir, "frontier.npy")),
+        np.load(os.path.join(state_dir, "visited.npy")))
+
+def _save_bfs_part(state_dir, parts, level, start, ids):
+    "Persists a batch's sampled ids for the given level (kept in the `parts` dict without a state_dir)"
+    if not state_dir:
+        parts.setdefault(level, []).append(ids)
+        return
+    _save_array(os.path.join(state_dir, "next_{0}_{1}.npy".format(level, start)), ids)
+
+def _bfs_part_exists(state_dir, level, start):
+    return bool(state_dir) and os.path.isfile(os.path.join(state_dir, "next_{0}_{1}.npy".format(level, start)))
+
+def _bfs_part_filenames(state_dir, level):
+    prefix = "next_{0}_".format(level)
+    return [os.path.join(state_dir, f) for f in os.listdir(state_dir)
+        if f.startswith(prefix) and f.endswith(".npy")]
+
+def _load_bfs_parts(state_dir, parts, level):
+    "Returns unique ids of all persisted batch parts for the given level"
+    if not state_dir:
+        level_parts = parts.get(level, [])
+    else:
+        level_parts = [np.load(f) for f in _bfs_part_filenames(state_dir, level)]
+    if not level_parts:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(level_parts))
+
+def _remove_bfs_parts(state_dir, level):
+    if state_dir and os.path.isdir(state_dir):
+        for f in _bfs_part_filenames(state_dir, level):
+            os.remove(f)
+
 def ensure_users_edges_in_db(user, edges_collection, twitter_api):
     "Looks up a user's friends_ids and followers_ids on the twitter api, and stores the edges in db."
+    if isinstance(edges_collection, AdjacencyStore):
+        return ensure_users_adjacency_in_db(user, edges_collection, twitter_api)
 
     logging.info(".. Fetching followers_ids for user {0}.".format(user['id']))
     logging.info(".... user has {0} followers.".format(user['followers_count']))
@@ -113,6 +314,21 @@ def ensure_users_edges_in_db(user, edges_collection, twitter_api):
 
     return friends_ids, followers_ids
 
+def ensure_users_adjacency_in_db(user, adjacency_store, twitter_api):
+    "Same as ensure_users_edges_in_db, but merges the ids into an AdjacencyStore."
+    logging.info(".. Fetching followers_ids for user {0}.".format(user['id']))
+    logging.info(".... user has {0} followers.".format(user['followers_count']))
+    followers_ids = list(Cursor(twitter_api.followers_ids, id=user['id']).items())
+    adjacency_store.add_neighbors(user['id'], followers_ids, IN)
+
+    logging.info(".. Fetching friends_ids for user {0}.".format(user['id']))
+    logging.info(".... user has {0} friends.".format(user['friends_count']))
+    friends_ids = list(Cursor(twitter_api.friends_ids, id=user['id']).items())
+    adjacency_store.add_neighbors(user['id'], friends_ids, OUT)
+    logging.info(".... adjacency persisted to db")
+
+    return friends_ids, followers_ids
+
 def store_edges(collection, edges):
     try:
         if edges:
@@ -187,12 +403,19 @@ def get_mongo_collection(args):
             raise ConnectionFailure(
                 "Mongo DB Authentication for User {0}, DB {1} failed".format(args.user, args.database))
     nodes_collection = db[args.collection_prefix + '_nodes']
-    edges_collection = db[args.collection_prefix + '_edges']
+    if args.adjacency:
+        edges_collection = db[args.collection_prefix + '_adjacency']
+    else:
+        edges_collection = db[args.collection_prefix + '_edges']
 
     if args.from_scratch:
         nodes_collection.drop()
         edges_collection.drop()
 
+    if args.adjacency:
+        ensure_indexing(nodes_collection, None)
+        return nodes_collection, AdjacencyStore(edges_collection)
+
     ensure_indexing(nodes_collection, edges_collection)
 
     return nodes_collection, edges_collection
@@ -200,6 +423,8 @@ def get_mongo_collection(args):
 def ensure_indexing(nodes_collection, edges_collection):
     nodes_collection.ensure_index("id", name="unique_id", unique=True, drop_dups=True, background=True)
     nodes_collection.ensure_index("random", name="random_number", background=True)
+    if edges_collection is None:
+        return
     edges_collection.ensure_index([('from', ASCENDING),("to", ASCENDING)], name="compound_unique",
                                     unique=True, drop_dups=True, background=True)
 
@@ -228,9 +453,23 @@ if __name__ == "__main__":
         help="JSON file w/ list of OAuth keys (consumer, consumer secret, access token, access secret)")
     parser.add_argument("-d", "--depth", action="store", type=int, dest="depth", default=1,
         help="depth of network to collect from initial seed")
+    parser.add_argument("--bfs", dest='bfs', action='store_true', default=False,
+                   help='Crawl breadth-first, one de-duplicated frontier per depth, fetching with several threads')
+    parser.add_argument("-sd", "--state-dir", action="store", dest="state_dir", default=None,
+        help="Directory to persist breadth-first crawl state in, and resume from (implies --bfs)")
+    parser.add_argument("-nw", "--workers", action="store", type=int, dest="workers", default=8,
+        help="Number of threads fetching friends/followers ids in a breadth-first crawl (default 8)")
     parser.add_argument("--from-scratch", dest='from_scratch', action='store_const',
                    const=True, default=False,
                    help='Drop the database before starting. Will drop database! Use with caution! Default False.')
+    parser.add_argument("--adjacency", dest='adjacency', action='store_true', default=False,
+                   help='Store edges as compressed per-user neighbor lists (prefix_adjacency) instead of edge documents (prefix_edges)')
+    parser.add_argument("--stream", dest='stream', action='store_true', default=False,
+                   help='With --output: stream the graph file from the db instead of building it in memory')
+    parser.add_argument("--format", dest='format', choices=FORMATS, default='graphml',
+                   help='With --output --stream: output format (default graphml)')
+    parser.add_argument("--csr-file", dest='csr_file', default=None,
+                   help='With --format csr: file to write the binary CSR network to (.npz)')
     parser.add_argument("--output", dest='action', action='store_const',
                    const='output', default='collect',
                    help='Output a graph file from the specified Mongo collection (default: crawl twitter and save to that db)')
@@ -242,7 +481,12 @@ if __name__ == "__main__":
     nodes_collection, edges_collection = get_mongo_collection(args)
 
     if args.action == 'output':
-        generate_output_file(nodes_collection, edges_collection, False)
+        if args.stream:
+            if args.format == 'csr' and not args.csr_file:
+                parser.error('Specify --csr-file for csr output')
+            stream_output_file(nodes_collection, edges_collection, False, args.format, csr_filename=args.csr_file)
+        else:
+            generate_output_file(nodes_collection, edges_collection, False)
     else:
         if not args.seed_file or not args.oauthsfile:
             parser.error('Specify OAUTHSFILE and SEED_FILE for network collection')
@@ -250,4 +494,8 @@ if __name__ == "__main__":
         seed = [int(line) for line in open(args.seed_file).readlines()]
 
         twitter_api = APIPool(oauths_filename=args.oauthsfile, debug=True)
-        crawl(nodes_collection, edges_collection, seed, twitter_api, args.depth, float(args.percentage)/100, args.sample_more)
+        if args.bfs or args.state_dir:
+            crawl_bfs(nodes_collection, edges_collection, seed, twitter_api, args.depth, float(args.percentage)/100,
+                args.sample_more, state_dir=args.state_dir, num_workers=args.workers)
+        else:
+            crawl(nodes_collection, edges_collection, seed, twitter_api, args.depth, float(args.percentage)/100, args.sample_more)
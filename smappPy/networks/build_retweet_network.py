@@ -14,6 +14,13 @@ from collections import namedtuple
 #TODO: Check for username = "" before adding (if so, look at tweet text, fix problem. If "", throw out)
 #TODO: Add a threshold (only draws edges if # > THRESHOLD)
 
+# Networks with more nodes than this are drawn with the fast (sparse layout) path
+FAST_RENDER_NODES = 2000
+
+# Tweet fields read by build_retweet_network (eg: for collection_util.tweet_cursor)
+RETWEET_NETWORK_FIELDS = ["text", "user.screen_name", "retweeted_status.user.id",
+    "retweeted_status.user.screen_name"]
+
 
 def build_retweet_network(tweet_cursor, internal_only=True):
     """
@@ -25,6 +32,9 @@ def build_retweet_network(tweet_cursor, internal_only=True):
 
     Note: considers official retweets (via the twitter retweet button) and also, in a best-effort
     sense, manual retweets (via RT tagging).
+
+    Only RETWEET_NETWORK_FIELDS of tweets are used: query with
+    collection_util.tweet_cursor(collection, query, RETWEET_NETWORK_FIELDS) to fetch only those.
     """
 
     num_tweets = tweet_cursor.count(with_limit_and_skip=True)
@@ -102,25 +112,37 @@ def build_retweet_network(tweet_cursor, internal_only=True):
     # Return graph/network!
     return DG
 
-def display_retweet_network(network, outfile=None, show=False):
+def display_retweet_network(network, outfile=None, show=False, fast=None, layout_cache_dir=None,
+    min_weight=1, max_edges=None, iterations=50, seed=0):
     """
     Take a DiGraph (retweet network?) and display+/save it to file.
     Nodes must have a 'color' property, represented literally and indicating their type
     Edges must have a 'weight' property, represented as edge width
-    """
 
-    # Create a color list corresponding to nodes.
-    node_colors = [ n[1]["color"] for n in network.nodes(data=True) ]
+    fast - use the scalable rendering path (sparse force-directed layout, edges drawn as
+        one LineCollection). Default: True for networks of more than FAST_RENDER_NODES nodes
+    layout_cache_dir - (fast path) directory to cache node positions in, keyed by graph
+        hash, so repeated renders of the same graph reuse its layout
+    min_weight - (fast path) only lay out and draw edges with weight >= min_weight
+    max_edges - (fast path) if given, lay out and draw a random sample of this many edges
+    """
+    if fast is None:
+        fast = network.number_of_nodes() > FAST_RENDER_NODES
+    if fast:
+        _display_large_network(network, layout_cache_dir, min_weight, max_edges, iterations, seed)
+    else:
+        # Create a color list corresponding to nodes.
+        node_colors = [ n[1]["color"] for n in network.nodes(data=True) ]
 
-    # Get edge weights from graph
-    edge_weights = [ e[2]["weight"] for e in network.edges(data=True) ]
+        # Get edge weights from graph
+        edge_weights = [ e[2]["weight"] for e in network.edges(data=True) ]
 
-    # Build up graph figure
-    #pos = nx.random_layout(network)
-    pos = nx.spring_layout(network)
-    nx.draw_networkx_edges(network, pos, alpha=0.3 , width=edge_weights, edge_color='m')
-    nx.draw_networkx_nodes(network, pos, node_size=400, node_color=node_colors, alpha=0.4)
-    #nx.draw_networkx_labels(network, pos, fontsize=6)
+        # Build up graph figure
+        #pos = nx.random_layout(network)
+        pos = nx.spring_layout(network)
+        nx.draw_networkx_edges(network, pos, alpha=0.3 , width=edge_weights, edge_color='m')
+        nx.draw_networkx_nodes(network, pos, node_size=400, node_color=node_colors, alpha=0.4)
+        #nx.draw_networkx_labels(network, pos, fontsize=6)
 
     plt.title("Retweet Network", { 'fontsize': 12 })
     plt.axis('off')
@@ -132,3 +154,31 @@ def display_retweet_network(network, outfile=None, show=False):
     if show:
         print "Displaying graph. Close graph window to resume python execution"
         plt.show()
+
+def _display_large_network(network, layout_cache_dir, min_weight, max_edges, iterations, seed):
+    """
+    Draws network on the current matplotlib axes using fast_layout: edges filtered by
+    weight (and sampled, if max_edges), widths log-scaled, nodes as one scatter plot.
+    """
+    import numpy as np
+    from smappPy.networks.fast_layout import cached_layout, draw_edges
+
+    edges = [(u, v, d.get("weight", 1)) for u, v, d in network.edges(data=True)
+        if d.get("weight", 1) >= min_weight]
+    if max_edges is not None and len(edges) > max_edges:
+        sample = np.random.RandomState(seed).choice(len(edges), max_edges, replace=False)
+        edges = [edges[i] for i in sorted(sample)]
+
+    print "Laying out {0} nodes, {1} edges...".format(network.number_of_nodes(), len(edges))
+    pos = cached_layout(network.nodes(), [(u, v) for u, v, w in edges], layout_cache_dir,
+        iterations=iterations, seed=seed)
+
+    ax = plt.gca()
+    draw_edges(ax, pos, [(u, v) for u, v, w in edges],
+        widths=[0.2 + np.log1p(w) * 0.5 for u, v, w in edges])
+    nodes = network.nodes(data=True)
+    xy = np.array([pos[n] for n, d in nodes])
+    node_size = max(2.0, 400.0 / np.sqrt(max(len(nodes), 1)))
+    ax.scatter(xy[:, 0], xy[:, 1], s=node_size, c=[d.get("color", "#2A2AD1") for n, d in nodes],
+        alpha=0.4, linewidths=0)
+    ax.autoscale_view()
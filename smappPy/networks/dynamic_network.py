@@ -0,0 +1,175 @@
+"""
+Time-sliced (dynamic) retweet/mention networks, built in a single pass over a
+time-ordered tweet stream (eg: a cursor sorted by timestamp).
+
+Windows are made of 'step'-long panes, aligned to multiples of step since the epoch.
+Tumbling windows have window == step; sliding windows have window = k * step and
+advance by one pane at a time (the first k-1 windows are partial). Only the current
+window's edge weights and the last k panes are held in memory.
+
+Each window is emitted as a delta against the previous one (edges added or reweighted,
+edges removed), with summary stats computed incrementally. Use replay() to
+reconstruct full per-window edge sets, and window_graph() for a networkx graph.
+"""
+
+import heapq
+import networkx as nx
+
+from datetime import datetime, timedelta
+from collections import deque, namedtuple, Counter
+
+import smappPy.retweet as rt
+from smappPy.tweet_util import get_timestamp
+from smappPy.networks.build_cooccurrence_network import tweet_mentions
+
+EPOCH = datetime(1970, 1, 1)
+
+# start, end: datetimes (window covers [start, end))
+# added: dict edge (source, target) -> weight, for new edges and edges whose weight changed
+# removed: list of edges no longer in the window
+# stats: dict of "nodes", "edges", "density", "top_in_degree" (list of (node, in-degree))
+WindowDelta = namedtuple("WindowDelta", ["start", "end", "added", "removed", "stats"])
+
+
+def retweet_edges(tweet):
+    """Returns list with (tweeter, retweeted user) screen name edge, if tweet is a retweet"""
+    if not rt.is_retweet(tweet):
+        return []
+    retweeted = rt.get_user_retweeted(tweet, warn=False)
+    if not retweeted or not retweeted[1]:
+        return []
+    return [(tweet["user"]["screen_name"], retweeted[1])]
+
+def mention_edges(tweet):
+    """Returns list of (tweeter, mentioned user) screen name edges"""
+    user, mentioned = tweet_mentions(tweet)
+    return [(user, m) for m in mentioned]
+
+
+class DynamicNetworkBuilder(object):
+    """
+    Incremental windowed network builder. Feed tweets (in time order) to add_tweet,
+    which returns the list of WindowDeltas of windows closed by that tweet; call close()
+    after the last tweet for the final window. Tweets slightly out of order (earlier
+    than the current pane) are counted in the current pane.
+    window, step - timedeltas; window must be a multiple of step (default: step=window)
+    edges - function tweet -> list of (source, target) edges (eg: retweet_edges)
+    top_n - number of highest in-degree nodes reported in stats
+    """
+
+    def __init__(self, window, step=None, edges=retweet_edges, top_n=10):
+        step = step or window
+        ratio = window.total_seconds() / step.total_seconds()
+        if ratio < 1 or ratio != int(ratio):
+            raise ValueError("Window ({0}) must be a multiple of step ({1})".format(window, step))
+        self.window = window
+        self.step = step
+        self.panes_per_window = int(ratio)
+        self.edges = edges
+        self.top_n = top_n
+
+        self.panes = deque()            # edge Counters of the window's panes, oldest first
+        self.pane = Counter()           # pane being filled
+        self.pane_end = None
+        self.weights = {}               # edge -> weight in current window
+        self.in_degree = Counter()      # node -> number of distinct in-edges in window
+        self.node_edges = Counter()     # node -> number of distinct incident edges in window
+
+    def add_tweet(self, tweet):
+        ts = get_timestamp(tweet)
+        closed = []
+        if self.pane_end is None:
+            step = self.step.total_seconds()
+            self.pane_end = EPOCH + timedelta(seconds=((ts - EPOCH).total_seconds() // step + 1) * step)
+        while ts >= self.pane_end:
+            closed.append(self._close_pane())
+        for edge in self.edges(tweet):
+            self.pane[edge] += 1
+        return closed
+
+    def close(self):
+        """Closes the pane being filled. Returns its WindowDelta (None if no tweets were added)"""
+        if self.pane_end is None:
+            return None
+        return self._close_pane()
+
+    def _close_pane(self):
+        changed = set(self.pane)
+        self._apply(self.pane, 1)
+        self.panes.append(self.pane)
+        if len(self.panes) > self.panes_per_window:
+            expired = self.panes.popleft()
+            changed.update(expired)
+            self._apply(expired, -1)
+
+        added = dict((e, self.weights[e]) for e in changed if e in self.weights)
+        removed = [e for e in changed if e not in self.weights]
+        delta = WindowDelta(self.pane_end - self.window, self.pane_end, added, removed,
+            self.stats())
+        self.pane = Counter()
+        self.pane_end += self.step
+        return delta
+
+    def _apply(self, pane, sign):
+        """Adds (sign=1) or subtracts (sign=-1) a pane's edge counts from the window"""
+        for (source, target), count in pane.iteritems():
+            edge = (source, target)
+            weight = self.weights.get(edge, 0) + sign * count
+            if weight > 0:
+                if edge not in self.weights:
+                    self._count_edge(source, target, 1)
+                self.weights[edge] = weight
+            elif edge in self.weights:
+                del self.weights[edge]
+                self._count_edge(source, target, -1)
+
+    def _count_edge(self, source, target, sign):
+        self.in_degree[target] += sign
+        self.node_edges[source] += sign
+        self.node_edges[target] += sign
+        for node in (source, target):
+            if self.node_edges[node] == 0:
+                del self.node_edges[node]
+        if self.in_degree[target] == 0:
+            del self.in_degree[target]
+
+    def stats(self):
+        """Returns summary stats dict of the current window (see WindowDelta)"""
+        num_nodes = len(self.node_edges)
+        num_edges = len(self.weights)
+        density = num_edges / float(num_nodes * (num_nodes - 1)) if num_nodes > 1 else 0.0
+        top = heapq.nlargest(self.top_n, self.in_degree.iteritems(), key=lambda i: i[1])
+        return {"nodes": num_nodes, "edges": num_edges, "density": density, "top_in_degree": top}
+
+
+def iter_window_deltas(tweets, window, step=None, edges=retweet_edges, top_n=10):
+    """
+    Single pass over time-ordered tweets. Yields WindowDelta for each consecutive window
+    (see DynamicNetworkBuilder for parameters).
+    """
+    builder = DynamicNetworkBuilder(window, step, edges, top_n)
+    for tweet in tweets:
+        for delta in builder.add_tweet(tweet):
+            yield delta
+    last = builder.close()
+    if last:
+        yield last
+
+def replay(deltas):
+    """
+    Takes an iterable of WindowDeltas. Yields tuples (start, end, dict edge -> weight) of
+    full window edge sets. The same dict is updated in place between windows: copy it to
+    keep a snapshot.
+    """
+    weights = {}
+    for delta in deltas:
+        weights.update(delta.added)
+        for edge in delta.removed:
+            del weights[edge]
+        yield delta.start, delta.end, weights
+
+def window_graph(weights, directed=True):
+    """Takes a dict edge -> weight. Returns networkx (Di)Graph with 'weight' edge attributes"""
+    graph = nx.DiGraph() if directed else nx.Graph()
+    graph.add_weighted_edges_from((s, t, w) for (s, t), w in weights.iteritems())
+    return graph
@@ -0,0 +1,127 @@
+"""
+Scalable force-directed layout for large (sparse) networks, with an on-disk position
+cache, and single-call edge drawing.
+
+sparse_layout is Fruchterman-Reingold with vectorized attraction along the sparse edge
+list, and repulsion approximated Barnes-Hut style from the centers of mass of a coarse
+grid of cells (cost per iteration ~ nodes * occupied cells + edges, instead of nodes^2).
+"""
+
+import os
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+
+REPULSION_CHUNK_SIZE = 4096
+
+
+def sparse_layout(adjacency, iterations=50, grid_size=16, gravity=1.0, seed=0):
+    """
+    Takes a (square) scipy.sparse adjacency matrix (direction and weights are ignored).
+    Returns (n x 2) array of node positions in [0, 1].
+    gravity - strength of the pull toward the center of mass (keeps small disconnected
+        components from drifting off and squashing the rest of the layout)
+    """
+    n = adjacency.shape[0]
+    rng = np.random.RandomState(seed)
+    pos = rng.rand(n, 2)
+    if n < 2:
+        return pos
+
+    A = adjacency.tocoo()
+    keep = A.row != A.col
+    rows, cols = A.row[keep], A.col[keep]
+    k = 1.0 / np.sqrt(n)
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        disp = _grid_repulsion(pos, k, grid_size)
+        disp -= gravity * (pos - pos.mean(axis=0))
+
+        delta = pos[rows] - pos[cols]
+        dist = np.sqrt((delta ** 2).sum(axis=1)) + 1e-9
+        pull = delta * (dist / k)[:, None]
+        for dim in (0, 1):
+            disp[:, dim] -= np.bincount(rows, weights=pull[:, dim], minlength=n)
+            disp[:, dim] += np.bincount(cols, weights=pull[:, dim], minlength=n)
+
+        length = np.sqrt((disp ** 2).sum(axis=1)) + 1e-9
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    pos -= pos.min(axis=0)
+    pos /= max(pos.max(), 1e-9)
+    return pos
+
+def _grid_repulsion(pos, k, grid_size):
+    """Repulsive displacement of each node from grid cell centers of mass"""
+    low = pos.min(axis=0)
+    extent = np.maximum(pos.max(axis=0) - low, 1e-9)
+    cells = np.minimum((pos - low) / extent * grid_size, grid_size - 1).astype(np.int64)
+    cell_index = cells[:, 0] * grid_size + cells[:, 1]
+
+    mass = np.bincount(cell_index, minlength=grid_size * grid_size).astype(np.float64)
+    occupied = mass > 0
+    centers = np.column_stack([
+        np.bincount(cell_index, weights=pos[:, dim], minlength=grid_size * grid_size)[occupied]
+        for dim in (0, 1)]) / mass[occupied][:, None]
+    mass = mass[occupied]
+
+    disp = np.empty_like(pos)
+    for start in range(0, len(pos), REPULSION_CHUNK_SIZE):
+        chunk = pos[start:start + REPULSION_CHUNK_SIZE]
+        dist2 = ((chunk[:, 0:1] - centers[:, 0]) ** 2 + (chunk[:, 1:2] - centers[:, 1]) ** 2 +
+            k * k * 0.01)
+        # sum over cells of (node - center) * force = node * sum(force) - force . centers
+        force = (k * k) * mass / dist2
+        disp[start:start + REPULSION_CHUNK_SIZE] = (chunk * force.sum(axis=1)[:, None] -
+            force.dot(centers))
+    return disp
+
+
+def graph_hash(nodes, edges, *params):
+    """Returns hex digest identifying a graph (sorted node and edge lists) and layout params"""
+    digest = hashlib.sha1()
+    digest.update(repr(sorted(nodes)))
+    digest.update(repr(sorted(edges)))
+    digest.update(repr(params))
+    return digest.hexdigest()
+
+def cached_layout(nodes, edges, cache_dir=None, iterations=50, grid_size=16, gravity=1.0, seed=0):
+    """
+    Takes lists of nodes and (source, target) edges. Returns dict node -> (x, y) position
+    from sparse_layout (with the given parameters). If cache_dir is given, positions are stored there (one .npy file
+    per graph, named by graph_hash) and reused by later calls on the same graph.
+    """
+    nodes = sorted(nodes)
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, "layout_{0}.npy".format(
+            graph_hash(nodes, edges, iterations, grid_size, gravity, seed)))
+        if os.path.exists(cache_file):
+            return dict(zip(nodes, np.load(cache_file)))
+
+    index = dict((node, i) for i, node in enumerate(nodes))
+    rows = np.array([index[s] for s, t in edges], dtype=np.int64)
+    cols = np.array([index[t] for s, t in edges], dtype=np.int64)
+    adjacency = sp.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), len(nodes)))
+    pos = sparse_layout(adjacency, iterations=iterations, grid_size=grid_size, gravity=gravity,
+        seed=seed)
+
+    if cache_file:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = cache_file + ".tmp.npy"
+        np.save(tmp_file, pos)
+        os.rename(tmp_file, cache_file)
+    return dict(zip(nodes, pos))
+
+
+def draw_edges(ax, pos, edges, widths=1.0, color="m", alpha=0.3):
+    """Draws all edges with one matplotlib LineCollection. Returns the collection"""
+    from matplotlib.collections import LineCollection
+    segments = np.array([(pos[s], pos[t]) for s, t in edges]).reshape(-1, 2, 2)
+    lines = LineCollection(segments, linewidths=widths, colors=color, alpha=alpha)
+    ax.add_collection(lines)
+    return lines
@@ -0,0 +1,220 @@
+"""
+Graph analytics over scipy.sparse adjacency matrices (vectorized; no per-node python loops),
+for networks too large to analyze comfortably in networkx.
+
+Build a matrix with:
+    adjacency_from_networkx(graph)      # eg: from build_retweet_network
+    AdjacencyStore(collection).to_scipy()   # follower networks (see adjacency_store)
+    adjacency_store.load_csr(filename)      # or build_follower_network --format csr
+
+All functions take a square scipy.sparse matrix A where A[i, j] != 0 is an edge i -> j
+(value = weight), and return numpy arrays indexed like A's rows.
+
+Benchmark against the networkx equivalents with:
+    python -m smappPy.networks.sparse_analytics [num_nodes] [avg_degree] [--no-networkx]
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+def adjacency_from_networkx(graph, weight="weight"):
+    """
+    Takes a networkx (Di)Graph. Returns tuple (csr_matrix A, list of nodes), with rows and
+    columns of A in node list order. Edge values are edge 'weight' attributes (1 if absent,
+    or if weight=None).
+    """
+    nodes = graph.nodes()
+    index = dict((n, i) for i, n in enumerate(nodes))
+    edges = graph.edges(data=True)
+    rows = np.fromiter((index[u] for u, v, d in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((index[v] for u, v, d in edges), dtype=np.int64, count=len(edges))
+    data = np.fromiter(((d.get(weight, 1) if weight else 1) for u, v, d in edges),
+        dtype=np.float64, count=len(edges))
+    n = len(nodes)
+    matrix = sp.coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr()
+    if not graph.is_directed():
+        matrix = matrix + sp.triu(matrix, 1).T + sp.tril(matrix, -1).T
+        matrix = matrix.tocsr()
+    return matrix, nodes
+
+def _binary(A):
+    """Returns A as a csr matrix of 1.0 values (edge structure only)"""
+    A = sp.csr_matrix(A, dtype=np.float64, copy=True)
+    A.eliminate_zeros()
+    A.data[:] = 1.0
+    return A
+
+def _drop_self_loops(A):
+    """Returns csr copy of A without diagonal entries"""
+    A = A.tocoo()
+    keep = A.row != A.col
+    return sp.csr_matrix((A.data[keep], (A.row[keep], A.col[keep])), shape=A.shape)
+
+def pagerank(A, alpha=0.85, personalization=None, weighted=True, tol=1.0e-6, max_iter=100):
+    """
+    PageRank by sparse power iteration (same definition as networkx.pagerank: dangling
+    nodes' rank is spread by the personalization vector, and convergence is when the L1
+    change is below num_nodes * tol).
+    personalization - optional array of (non-negative) teleport weights per node
+    Returns array of ranks (sums to 1). Raises ArithmeticError if not converged.
+    """
+    A = sp.csr_matrix(A, dtype=np.float64) if weighted else _binary(A)
+    n = A.shape[0]
+    if n == 0:
+        return np.empty(0)
+
+    out_weight = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    inv_out = np.zeros(n)
+    inv_out[~dangling] = 1.0 / out_weight[~dangling]
+    # Row-normalize, transpose once so each iteration is one sparse mat-vec
+    P_T = (sp.diags(inv_out) * A).T.tocsr()
+
+    if personalization is None:
+        p = np.full(n, 1.0 / n)
+    else:
+        p = np.asarray(personalization, dtype=np.float64)
+        p = p / p.sum()
+
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        x_last = x
+        x = alpha * (P_T.dot(x_last) + x_last[dangling].sum() * p) + (1 - alpha) * p
+        if np.abs(x - x_last).sum() < n * tol:
+            return x
+    raise ArithmeticError("pagerank: power iteration failed to converge in {0} iterations".format(
+        max_iter))
+
+def in_degree(A, weighted=False):
+    """Returns array of node in-degrees (in-strength, if weighted)"""
+    A = A if weighted else _binary(A)
+    return np.asarray(A.sum(axis=0)).ravel()
+
+def out_degree(A, weighted=False):
+    """Returns array of node out-degrees (out-strength, if weighted)"""
+    A = A if weighted else _binary(A)
+    return np.asarray(A.sum(axis=1)).ravel()
+
+def degree_distribution(degrees):
+    """
+    Takes an array of degrees (eg: in_degree(A)). Returns tuple of arrays (degree values,
+    number of nodes with that degree), for degrees that occur.
+    """
+    values, counts = np.unique(np.asarray(degrees), return_counts=True)
+    return values, counts
+
+def weakly_connected_components(A):
+    """
+    Returns tuple (number of weakly connected components, array of component label per
+    node). Labels are ordered by component size, largest first (label 0 = giant component).
+    """
+    num, labels = connected_components(A, directed=True, connection="weak")
+    sizes = np.bincount(labels, minlength=num)
+    rank = np.empty(num, dtype=np.int64)
+    rank[np.argsort(-sizes, kind="mergesort")] = np.arange(num)
+    return num, rank[labels]
+
+def core_number(A):
+    """
+    k-core decomposition of the undirected, unweighted graph underlying A (self-loops
+    ignored, as networkx.core_number requires none). Returns array of core numbers.
+    Bucket-based peeling (Batagelj and Zaversnik, 2003) over the CSR arrays: nodes are
+    kept sorted by remaining degree in one array, with each degree's bucket start, and
+    peeling a node moves each higher-degree neighbor down one bucket by a swap. Runs in
+    O(nodes + edges); unlike the other functions, this is a python loop (peeling order
+    is inherently sequential), over one node's neighbors at a time.
+    """
+    U = _drop_self_loops(_binary(A + A.T))
+    n = U.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    indptr, indices = U.indptr, U.indices
+
+    degree = np.diff(indptr)
+    # vert: nodes sorted by degree; pos: position of each node in vert; bucket_start[d]:
+    # position in vert of the first node of degree d
+    vert = np.argsort(degree, kind="mergesort")
+    pos = np.empty(n, dtype=np.int64)
+    pos[vert] = np.arange(n)
+    bucket_start = np.concatenate(([0], np.cumsum(np.bincount(degree))))[:-1]
+
+    degree, vert, pos, bucket_start = degree.tolist(), vert.tolist(), pos.tolist(), bucket_start.tolist()
+    bounds = indptr.tolist()
+    for i in xrange(n):
+        v = vert[i]
+        dv = degree[v]
+        for u in indices[bounds[v]:bounds[v + 1]].tolist():
+            du = degree[u]
+            if du > dv:
+                # Swap u with the first node of its bucket, then shrink the bucket past it
+                pu, pw = pos[u], bucket_start[du]
+                w = vert[pw]
+                if u != w:
+                    vert[pu], vert[pw] = w, u
+                    pos[u], pos[w] = pw, pu
+                bucket_start[du] += 1
+                degree[u] = du - 1
+    return np.asarray(degree, dtype=np.int64)
+
+def reciprocity(A):
+    """
+    Returns the overall reciprocity of directed graph A: fraction of (non self-loop) edges
+    i -> j for which j -> i is also an edge (as networkx.overall_reciprocity, networkx>=2.0).
+    """
+    B = _drop_self_loops(_binary(A))
+    if B.nnz == 0:
+        return 0.0
+    return B.multiply(B.T).nnz / float(B.nnz)
+
+
+def _random_digraph(num_nodes, avg_degree, seed=0):
+    """Random directed graph with power-law-ish in-degrees, as csr matrix (for benchmarks)"""
+    rng = np.random.RandomState(seed)
+    num_edges = num_nodes * avg_degree
+    rows = rng.randint(0, num_nodes, num_edges)
+    cols = (rng.pareto(1.5, num_edges) * num_nodes / 50).astype(np.int64) % num_nodes
+    A = sp.coo_matrix((np.ones(num_edges), (rows, cols)), shape=(num_nodes, num_nodes)).tocsr()
+    A.data[:] = 1.0
+    return A
+
+def benchmark(num_nodes=1000000, avg_degree=5, compare_networkx=True):
+    """Times each routine (and its networkx equivalent, optionally) on a random graph"""
+    import time
+    A = _random_digraph(num_nodes, avg_degree)
+    print "Graph: {0} nodes, {1} edges".format(A.shape[0], A.nnz)
+
+    def timed(label, func, *args):
+        start = time.time()
+        result = func(*args)
+        print "  {0:<40} {1:8.2f}s".format(label, time.time() - start)
+        return result
+
+    timed("pagerank", pagerank, A)
+    timed("in/out degree distribution", lambda: (degree_distribution(in_degree(A)),
+        degree_distribution(out_degree(A))))
+    timed("weakly connected components", weakly_connected_components, A)
+    timed("core number", core_number, A)
+    timed("reciprocity", reciprocity, A)
+
+    if compare_networkx:
+        import networkx as nx
+        G = timed("(networkx graph construction)", nx.from_scipy_sparse_matrix, A,
+            False, nx.DiGraph())
+        timed("networkx pagerank", nx.pagerank, G)
+        timed("networkx in/out degree", lambda: (G.in_degree(), G.out_degree()))
+        timed("networkx weakly connected components",
+            lambda: list(nx.weakly_connected_components(G)))
+        U = G.to_undirected()
+        U.remove_edges_from(U.selfloop_edges())
+        timed("networkx core number", nx.core_number, U)
+        timed("networkx reciprocity", lambda: sum(1 for u, v in G.edges() if u != v and
+            G.has_edge(v, u)) / float(G.number_of_edges() - G.number_of_selfloops()))
+
+
+if __name__ == "__main__":
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    benchmark(int(args[0]) if args else 1000000, int(args[1]) if len(args) > 1 else 5,
+        "--no-networkx" not in sys.argv)
@@ -0,0 +1,219 @@
+"""
+Streaming network export. Writes nodes and edges straight from Mongo cursors (or an
+AdjacencyStore) to GraphML, GEXF, a CSV edge list or a binary CSR file, without building
+a networkx graph. Peak memory is the sorted array of node IDs (8 bytes per node) plus one
+chunk of edges; except for CSR output, which holds the output index arrays.
+
+Node filtering (dropping edges with an endpoint that is not a node) is done by binary
+search of each chunk of edge endpoints in the sorted node ID array.
+
+An AdjacencyStore can record an edge A -> B twice, in A's "out" list and B's "in" list.
+Each edge is written once: a user's "out" list is taken as the complete set of its
+outgoing edges, and "in" records are only used for sources without an "out" list.
+"""
+
+import numpy as np
+from xml.sax.saxutils import escape, quoteattr
+from smappPy.iter_util import grouper
+from smappPy.networks.adjacency_store import AdjacencyStore, OUT, write_csr
+from scipy.sparse import coo_matrix
+
+# Twitter user fields exported as node attributes, with GraphML/GEXF types
+USER_NODE_ATTRIBUTES = [
+    ("name", "string"),
+    ("id", "long"),
+    ("geo_enabled", "boolean"),
+    ("followers_count", "long"),
+    ("protected", "boolean"),
+    ("lang", "string"),
+    ("utc_offset", "long"),
+    ("statuses_count", "long"),
+    ("friends_count", "long"),
+    ("screen_name", "string"),
+    ("url", "string"),
+    ("location", "string"),
+]
+
+FORMATS = ["graphml", "gexf", "csv", "csr"]
+EDGE_CHUNK_SIZE = 100000
+
+
+def stream_network(users_collection, edges, outhandle, fmt="graphml", keep_empty_nodes=False,
+    node_attributes=USER_NODE_ATTRIBUTES, node_outhandle=None, csr_filename=None):
+    """
+    Streams the network stored in users_collection (user docs, nodes) and edges (edge
+    collection of {from, to} docs, or an AdjacencyStore) to outhandle in format 'fmt'
+    (one of FORMATS).
+    If keep_empty_nodes is False, only edges between users in users_collection are
+    written; otherwise all edges are, and for graph formats endpoints without a user doc
+    are written as attribute-less nodes (like networkx does when adding edges).
+    For 'csv', outhandle receives the 'source,target' edge list; node attributes are
+    written as CSV to node_outhandle, if given.
+    For 'csr', the network is written to csr_filename (see adjacency_store.load_csr) and
+    outhandle is not used.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown network format '{0}', must be one of {1}".format(fmt, FORMATS))
+
+    node_ids = np.unique(np.fromiter((u["id"] for u in users_collection.find(
+        projection={"_id": False, "id": True})), dtype=np.int64))
+    def iter_users():
+        return users_collection.find(projection=dict((a, True) for a, _ in node_attributes))
+    def iter_edge_chunks():
+        return _filtered_edge_chunks(edges, None if keep_empty_nodes else node_ids)
+
+    if fmt == "csr":
+        _write_csr(csr_filename, node_ids, iter_edge_chunks(), keep_empty_nodes)
+        return
+
+    extra_ids = None
+    if keep_empty_nodes and fmt in ("graphml", "gexf"):
+        # Edge endpoints without user docs are nodes too (need to be declared up front)
+        extra_ids = np.empty(0, dtype=np.int64)
+        for sources, targets in iter_edge_chunks():
+            ends = np.union1d(sources, targets)
+            extra_ids = np.union1d(extra_ids, ends[~_contains(node_ids, ends)])
+
+    if fmt == "graphml":
+        _write_graphml(outhandle, node_attributes, iter_users(), extra_ids, iter_edge_chunks())
+    elif fmt == "gexf":
+        _write_gexf(outhandle, node_attributes, iter_users(), extra_ids, iter_edge_chunks())
+    elif fmt == "csv":
+        if node_outhandle:
+            _write_node_csv(node_outhandle, node_attributes, iter_users())
+        outhandle.write("source,target\n")
+        for sources, targets in iter_edge_chunks():
+            outhandle.write("".join("{0},{1}\n".format(s, t) for s, t in zip(sources, targets)))
+
+
+def _contains(sorted_ids, ids):
+    """Vectorized membership of ids in sorted array sorted_ids. Returns boolean array"""
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.searchsorted(sorted_ids, ids)
+    pos[pos == len(sorted_ids)] = 0
+    return sorted_ids[pos] == ids
+
+def _filtered_edge_chunks(edges, node_ids, chunk_size=EDGE_CHUNK_SIZE):
+    """
+    Yields (sources, targets) int64 array tuples of edges, in chunks. If node_ids is
+    given, only edges with both endpoints in node_ids are yielded.
+    """
+    for sources, targets in _edge_chunks(edges, chunk_size):
+        if node_ids is not None:
+            keep = _contains(node_ids, sources) & _contains(node_ids, targets)
+            sources, targets = sources[keep], targets[keep]
+        if len(sources):
+            yield sources, targets
+
+def _edge_chunks(edges, chunk_size):
+    if isinstance(edges, AdjacencyStore):
+        # Edges of users with an "out" list are all in that list (see module docstring)
+        out_ids = edges.user_ids(OUT)
+        for user_id, direction, neighbors in edges.iter_adjacency():
+            neighbors = neighbors.astype(np.int64)
+            if direction != OUT:
+                neighbors = neighbors[~_contains(out_ids, neighbors)]
+            user_col = np.full(len(neighbors), user_id, dtype=np.int64)
+            if direction == OUT:
+                yield user_col, neighbors
+            else:
+                yield neighbors, user_col
+    else:
+        cursor = edges.find(projection={"_id": False, "from": True, "to": True},
+            batch_size=10000)
+        for chunk in grouper(chunk_size, cursor, pad=False):
+            yield (np.fromiter((e["from"] for e in chunk), dtype=np.int64, count=len(chunk)),
+                   np.fromiter((e["to"] for e in chunk), dtype=np.int64, count=len(chunk)))
+
+def _attr_value(value, attr_type):
+    """Formats an attribute value for XML output. Returns None for empty values"""
+    if value is None or value == "":
+        return None
+    if attr_type == "boolean":
+        return "true" if value else "false"
+    if isinstance(value, unicode):
+        return escape(value).encode("utf8")
+    return escape(str(value))
+
+def _write_graphml(out, node_attributes, users, extra_ids, edge_chunks):
+    out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    out.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+        'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+    for i, (name, attr_type) in enumerate(node_attributes):
+        out.write('  <key attr.name={0} attr.type="{1}" for="node" id="d{2}" />\n'.format(
+            quoteattr(name), attr_type, i))
+    out.write('  <graph edgedefault="directed">\n')
+    for user in users:
+        out.write('    <node id="{0}">\n'.format(user["id"]))
+        for i, (name, attr_type) in enumerate(node_attributes):
+            value = _attr_value(user.get(name), attr_type)
+            if value is not None:
+                out.write('      <data key="d{0}">{1}</data>\n'.format(i, value))
+        out.write('    </node>\n')
+    if extra_ids is not None:
+        for node_id in extra_ids:
+            out.write('    <node id="{0}" />\n'.format(node_id))
+    for sources, targets in edge_chunks:
+        out.write("".join('    <edge source="{0}" target="{1}" />\n'.format(s, t)
+            for s, t in zip(sources, targets)))
+    out.write('  </graph>\n</graphml>\n')
+
+def _write_gexf(out, node_attributes, users, extra_ids, edge_chunks):
+    gexf_types = {"string": "string", "long": "long", "boolean": "boolean"}
+    out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    out.write('<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n')
+    out.write('  <graph defaultedgetype="directed" mode="static">\n')
+    out.write('    <attributes class="node" mode="static">\n')
+    for i, (name, attr_type) in enumerate(node_attributes):
+        out.write('      <attribute id="{0}" title={1} type="{2}" />\n'.format(i, quoteattr(name),
+            gexf_types[attr_type]))
+    out.write('    </attributes>\n    <nodes>\n')
+    for user in users:
+        label = _attr_value(user.get("screen_name"), "string") or str(user["id"])
+        out.write('      <node id="{0}" label="{1}">\n        <attvalues>\n'.format(
+            user["id"], label.replace('"', "&quot;")))
+        for i, (name, attr_type) in enumerate(node_attributes):
+            value = _attr_value(user.get(name), attr_type)
+            if value is not None:
+                out.write('          <attvalue for="{0}" value="{1}" />\n'.format(i,
+                    value.replace('"', "&quot;")))
+        out.write('        </attvalues>\n      </node>\n')
+    if extra_ids is not None:
+        for node_id in extra_ids:
+            out.write('      <node id="{0}" label="{0}" />\n'.format(node_id))
+    out.write('    </nodes>\n    <edges>\n')
+    edge_id = 0
+    for sources, targets in edge_chunks:
+        lines = []
+        for s, t in zip(sources, targets):
+            lines.append('      <edge id="{0}" source="{1}" target="{2}" />\n'.format(edge_id, s, t))
+            edge_id += 1
+        out.write("".join(lines))
+    out.write('    </edges>\n  </graph>\n</gexf>\n')
+
+def _write_node_csv(out, node_attributes, users):
+    from smappPy.unicode_csv import UnicodeWriter
+    writer = UnicodeWriter(out)
+    writer.writerow([name for name, _ in node_attributes])
+    writer.writerows([user.get(name) if user.get(name) is not None else ""
+        for name, _ in node_attributes] for user in users)
+
+def _write_csr(filename, node_ids, edge_chunks, keep_empty_nodes):
+    """Writes CSR file of edges, rows/columns indexed by position in node ID array"""
+    sources, targets = [], []
+    for s, t in edge_chunks:
+        sources.append(s)
+        targets.append(t)
+    sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+    targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+    if keep_empty_nodes:
+        node_ids = np.union1d(node_ids, np.union1d(sources, targets))
+    n = len(node_ids)
+    matrix = coo_matrix((np.ones(len(sources), dtype=np.int8),
+        (np.searchsorted(node_ids, sources), np.searchsorted(node_ids, targets))),
+        shape=(n, n)).tocsr()
+    matrix.data[:] = 1
+    write_csr(filename, matrix, node_ids)
@@ -14,10 +14,13 @@ database.authenticate("readonly", "smappnyu")
 from datetime import datetime
 start = datetime(2013,9,20)
 end = datetime(2013,9, 22)
-results = database.legislator_tweets.find({"timestamp": {"$gte": start, "$lt": end}})
+from smappPy.collection_util import tweet_cursor
+from smappPy.networks.build_retweet_network import build_retweet_network, display_retweet_network, \
+    RETWEET_NETWORK_FIELDS
+results = tweet_cursor(database.legislator_tweets, {"timestamp": {"$gte": start, "$lt": end}},
+    RETWEET_NETWORK_FIELDS)
 
 # Pass results to nework building function, get graph
-from tweetnetworks.build_retweet_network import build_retweet_network, display_retweet_network
 retweet_net = build_retweet_network(results, internal_only=False)
 
 # Print and show graph, with coloring
@@ -0,0 +1,225 @@
+"""
+Precomputed hourly tweet counts ("rollups") for a tweet collection, kept in a side
+collection so figures and summaries don't have to scan the tweets.
+
+One rollup document per hour and combination of dimension values:
+
+    {"bucket": <datetime, hour start>, "lang": <tweet language, "unk" if none>,
+     "retweet": <bool>, "geocoded": <bool>, "has_url": <bool>, "count": <num tweets>}
+
+plus one metadata document holding the covered range [low_water, high_water). update()
+aggregates only tweets from the high-water mark up to the last complete hour, so it is
+cheap to run periodically (eg: from cron: python -m smappPy.rollup ...). Tweets inserted
+with a timestamp before the high-water mark are not counted; rebuild() recounts a range.
+
+Days, weeks etc. are sums of hours: any range aligned to hours and within the covered
+range can be answered from the rollup (see covers()). smappPy.aggregation uses a rollup
+(when given one) for ranges it covers.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from pymongo import ASCENDING, UpdateOne
+
+from smappPy.tweet_util import TIMESTAMP_FIELD
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+DIMENSIONS = ["lang", "retweet", "geocoded", "has_url"]
+META_ID = "__rollup_meta__"
+MISSING_LANG = "unk"
+
+# Aggregation expressions for each dimension of a tweet
+DIMENSION_EXPRESSIONS = {
+    "lang": {"$ifNull": ["$lang", MISSING_LANG]},
+    "retweet": {"$gt": [{"$ifNull": ["$retweeted_status", None]}, None]},
+    "geocoded": {"$gt": [{"$ifNull": ["$coordinates", None]}, None]},
+    "has_url": {"$gt": [{"$size": {"$ifNull": ["$entities.urls", []]}}, 0]},
+}
+
+# The boolean dimensions' expressions, as functions of a tweet (for tweets not in Mongo)
+DIMENSION_FUNCTIONS = {
+    "retweet": lambda t: t.get("retweeted_status") is not None,
+    "geocoded": lambda t: t.get("coordinates") is not None,
+    "has_url": lambda t: len((t.get("entities") or {}).get("urls") or []) > 0,
+}
+
+
+def floor_hour(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+def _hour_aligned(when):
+    return when == floor_hour(when)
+
+
+class TweetRollup(object):
+    """
+    Hourly rollup of tweet_collection, stored in rollup_collection (both pymongo
+    collections; tweet_collection may be omitted to only read the rollup).
+    """
+
+    def __init__(self, rollup_collection, tweet_collection=None, ensure_indexes=True):
+        self.collection = rollup_collection
+        self.tweet_collection = tweet_collection
+        if ensure_indexes:
+            self.collection.ensure_index([("bucket", ASCENDING)] + [(d, ASCENDING) for d in DIMENSIONS],
+                name="bucket_dimensions_unique", unique=True, background=True)
+
+    def _meta(self):
+        return self.collection.find_one({"_id": META_ID}) or {}
+
+    def covered_range(self):
+        """Returns tuple (low_water, high_water) of datetimes covered, or (None, None)"""
+        meta = self._meta()
+        return meta.get("low_water"), meta.get("high_water")
+
+    def covers(self, start, end, step=HOUR):
+        """
+        Returns True if counts for [start, end) in buckets of 'step' can be answered from
+        the rollup (start, end and step are hour-aligned and the range is covered).
+        """
+        low, high = self.covered_range()
+        if low is None or step.total_seconds() % 3600:
+            return False
+        if not (_hour_aligned(start) and _hour_aligned(end)):
+            return False
+        return low <= start and end <= high
+
+    def update(self, until=None, start=None, batch_size=1000):
+        """
+        Counts tweets from the high-water mark (or 'start', or the earliest tweet, on the
+        first update) up to 'until' (default: the start of the current hour, UTC), and
+        moves the high-water mark to 'until'. Returns number of rollup buckets written.
+        """
+        low, high = self.covered_range()
+        if high is None:
+            if start is None:
+                first = list(self.tweet_collection.find({TIMESTAMP_FIELD: {"$ne": None}},
+                    projection={TIMESTAMP_FIELD: True}).sort(TIMESTAMP_FIELD, ASCENDING).limit(1))
+                if not first:
+                    return 0
+                start = first[0][TIMESTAMP_FIELD]
+            high = floor_hour(start)
+            low = high
+        until = floor_hour(until or datetime.utcnow())
+        if until <= high:
+            return 0
+
+        written = self._count_range(high, until, batch_size)
+        self.collection.update_one({"_id": META_ID},
+            {"$set": {"low_water": min(low, high), "high_water": until}}, upsert=True)
+        logger.info("Rolled up {0} - {1}: {2} buckets".format(high, until, written))
+        return written
+
+    def rebuild(self, start, end, batch_size=1000):
+        """
+        Recounts tweets in [start, end) (hour-aligned, within the covered range), eg: after
+        late inserts. Returns number of rollup buckets written.
+        """
+        start, end = floor_hour(start), floor_hour(end)
+        self.collection.delete_many({"bucket": {"$gte": start, "$lt": end}})
+        return self._count_range(start, end, batch_size)
+
+    def _count_range(self, start, end, batch_size):
+        """Aggregates tweets in [start, end) by hour and dimensions, upserting rollup docs"""
+        group_id = dict(DIMENSION_EXPRESSIONS)
+        elapsed = {"$subtract": ["$" + TIMESTAMP_FIELD, start]}
+        group_id["t"] = {"$subtract": [elapsed, {"$mod": [elapsed, int(HOUR.total_seconds() * 1000)]}]}
+        pipeline = [
+            {"$match": {TIMESTAMP_FIELD: {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+        ]
+
+        ops, written = [], 0
+        for group in self.tweet_collection.aggregate(pipeline, allowDiskUse=True):
+            key = {"bucket": start + timedelta(milliseconds=group["_id"]["t"])}
+            for d in DIMENSIONS:
+                key[d] = group["_id"].get(d, False)
+            # Ranges never overlap, so $set (rather than $inc) keeps retries idempotent
+            ops.append(UpdateOne(key, {"$set": {"count": group["count"]}}, upsert=True))
+            if len(ops) >= batch_size:
+                self.collection.bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+            written += len(ops)
+        return written
+
+    def _iter_buckets(self, start, end, filters):
+        query = dict((d, v) for d, v in filters.items() if v is not None)
+        unknown = set(query) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError("Unknown rollup dimensions: {0}".format(sorted(unknown)))
+        query["bucket"] = {"$gte": start, "$lt": end}
+        return self.collection.find(query, projection=dict((f, True) for f in
+            ["bucket", "count"] + DIMENSIONS))
+
+    def count(self, start, end, **filters):
+        """
+        Returns number of tweets in [start, end). Keyword arguments filter on dimension
+        values, eg: count(start, end, lang="en", retweet=False).
+        """
+        return sum(doc["count"] for doc in self._iter_buckets(start, end, filters))
+
+    def bucket_counts(self, start, step, num_steps, **filters):
+        """As aggregation.bucket_counts, with dimension filters as in count()"""
+        counts = [0] * num_steps
+        seconds = step.total_seconds()
+        for doc in self._iter_buckets(start, start + num_steps * step, filters):
+            counts[int((doc["bucket"] - start).total_seconds() // seconds)] += doc["count"]
+        return counts
+
+    def bucket_counts_by(self, start, step, num_steps, dimension="lang", values=None,
+        other="other", **filters):
+        """As aggregation.bucket_counts_by, split by a rollup dimension"""
+        if dimension not in DIMENSIONS:
+            raise ValueError("Unknown rollup dimension '{0}'".format(dimension))
+        counts = OrderedDict((v, [0] * num_steps) for v in (values or []))
+        if values:
+            counts[other] = [0] * num_steps
+        seconds = step.total_seconds()
+        for doc in self._iter_buckets(start, start + num_steps * step, filters):
+            value = doc[dimension]
+            if values and value not in counts:
+                value = other
+            if value not in counts:
+                counts[value] = [0] * num_steps
+            counts[value][int((doc["bucket"] - start).total_seconds() // seconds)] += doc["count"]
+        return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+    from pymongo.errors import ConnectionFailure
+
+    parser = argparse.ArgumentParser(description="Update hourly tweet count rollup of a collection")
+    parser.add_argument("-s", "--host", action="store", dest="host", default="localhost",
+        help="Database server host (default localhost)")
+    parser.add_argument("-p", "--port", action="store", type=int, dest="port", default=27017,
+        help="Database server port (default 27017)")
+    parser.add_argument("-u", "--user", action="store", dest="user", default=None,
+        help="Database username (default None, ok when username + pass not required")
+    parser.add_argument("-w", "--password", action="store", dest="password", default=None,
+        help="Database password (default None, ok when username + pass not required")
+    parser.add_argument("-d", "--db", action="store", dest="database", required=True,
+        help="Database containing tweet collection")
+    parser.add_argument("-c", "--collection", action="store", dest="collection", required=True,
+        help="Collection of tweets to roll up")
+    parser.add_argument("-r", "--rollup_collection", action="store", dest="rollup_collection",
+        default=None, help="Collection to store rollup in (default <collection>_rollup)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mc = MongoClient(args.host, args.port)
+    db = mc[args.database]
+    if args.user and args.password:
+        if not db.authenticate(args.user, args.password):
+            raise ConnectionFailure(
+                "Mongo DB Authentication for User {0}, DB {1} failed".format(args.user, args.database))
+    rollup = TweetRollup(db[args.rollup_collection or args.collection + "_rollup"],
+        db[args.collection])
+    print "Wrote {0} rollup buckets".format(rollup.update())
@@ -5,9 +5,18 @@ Contains smappPy functionality for storing tweets to file, database, etc
 @date 2/24/2014
 """
 
+import os
+import time
+import gzip
+import shutil
+import threading
+from Queue import Queue
 from simplejson import dumps as json_dumps
+from bson import BSON
 from bson.json_util import dumps as bson_dumps
 
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+
 def tweets_to_file(tweets, tweetfile, append=False, pure_json=False, pretty=False):
     """
     Exports a collection (iterable) of tweets to given file. Exports tweets in mongoDB
@@ -53,6 +62,214 @@ def tweets_to_json(tweets, tweetfile, append=False, pretty=False):
             handle.write(json_dumps(tweet) + "\n")
     handle.close()
 
+def tweets_to_columns(tweets, path, columns=None, format="numpy", chunk_size=50000):
+    """
+    Exports a collection of tweets (any iterable of tweet objects) to columnar storage
+    at 'path': one column per field, readable column-by-column with
+    smappPy.columnar.read_columns. 'columns' is a list of (name, kind, field) tuples
+    (default columnar.DEFAULT_COLUMNS: ids, timestamp, lang, text, retweet, hashtags,
+    coordinates). 'format' is "numpy" (a directory of memory-mappable column files)
+    or "parquet" (a file, requires pyarrow). Returns number of tweets written.
+    """
+    from smappPy.columnar import ColumnarWriter, DEFAULT_COLUMNS
+    with ColumnarWriter(path, columns or DEFAULT_COLUMNS, format, chunk_size) as writer:
+        writer.write_all(tweets)
+    return writer.rows
+
+def _compressed_writer(handle, compression, level=None):
+    """
+    Returns file-like object writing to open binary 'handle' with given compression
+    (None, "gzip", "zstd" (requires zstandard) or "lz4" (requires lz4)). Closing it
+    finishes the compressed stream, but may leave handle open.
+    """
+    if compression is None:
+        return handle
+    elif compression == "gzip":
+        return gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=level or 6)
+    elif compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(handle)
+    elif compression == "lz4":
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(handle, mode="wb", compression_level=level or 0)
+    raise ValueError("Unknown compression '{0}'".format(compression))
+
+
+class RotatingTweetWriter(object):
+    """
+    Writes tweets to a series of (optionally compressed) files, starting a new file
+    when the current one reaches 'max_bytes' (uncompressed) or its time window of
+    'max_seconds' (aligned to the clock, eg: 3600 gives hourly files) ends.
+
+    Files are named <prefix><UTC open time>_<sequence><extension>, eg:
+    "data/tweets_20140101-120000_0000.json.gz", and written under a ".tmp" name that is
+    renamed once the file is complete, so readers never see partial files.
+    Serialized tweets are buffered and written 'buffer_size' bytes at a time.
+    'compression' is None, "gzip", "zstd" or "lz4", at compression 'level' (default:
+    the library's). With background=True, files are written uncompressed and
+    compressed by a background thread after rotation, keeping compression off the
+    writing thread; until then they keep a ".raw" name.
+
+    Files are rotated on write() and flush(), so call flush() periodically if the
+    current file should be finished at the end of its time window while no tweets
+    arrive.
+
+    Use as a context manager, or call close() when done. Subclasses define the
+    serialization (see JsonTweetWriter, BsonTweetWriter).
+    """
+
+    extension = ""
+
+    def __init__(self, prefix, compression="gzip", level=None, max_bytes=None, max_seconds=None,
+        buffer_size=1 << 20, background=False):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError("Unknown compression '{0}'".format(compression))
+        self.prefix = prefix
+        self.compression = compression
+        self.level = level
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.buffer_size = buffer_size
+        self.background = background
+        self.files = []
+
+        self._sequence = 0
+        self._buffer, self._buffered = [], 0
+        self._handle = self._stream = None
+        self._queue = self._thread = None
+        self._error = None
+        if background and compression is not None:
+            self._queue = Queue()
+            self._thread = threading.Thread(target=self._compress_files)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def serialize(self, tweet):
+        """Returns tweet as a byte string, for writing"""
+        raise NotImplementedError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, tweet):
+        if self._handle is None or self._should_rotate():
+            self._rotate()
+        data = self.serialize(tweet)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._written += len(data)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+    def write_all(self, tweets):
+        for tweet in tweets:
+            self.write(tweet)
+
+    def flush(self):
+        """
+        Writes buffered tweets to the current file, finishing the file if its time
+        window has ended (the next write() starts a new one)
+        """
+        if self._handle is None:
+            return
+        if self.max_seconds and time.time() >= self._window_end:
+            self._finish_file()
+        else:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if self._buffer:
+            self._stream.write(b"".join(self._buffer))
+            self._buffer, self._buffered = [], 0
+
+    def close(self):
+        """Finishes the current file and waits for background compression"""
+        self._finish_file()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def _should_rotate(self):
+        if self.max_bytes and self._written >= self.max_bytes:
+            return True
+        return self.max_seconds and time.time() >= self._window_end
+
+    def _rotate(self):
+        self._finish_file()
+        now = time.time()
+        name = "{0}{1}_{2:04d}{3}".format(self.prefix, time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)),
+            self._sequence, self.extension)
+        self._sequence += 1
+        if self.max_seconds:
+            self._window_end = (now // self.max_seconds + 1) * self.max_seconds
+        self._path = name + COMPRESSION_EXTENSIONS[self.compression]
+        self._raw_path = name + ".raw" if self._queue is not None else self._path
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._handle = open(self._raw_path + ".tmp", "wb")
+        compression = None if self._queue is not None else self.compression
+        self._stream = _compressed_writer(self._handle, compression, self.level)
+        self._written = 0
+
+    def _finish_file(self):
+        if self._handle is None:
+            return
+        self._write_buffer()
+        self._stream.close()
+        if not self._handle.closed:
+            self._handle.close()
+        os.rename(self._raw_path + ".tmp", self._raw_path)
+        if self._queue is not None:
+            self._queue.put((self._raw_path, self._path))
+        else:
+            self.files.append(self._path)
+        self._handle = self._stream = None
+
+    def _compress_files(self):
+        """Background thread: compresses finished raw files, then removes them"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            raw_path, path = item
+            try:
+                with open(raw_path, "rb") as raw, open(path + ".tmp", "wb") as handle:
+                    stream = _compressed_writer(handle, self.compression, self.level)
+                    shutil.copyfileobj(raw, stream, 1 << 20)
+                    stream.close()
+                os.rename(path + ".tmp", path)
+                os.remove(raw_path)
+                self.files.append(path)
+            except Exception as e:
+                self._error = e
+
+
+class JsonTweetWriter(RotatingTweetWriter):
+    """RotatingTweetWriter of line-separated JSON (as tweets_to_json)"""
+
+    extension = ".json"
+
+    def serialize(self, tweet):
+        data = json_dumps(tweet) + "\n"
+        return data.encode("utf8") if isinstance(data, unicode) else data
+
+
+class BsonTweetWriter(RotatingTweetWriter):
+    """RotatingTweetWriter of concatenated BSON documents (eg: for bson.decode_file_iter)"""
+
+    extension = ".bson"
+
+    def serialize(self, tweet):
+        return BSON.encode(tweet)
+
+
 def tweets_to_db(server, port, user, password, database, collection, tweets):
     """"""
     raise NotImplementedError("Not yet implemented")
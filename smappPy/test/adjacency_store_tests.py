@@ -0,0 +1,98 @@
+"""
+Unit tests for `networks.adjacency_store` module (encoding, storage and CSR files).
+"""
+
+import os
+import tempfile
+import numpy as np
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from scipy.sparse import csr_matrix
+from smappPy.networks.adjacency_store import AdjacencyStore, encode_neighbors, decode_neighbors, \
+    write_csr, load_csr, IN, OUT
+
+
+def test_encode_decode_roundtrip_sorts_and_dedups():
+    ids = [2**62 + 5, 17, 3, 17, 1000000000000]
+    decoded = decode_neighbors(encode_neighbors(ids))
+    eq_([3, 17, 1000000000000, 2**62 + 5], [int(i) for i in decoded])
+
+def test_encode_decode_empty():
+    eq_(0, len(decode_neighbors(encode_neighbors([]))))
+
+def test_encoding_is_compact_for_dense_ids():
+    ids = range(10**12, 10**12 + 20000, 2)
+    ok_(len(encode_neighbors(ids)) < len(ids))
+
+def test_csr_file_roundtrip_with_mmap():
+    matrix = csr_matrix(np.array([[0, 1, 1], [0, 0, 1], [1, 0, 0]], dtype=np.int8))
+    node_ids = np.array([10, 20, 30], dtype=np.uint64)
+    filename = os.path.join(tempfile.mkdtemp(), "net.npz")
+    write_csr(filename, matrix, node_ids)
+
+    for mmap_mode in (None, "r"):
+        loaded, loaded_ids = load_csr(filename, mmap_mode=mmap_mode)
+        eq_([10, 20, 30], list(loaded_ids))
+        eq_(0, (loaded != matrix).nnz)
+
+def test_csr_file_reload_after_rewrite():
+    filename = os.path.join(tempfile.mkdtemp(), "net.npz")
+    write_csr(filename, csr_matrix(np.array([[0, 1], [0, 0]], dtype=np.int8)),
+        np.array([10, 20], dtype=np.uint64))
+    load_csr(filename)
+
+    matrix = csr_matrix(np.array([[0, 1, 1], [1, 0, 0], [0, 1, 0]], dtype=np.int8))
+    write_csr(filename, matrix, np.array([1, 2, 3], dtype=np.uint64))
+    loaded, loaded_ids = load_csr(filename)
+    eq_([1, 2, 3], list(loaded_ids))
+    eq_(0, (loaded != matrix).nnz)
+
+def test_csr_file_empty_and_compressed():
+    filename = os.path.join(tempfile.mkdtemp(), "net.npz")
+    write_csr(filename, csr_matrix((0, 0), dtype=np.int8), np.array([], dtype=np.uint64))
+    loaded, loaded_ids = load_csr(filename)
+    eq_((0, 0), loaded.shape)
+
+    # Compressed archives can't be memory-mapped, and are read in full
+    matrix = csr_matrix(np.array([[0, 1], [1, 0]], dtype=np.int8))
+    np.savez_compressed(filename, indptr=matrix.indptr, indices=matrix.indices,
+        node_ids=np.array([5, 6], dtype=np.uint64))
+    loaded, loaded_ids = load_csr(filename)
+    eq_([5, 6], list(loaded_ids))
+    eq_(0, (loaded != matrix).nnz)
+
+def _collection():
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    return mongomock.MongoClient().db.adjacency
+
+def test_recrawl_merges_neighbors():
+    """Re-crawls merge overlapping ids into users' neighbors, across chunks"""
+    collection = _collection()
+    store = AdjacencyStore(collection, chunk_size=3)
+    eq_({1: 4, 2: 1}, store.add_many({1: [10, 11, 12, 13], 2: [10]}, OUT))
+    eq_({1: 6, 3: 0}, store.add_many({1: [12, 13, 14, 9], 3: []}, OUT))
+    store.add_many({10: [1, 2]}, IN)
+
+    eq_([9, 10, 11, 12, 13, 14], list(store.neighbors(1, OUT)))
+    eq_([], list(store.neighbors(3, OUT)))
+    eq_([0, 1], [d["chunk"] for d in collection.find({"id": 1}, sort=[("chunk", 1)])])
+    eq_([3, 3], [d["n"] for d in collection.find({"id": 1}, sort=[("chunk", 1)])])
+
+    edges = list(store.iter_edges())
+    eq_([(1, 9), (1, 10), (1, 11), (1, 12), (1, 13), (1, 14), (2, 10), (1, 10), (2, 10)], edges)
+    matrix, node_ids = store.to_scipy()
+    eq_([1, 2, 9, 10, 11, 12, 13, 14], list(node_ids))
+    eq_(set((s, t) for s, t in edges), set((int(node_ids[r]), int(node_ids[c])) for r, c in zip(*matrix.nonzero())))
+    eq_(7, matrix.nnz)
+
+def test_rechunked_user_drops_extra_chunks():
+    collection = _collection()
+    AdjacencyStore(collection, chunk_size=2).add_neighbors(1, range(5))
+    eq_(3, collection.find({"id": 1}).count())
+    store = AdjacencyStore(collection, chunk_size=10)
+    eq_(6, store.add_neighbors(1, [5]))
+    eq_(1, collection.find({"id": 1}).count())
+    eq_(range(6), list(store.neighbors(1)))
@@ -0,0 +1,36 @@
+"""
+Unit tests for `aggregation` module (client-side streaming counts).
+"""
+
+from datetime import datetime, timedelta
+from nose.tools import *
+from smappPy.aggregation import bucket_counts, bucket_counts_by, user_counts
+
+START = datetime(2014, 1, 1)
+DAY = timedelta(days=1)
+
+TWEETS = [
+    {"timestamp": START + timedelta(hours=1), "lang": "en", "user": {"id": 1}},
+    {"timestamp": START + timedelta(hours=2), "lang": "tr", "user": {"id": 1}},
+    {"created_at": "Thu Jan 02 10:00:00 +0000 2014", "lang": "es", "user": {"id": 2}},
+    {"timestamp": START + timedelta(days=2, hours=3), "user": {"id": 3}},
+    {"timestamp": START - timedelta(hours=1), "lang": "en", "user": {"id": 2}},
+    {"timestamp": START + timedelta(days=5), "lang": "en"},
+]
+
+def test_bucket_counts_skip_out_of_range():
+    eq_([2, 1, 1], bucket_counts(TWEETS, START, DAY, 3))
+
+def test_bucket_counts_by_value_with_other():
+    counts = bucket_counts_by(TWEETS, START, DAY, 3, values=["en", "tr"])
+    eq_(["en", "tr", "other"], list(counts.keys()))
+    eq_([1, 0, 0], counts["en"])
+    eq_([0, 1, 1], counts["other"])
+
+def test_bucket_counts_by_missing_value():
+    counts = bucket_counts_by(TWEETS, START, DAY, 3)
+    eq_([0, 0, 1], counts["unk"])
+
+def test_user_counts():
+    eq_({1: 2, 2: 1, 3: 1}, user_counts(TWEETS, START, START + 3 * DAY))
+    eq_({1: 2, 2: 2, 3: 1}, user_counts(TWEETS))
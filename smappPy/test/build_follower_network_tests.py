@@ -0,0 +1,133 @@
+"""
+Unit tests for `networks.build_follower_network` module (breadth-first crawl).
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import numpy as np
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from tweepy import TweepError
+from smappPy.tweepy_pool import APIPool
+from smappPy.networks import build_follower_network as network
+from smappPy.networks.adjacency_store import AdjacencyStore, IN
+
+OAUTH_DICT = {
+        "consumer_key"        : "12345",
+        "consumer_secret"     : "23456",
+        "access_token"        : "34567",
+        "access_token_secret" : "45678"
+    }
+
+# user id -> follower ids. Users 7 and 8 can't be looked up (eg: deleted)
+FOLLOWERS = {1: [2, 3], 2: [4], 3: [4, 5], 4: [1], 5: [6, 7, 8], 6: [], 7: [], 8: []}
+MISSING = set([7, 8])
+
+
+class _User(object):
+
+    def __init__(self, user_id):
+        self._json = {"id": user_id, "created_at": "Thu Jan 01 00:00:00 +0000 2015",
+            "followers_count": len(FOLLOWERS[user_id]), "friends_count": 0}
+
+
+class _FakeAPI(object):
+    """Stands in for a tweepy API over the FOLLOWERS graph, recording lookups"""
+
+    def __init__(self):
+        self.lookups = []
+
+    def lookup_users(self, user_ids):
+        self.lookups.append(sorted(user_ids))
+        if MISSING & set(user_ids):
+            raise TweepError([{"message": "No user matches for specified terms.", "code": 17}])
+        return [_User(i) for i in user_ids]
+
+    def followers_ids(self, id, cursor=-1):
+        return FOLLOWERS[id], (0, 0)
+    followers_ids.pagination_mode = "cursor"
+
+    def friends_ids(self, id, cursor=-1):
+        return [], (0, 0)
+    friends_ids.pagination_mode = "cursor"
+
+
+def _collections():
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    db = mongomock.MongoClient().db
+    return db.users, AdjacencyStore(db.adjacency)
+
+def test_crawl_bfs_retries_failed_lookups():
+    """
+    A lookup failing on some users of a batch should only drop those users, which are
+    returned, and the crawl should continue with the rest of the batch.
+    """
+    users, store = _collections()
+    failed = network.crawl_bfs(users, store, [1], _FakeAPI(), depth=3, num_workers=2)
+    eq_([7, 8], sorted(failed))
+    eq_([1, 2, 3, 4, 5, 6], sorted(u["id"] for u in users.find()))
+    eq_([6, 7, 8], list(store.neighbors(5, IN)))
+    eq_(0, users.find({"sampled_followers": {"$ne": True}}).count())
+
+def test_crawl_bfs_state_resumes_and_cleans_up():
+    users, store = _collections()
+    state_dir = tempfile.mkdtemp()
+    try:
+        network.crawl_bfs(users, store, [1], _FakeAPI(), depth=1, state_dir=state_dir, batch_size=1)
+        level, frontier, visited = network._load_bfs_state(state_dir)
+        eq_(2, level)
+        eq_([1, 2, 3], list(visited))
+        eq_(["frontier.npy", "level.npy", "visited.npy"], sorted(os.listdir(state_dir)))
+
+        # A crash between persisting the next level's state and removing its parts
+        # leaves parts behind, which a resumed crawl must not reuse for the level after
+        network._save_array(os.path.join(state_dir, "next_2_0.npy"), np.asarray([4, 5]))
+        api = _FakeAPI()
+        network.crawl_bfs(users, store, [1], api, depth=1, state_dir=state_dir)
+        eq_([], api.lookups)
+        ok_(not os.path.exists(os.path.join(state_dir, "next_2_0.npy")))
+    finally:
+        shutil.rmtree(state_dir)
+
+def test_crawl_bfs_parts_are_per_crawl():
+    """Crawls without a state_dir keep the next level's ids to themselves, also if they fail"""
+    class _BrokenAPI(_FakeAPI):
+        def lookup_users(self, user_ids):
+            if 2 in user_ids:
+                raise RuntimeError("connection lost")
+            return _FakeAPI.lookup_users(self, user_ids)
+
+    users, store = _collections()
+    assert_raises(RuntimeError, network.crawl_bfs, users, store, [1, 2], _BrokenAPI(), depth=1, batch_size=1)
+    users, store = _collections()
+    network.crawl_bfs(users, store, [4], _FakeAPI(), depth=1)
+    eq_([1, 4], sorted(u["id"] for u in users.find()))
+
+def test_crawl_bfs_workers_get_own_apis():
+    """Given an APIPool, worker threads fetch with disjoint shares of its apis"""
+    users, store = _collections()
+    users.insert_many([_User(i)._json for i in range(1, 9)])
+    pool = APIPool([OAUTH_DICT, OAUTH_DICT], use_appauth=False)
+    calls = []
+    def fetch(user, edges_collection, twitter_api):
+        calls.append((threading.current_thread().name, twitter_api))
+        time.sleep(0.01)
+        return [], FOLLOWERS[user['id']]
+
+    original = network.ensure_users_edges_in_db
+    network.ensure_users_edges_in_db = fetch
+    try:
+        network.crawl_bfs(users, store, range(1, 9), pool, depth=0, num_workers=2)
+    finally:
+        network.ensure_users_edges_in_db = original
+    eq_(8, len(calls))
+    apis_by_thread = dict((name, api._apis[0][0]) for name, api in calls)
+    eq_(2, len(apis_by_thread))
+    eq_(2, len(set(apis_by_thread.values())))
+    ok_(all(len(api._apis) == 1 for _, api in calls))
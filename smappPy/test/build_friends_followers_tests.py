@@ -0,0 +1,92 @@
+"""
+Unit tests for `user_collection.build_friends_followers` module (streamed friend/follower IDs).
+"""
+
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from tweepy import TweepError
+from smappPy.networks.adjacency_store import AdjacencyStore, IN, OUT
+from smappPy.user_collection.build_friends_followers import fetch_and_store_ids
+from smappPy.user_collection.network_edges import ensure_edge_indexes
+from smappPy.user_collection.userdocs import ensure_userdoc_indexes
+
+SEED = 100
+# Pages of IDs returned by the fake api method. 3 is on two pages
+PAGES = [[1, 2, 3], [3, 4, 5], [6]]
+
+
+class _PagedIds(object):
+    """
+    Stands in for a tweepy api ids method (eg: api.followers_ids), returning PAGES. Records
+    the number of users stored when each page is requested. Fails on page 'fail_page'.
+    """
+
+    pagination_mode = "cursor"
+
+    def __init__(self, users, fail_page=None):
+        self.users = users
+        self.fail_page = fail_page
+        self.stored_at_page = []
+
+    def __call__(self, user_id, cursor=-1):
+        eq_(SEED, user_id)
+        page = 0 if cursor == -1 else cursor
+        self.stored_at_page.append(self.users.count())
+        if page == self.fail_page:
+            raise TweepError([{"message": "Internal error", "code": 131}])
+        next_cursor = page + 1 if page + 1 < len(PAGES) else 0
+        return PAGES[page], (page - 1, next_cursor)
+
+
+def _collections():
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    db = mongomock.MongoClient().db
+    ensure_userdoc_indexes(db.users)
+    ensure_edge_indexes(db.edges)
+    return db.users, db.edges, AdjacencyStore(db.adjacency)
+
+def _edges(collection):
+    return sorted((e["from"], e["to"]) for e in collection.find())
+
+def test_ids_stored_as_pages_stream_in():
+    users, edges, _ = _collections()
+    api_method = _PagedIds(users)
+    eq_((0, [1, 2, 3, 3, 4, 5, 6]), fetch_and_store_ids(api_method, SEED, users, edges, chunk_size=2))
+    # Each page is requested once the chunks before it are stored
+    eq_([0, 2, 5], api_method.stored_at_page)
+    eq_([1, 2, 3, 4, 5, 6], sorted(u["id"] for u in users.find()))
+
+def test_rerun_tolerates_duplicates():
+    """Duplicates within a bulk insert, or from a previous run, are skipped"""
+    users, edges, _ = _collections()
+    for _ in range(2):
+        eq_(0, fetch_and_store_ids(_PagedIds(users), SEED, users, edges, chunk_size=4)[0])
+        eq_(6, users.count())
+        eq_(6, edges.count())
+
+def test_edge_direction():
+    users, edges, store = _collections()
+    fetch_and_store_ids(_PagedIds(users), SEED, users, edges, seed_is_source=True)
+    eq_([(SEED, i) for i in range(1, 7)], _edges(edges))
+
+    users, edges, store = _collections()
+    fetch_and_store_ids(_PagedIds(users), SEED, users, edges, seed_is_source=False)
+    eq_([(i, SEED) for i in range(1, 7)], _edges(edges))
+
+    fetch_and_store_ids(_PagedIds(users), SEED, users, store, seed_is_source=False)
+    eq_(range(1, 7), list(store.neighbors(SEED, IN)))
+    eq_([], list(store.neighbors(SEED, OUT)))
+
+def test_failed_page_keeps_earlier_pages():
+    users, edges, store = _collections()
+    code, ids = fetch_and_store_ids(_PagedIds(users, fail_page=1), SEED, users, edges, chunk_size=3)
+    eq_(131, code)
+    eq_([1, 2, 3], ids)
+    eq_([1, 2, 3], sorted(u["id"] for u in users.find()))
+    eq_([(SEED, 1), (SEED, 2), (SEED, 3)], _edges(edges))
+
+    fetch_and_store_ids(_PagedIds(users, fail_page=1), SEED, users, store, chunk_size=3)
+    eq_([1, 2, 3], list(store.neighbors(SEED, OUT)))
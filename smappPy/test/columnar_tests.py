@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for `columnar` module (columnar tweet export and reading).
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from datetime import datetime
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy.store_tweets import tweets_to_columns
+from smappPy.columnar import ColumnarWriter, read_columns
+
+TWEETS = [
+    {"id": 1, "created_at": "Wed Aug 27 13:08:45 +0000 2008", "lang": "en", "text": u"hello #a #b",
+     "user": {"id": 10}, "entities": {"hashtags": [{"text": u"a"}, {"text": u"b"}]}},
+    {"id": 2, "timestamp": datetime(2014, 1, 1, 12), "lang": "tr", "text": u"caf\xe9 #b",
+     "user": {"id": 11}, "entities": {"hashtags": [{"text": u"b"}]},
+     "retweeted_status": {"user": {"id": 10}}, "coordinates": {"coordinates": [29.0, 41.0]}},
+    {"id": 3, "created_at": "Thu Jan 02 10:00:00 +0000 2014", "text": u"", "user": {"id": 12},
+     "entities": {"hashtags": []}},
+]
+
+def _check(columns):
+    eq_([1, 2, 3], list(columns["id"]))
+    eq_([-1, 10, -1], list(columns["retweeted_user_id"]))
+    eq_([False, True, False], list(columns["is_retweet"]))
+    eq_(np.datetime64("2014-01-01T12:00:00.000"), columns["timestamp"][1])
+    eq_([u"en", u"tr", None], columns["lang"].tolist())
+    eq_([u"hello #a #b", u"caf\xe9 #b", u""], columns["text"].tolist())
+    eq_([[u"a", u"b"], [u"b"], []], columns["hashtags"].tolist())
+    ok_(np.isnan(columns["longitude"][0]) and columns["longitude"][1] == 29.0)
+
+def test_numpy_round_trip_across_chunks():
+    path = tempfile.mkdtemp()
+    try:
+        eq_(3, tweets_to_columns(TWEETS, path, chunk_size=2))
+        _check(read_columns(path))
+        columns = read_columns(path, ["lang"])
+        eq_(["lang"], list(columns))
+        ok_(isinstance(columns["lang"].codes, np.memmap))
+    finally:
+        shutil.rmtree(path)
+
+def test_numpy_empty():
+    path = tempfile.mkdtemp()
+    try:
+        eq_(0, tweets_to_columns([], path))
+        eq_([], read_columns(path)["text"].tolist())
+    finally:
+        shutil.rmtree(path)
+
+def test_parquet_round_trip():
+    try:
+        import pyarrow
+    except ImportError:
+        raise SkipTest("pyarrow not installed")
+    path = os.path.join(tempfile.mkdtemp(), "tweets.parquet")
+    try:
+        eq_(3, tweets_to_columns(TWEETS, path, format="parquet", chunk_size=2))
+        table = read_columns(path, ["id", "lang", "hashtags"])
+        eq_([1, 2, 3], table.column("id").to_pylist())
+        eq_([u"en", u"tr", None], table.column("lang").to_pylist())
+        eq_([[u"a", u"b"], [u"b"], []], table.column("hashtags").to_pylist())
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+def test_close_is_idempotent():
+    formats = ["numpy"]
+    try:
+        import pyarrow
+        formats.append("parquet")
+    except ImportError:
+        pass
+    directory = tempfile.mkdtemp()
+    try:
+        for fmt in formats:
+            path = os.path.join(directory, "tweets_" + fmt)
+            with ColumnarWriter(path, format=fmt, chunk_size=2) as writer:
+                writer.write_all(TWEETS)
+            writer.close()
+            assert_raises(ValueError, writer.write, TWEETS[0])
+            eq_([1, 2, 3], list(read_columns(path, ["id"])["id"]) if fmt == "numpy" else
+                read_columns(path, ["id"]).column("id").to_pylist())
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,67 @@
+"""
+Unit tests for `networks.build_cooccurrence_network` (hashtag and mention networks).
+"""
+
+from nose.tools import *
+from smappPy.networks.build_cooccurrence_network import PairCounter, split_keys, \
+    build_hashtag_network, build_mention_network, count_hashtag_pairs, count_mention_pairs, \
+    iter_weighted_edges, StringInterner
+
+
+def _tweet(user, hashtags=(), mentions=()):
+    return {"user": {"screen_name": user},
+            "entities": {"hashtags": [{"text": h} for h in hashtags],
+                         "user_mentions": [{"screen_name": m} for m in mentions]}}
+
+TWEETS = [
+    _tweet("a", ["NYC", "vote", "nyc"], ["b", "c"]),
+    _tweet("a", ["nyc", "vote"], ["b", "a"]),
+    _tweet("b", ["vote", "election"], ["a"]),
+    _tweet("c"),
+]
+
+def test_hashtag_network_weights():
+    graph = build_hashtag_network(TWEETS)
+    eq_(2, graph["nyc"]["vote"]["weight"])
+    eq_(1, graph["vote"]["election"]["weight"])
+    ok_(not graph.has_edge("nyc", "election"))
+
+def test_hashtag_network_min_weight_prunes():
+    graph = build_hashtag_network(TWEETS, min_weight=2)
+    eq_([("nyc", "vote")], [tuple(sorted(e)) for e in graph.edges()])
+
+def test_mention_network_is_directed_without_self_mentions():
+    graph = build_mention_network(TWEETS)
+    eq_(2, graph["a"]["b"]["weight"])
+    eq_(1, graph["b"]["a"]["weight"])
+    eq_(1, graph["a"]["c"]["weight"])
+    ok_(not graph.has_edge("a", "a"))
+
+def test_messages_without_user_skipped():
+    graph = build_mention_network(TWEETS + [{"delete": {"status": {"id": 1}}}, {"limit": {"track": 5}}])
+    eq_(3, graph.number_of_edges())
+
+def test_given_empty_interner_is_shared():
+    interner = StringInterner()
+    _, hashtags = count_hashtag_pairs(TWEETS, interner=interner)
+    ok_(hashtags is interner)
+    _, users = count_mention_pairs(TWEETS, interner=interner)
+    ok_(users is interner)
+    eq_(["nyc", "vote", "election", "a", "b", "c"], interner.strings)
+
+def test_spilled_counts_match_in_memory_counts():
+    tweets = TWEETS * 50
+    counter = PairCounter(buffer_size=7, max_pairs_in_memory=1, num_partitions=3)
+    counter, interner = count_hashtag_pairs(tweets, counter)
+    spilled = sorted(iter_weighted_edges(counter, interner))
+    counter.close()
+    counter, interner = count_hashtag_pairs(tweets)
+    eq_(sorted(iter_weighted_edges(counter, interner)), spilled)
+    eq_((100, "nyc", "vote"), max((w, a, b) for a, b, w in spilled))
+
+def test_split_keys():
+    counter = PairCounter()
+    counter.add(3, 2**31 + 5)
+    keys, counts = next(counter.iter_counts())
+    a, b = split_keys(keys)
+    eq_((3, 2**31 + 5, 1), (a[0], b[0], counts[0]))
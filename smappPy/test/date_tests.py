@@ -0,0 +1,61 @@
+"""
+Unit tests for `date` module (twitter date string parsing).
+"""
+
+import numpy as np
+from datetime import datetime
+from nose.tools import *
+from smappPy.date import mongodate_to_datetime, parse_twitter_date, mongodates_to_datetime64, \
+    mongo_date_format
+
+DATES = ["Wed Aug 27 13:08:45 +0000 2008", "Sat Feb 29 00:00:00 +0000 2020",
+         "Tue Dec 31 23:59:59 +0000 2013", u"Mon Jan 05 07:06:05 +0000 2015"]
+
+def test_parse_matches_strptime():
+    for d in DATES:
+        eq_(datetime.strptime(d, mongo_date_format), parse_twitter_date(d))
+
+def test_cached_parse_matches_strptime():
+    for _ in range(2):
+        for d in DATES:
+            eq_(datetime.strptime(d, mongo_date_format), mongodate_to_datetime(d))
+
+@raises(ValueError)
+def test_parse_rejects_other_offsets():
+    parse_twitter_date("Wed Aug 27 13:08:45 +0100 2008")
+
+def test_vectorized_parse_matches_strptime():
+    parsed = mongodates_to_datetime64(DATES)
+    eq_([datetime.strptime(d, mongo_date_format) for d in DATES], parsed.tolist())
+    eq_(np.dtype("datetime64[s]"), parsed.dtype)
+
+def test_vectorized_parse_empty():
+    eq_(0, len(mongodates_to_datetime64([])))
+
+@raises(ValueError)
+def test_vectorized_parse_rejects_malformed():
+    mongodates_to_datetime64(DATES + ["Wed Aug 27 13:08:45 +0000 20088"])
+
+MALFORMED = ["Wed Aug 27 13:08:45 +0000 20088", "Wed Aug 27 13-08-45 +0000 2008",
+             "Wed Aug 27 13:08:45 +00002 008", "Wed Aug  5 13:08:45 +0000 2008",
+             "Wed Aug 2713:08:45  +0000 2008", "Wed Aug 27 13:08:4x +0000 2008",
+             "Wed Feb 30 13:08:45 +0000 2008", "Wed Aug 27 24:08:45 +0000 2008",
+             "Xyz Aug 27 13:08:45 +0000 2008", "Wed Aug 27 13:08:45 +0000 2008 "]
+
+def test_parse_rejects_malformed_like_strptime():
+    for d in MALFORMED:
+        try:
+            expected = datetime.strptime(d, mongo_date_format)
+        except ValueError:
+            assert_raises(ValueError, parse_twitter_date, d)
+        else:
+            eq_(expected, parse_twitter_date(d))
+
+def test_vectorized_parse_rejects_each_malformed():
+    for d in MALFORMED:
+        assert_raises(ValueError, mongodates_to_datetime64, DATES + [d])
+
+def test_date_module_does_not_import_numpy():
+    import subprocess, sys
+    code = "import sys, smappPy.date; sys.exit('numpy' in sys.modules)"
+    eq_(0, subprocess.call([sys.executable, "-c", code]))
@@ -0,0 +1,50 @@
+"""
+Unit tests for `networks.dynamic_network` (windowed network deltas).
+"""
+
+from datetime import datetime, timedelta
+from nose.tools import *
+from smappPy.networks.dynamic_network import iter_window_deltas, replay, mention_edges
+
+HOUR = timedelta(hours=1)
+
+def _tweet(hour, user, mentions):
+    return {"timestamp": datetime(2014, 1, 1) + timedelta(hours=hour, minutes=10),
+            "user": {"screen_name": user},
+            "entities": {"user_mentions": [{"screen_name": m} for m in mentions]}}
+
+TWEETS = [
+    _tweet(0, "a", ["b"]),
+    _tweet(0, "c", ["b"]),
+    _tweet(1, "a", ["b"]),
+    _tweet(3, "b", ["a", "c"]),
+]
+
+def _windows(deltas):
+    return [(start.hour, dict(weights)) for start, end, weights in replay(deltas)]
+
+def test_tumbling_windows_include_empty_windows():
+    windows = _windows(iter_window_deltas(TWEETS, HOUR, edges=mention_edges))
+    eq_([(0, {("a", "b"): 1, ("c", "b"): 1}),
+         (1, {("a", "b"): 1}),
+         (2, {}),
+         (3, {("b", "a"): 1, ("b", "c"): 1})], windows)
+
+def test_sliding_windows_sum_panes():
+    deltas = list(iter_window_deltas(TWEETS, 2 * HOUR, HOUR, edges=mention_edges))
+    windows = _windows(deltas)
+    eq_({("a", "b"): 2, ("c", "b"): 1}, windows[1][1])
+    eq_({("a", "b"): 1}, windows[2][1])
+    eq_([("a", "b")], deltas[3].removed)
+
+def test_window_stats():
+    deltas = list(iter_window_deltas(TWEETS, 2 * HOUR, HOUR, edges=mention_edges, top_n=1))
+    stats = deltas[1].stats
+    eq_(3, stats["nodes"])
+    eq_(2, stats["edges"])
+    eq_(2 / 6.0, stats["density"])
+    eq_([("b", 2)], stats["top_in_degree"])
+
+@raises(ValueError)
+def test_window_must_be_multiple_of_step():
+    list(iter_window_deltas(TWEETS, 90 * timedelta(minutes=1), HOUR))
@@ -0,0 +1,74 @@
+"""
+Unit tests for `tools.extract_user_data` module.
+"""
+
+import os
+import csv
+import sys
+import tempfile
+from StringIO import StringIO
+from datetime import datetime, timedelta
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy.rollup import TweetRollup
+from smappPy.tools.extract_user_data import extract_user_data
+
+START = datetime(2015, 1, 1, 10, 0)
+HOUR = timedelta(hours=1)
+
+
+def _tweet(i):
+    """Tweet i of user i % 3, 20 minutes after tweet i - 1"""
+    uid = i % 3
+    return {"id": i, "timestamp": START + timedelta(minutes=20 * i),
+            "user": {"id_str": str(uid), "screen_name": "user{0}".format(uid), "name": u"N\xe4me, {0}".format(uid),
+                     "lang": "en", "friends_count": i, "followers_count": 10 * i, "location": "NYC\n"}}
+
+def _collection(tweet_ids=range(12)):
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    db = mongomock.MongoClient().db
+    db.tweets.insert_many([_tweet(i) for i in tweet_ids])
+    return db
+
+def _extract(collection, *args, **kwargs):
+    """Runs extract_user_data, returns tuple (CSV rows by user id, printed output)"""
+    outfile = os.path.join(tempfile.mkdtemp(), "users.csv")
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        extract_user_data(collection, outfile, *args, **kwargs)
+        printed = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    with open(outfile) as handle:
+        rows = list(csv.DictReader(handle))
+    return dict((r["UserId"], r) for r in rows), printed
+
+def test_date_range_and_rollup_count():
+    db = _collection()
+    rollup = TweetRollup(db.rollup, db.tweets)
+    rollup.update(until=START + 4 * HOUR)
+
+    # Tweets 3 (11:00) to 6 (12:00), inclusive
+    end = START + 2 * HOUR
+    users, printed = _extract(db.tweets, START + HOUR, end, rollup=rollup)
+    ok_("Total tweets considered: 4" in printed)
+    eq_(["0", "1", "2"], sorted(users))
+    eq_(["2", "1", "1"], [users[u]["NumTweets"] for u in ("0", "1", "2")])
+    eq_("N\xc3\xa4me 0", users["0"]["Name"])
+    eq_("NYC", users["0"]["Location"])
+
+    # Rollup not used when it does not cover the range: same output
+    uncovered, printed = _extract(db.tweets, START + HOUR, end + timedelta(minutes=1), rollup=rollup)
+    ok_("Total tweets considered: 4" in printed)
+    eq_(users, uncovered)
+
+def test_user_data_from_latest_tweet():
+    """Both modes take each user's data from their latest tweet, whatever the insert order"""
+    db = _collection([7, 1, 10, 4, 2, 5])
+    for aggregate in (False, True):
+        users, _ = _extract(db.tweets, aggregate=aggregate)
+        eq_(["10", "5"], [users[u]["FriendsCount"] for u in ("1", "2")])
+        eq_(["4", "2"], [users[u]["NumTweets"] for u in ("1", "2")])
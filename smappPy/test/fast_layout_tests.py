@@ -0,0 +1,43 @@
+"""
+Unit tests for `networks.fast_layout` module (sparse layout and position cache).
+"""
+
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from nose.tools import *
+from smappPy.networks.fast_layout import sparse_layout, cached_layout
+
+NODES = ["a", "b", "c", "d", "e"]
+EDGES = [("a", "b"), ("b", "c"), ("c", "a"), ("d", "e")]
+
+def _adjacency():
+    index = dict((n, i) for i, n in enumerate(NODES))
+    rows = [index[s] for s, t in EDGES]
+    cols = [index[t] for s, t in EDGES]
+    return sp.coo_matrix((np.ones(len(EDGES)), (rows, cols)), shape=(len(NODES), len(NODES)))
+
+def _positions(pos):
+    return np.array([pos[n] for n in NODES])
+
+def test_cached_layout_matches_sparse_layout():
+    for seed, gravity in [(0, 1.0), (3, 1.0), (3, 0.2)]:
+        expected = sparse_layout(_adjacency(), iterations=20, gravity=gravity, seed=seed)
+        pos = cached_layout(NODES, EDGES, iterations=20, gravity=gravity, seed=seed)
+        ok_(np.allclose(expected, _positions(pos)))
+
+def test_cached_layout_reuses_cache_per_parameters():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        first = _positions(cached_layout(NODES, EDGES, cache_dir, iterations=20, seed=1))
+        ok_(np.allclose(first, _positions(cached_layout(NODES, EDGES, cache_dir, iterations=20, seed=1))))
+        other = _positions(cached_layout(NODES, EDGES, cache_dir, iterations=20, gravity=0.2, seed=1))
+        ok_(np.allclose(sparse_layout(_adjacency(), iterations=20, gravity=0.2, seed=1), other))
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_layout_in_unit_square():
+    pos = sparse_layout(_adjacency(), iterations=20)
+    eq_((len(NODES), 2), pos.shape)
+    ok_(pos.min() >= 0 and pos.max() <= 1)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for `filter_compiler` module (compiled tweet filter specs).
+"""
+
+import re
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy import tweet_filter
+from smappPy.filter_compiler import compile_filter, mongo_query, find_matching
+
+def _tweet(text, location=u"", place=None, coordinates=None):
+    return {"text": text, "user": {"location": location, "description": u"", "screen_name": u"bob"},
+            "place": place, "coordinates": coordinates and {"type": "Point", "coordinates": coordinates}}
+
+TWEETS = [
+    _tweet(u"Protests in Kiev today", u"Kyiv, Ukraine"),
+    _tweet(u"MAIDAN now", u"nyc", coordinates=[30.5, 50.4]),
+    _tweet(u"maidan", u"", place={"full_name": u"Kiev, Ukraine", "country": u"Ukraine"}),
+    _tweet(u"nothing to see", u"Philadelphia", coordinates=[-75.1, 40.0]),
+    _tweet(u"Ice cold, IRA", u"Dublin"),
+    _tweet(u"caf\xe9 ICE", u"Paris", place={"full_name": u"Paris", "country": u"France"}),
+]
+
+def _check(spec, reference):
+    passes = compile_filter(spec)
+    eq_([reference(t) for t in TWEETS], [passes(t) for t in TWEETS])
+
+def test_single_predicates():
+    _check(["field_contains", "text", "maidan", "kiev"],
+           lambda t: tweet_filter.field_contains(t, "text", "maidan", "kiev"))
+    _check({"function": "field_contains", "args": ["text", "ICE"], "kwargs": {"case_sensitive": True}},
+           lambda t: tweet_filter.field_contains(t, "text", "ICE", case_sensitive=True))
+    _check(["field_contains_case_sensitive", "text", "ICE", "IRA"],
+           lambda t: tweet_filter.field_contains_case_sensitive(t, "text", "ICE", "IRA"))
+    _check(["within_geobox", "30.2", 50.2, 30.8, 50.6],
+           lambda t: tweet_filter.within_geobox(t, 30.2, 50.2, 30.8, 50.6))
+    _check(["place_name_contains", "ukraine"],
+           lambda t: tweet_filter.place_name_contains(t, "ukraine"))
+    _check(["field_contains", "text", "caf\xc3\xa9"], lambda t: u"caf\xe9" in t["text"].lower())
+
+def test_and_or_tree():
+    spec = {"or": [
+        ["user_location_contains", "kiev", "kyiv"],
+        ["place_name_contains", "Kiev"],
+        {"and": [["within_geobox", 30.2, 50.2, 30.8, 50.6], ["field_contains", "text", "maidan"]]},
+        ["user_location_contains", "dublin"],
+    ]}
+    def reference(t):
+        return (tweet_filter.user_location_contains(t, "kiev", "kyiv") or
+                tweet_filter.place_name_contains(t, "Kiev") or
+                (tweet_filter.within_geobox(t, 30.2, 50.2, 30.8, 50.6) and
+                 tweet_filter.field_contains(t, "text", "maidan")) or
+                tweet_filter.user_location_contains(t, "dublin"))
+    _check(spec, reference)
+
+def test_empty_and_or():
+    ok_(compile_filter({"and": []})(TWEETS[0]))
+    ok_(not compile_filter({"or": []})(TWEETS[0]))
+
+def test_missing_field_does_not_match():
+    ok_(not compile_filter(["field_contains", "user.name.first", "bob"])(TWEETS[0]))
+    ok_(not compile_filter(["place_name_contains", "kiev"])(TWEETS[0]))
+
+@raises(ValueError)
+def test_unknown_function():
+    compile_filter(["no_such_filter", "x"])
+
+def test_mongo_query_exact_contains():
+    query, residual = mongo_query(["user_location_contains", "kyiv", "u.s.a (east)"])
+    eq_(None, residual)
+    regex = query["user.location"]
+    eq_("i", regex["$options"])
+    pattern = re.compile(regex["$regex"], re.I)
+    ok_(pattern.search(u"Made in the U.S.A (East)") and not pattern.search(u"usa east"))
+
+def test_mongo_query_and_keeps_inexact_residual():
+    query, residual = mongo_query({"and": [["within_geobox", 30.2, 50.2, 30.8, 50.6],
+                                           ["field_contains", "text", "maidan"]]})
+    eq_({"$and": [{"coordinates.coordinates": {"$geoWithin": {"$box": [[30.2, 50.2], [30.8, 50.6]]}}},
+                  {"text": {"$regex": u"maidan", "$options": "i"}}]}, query)
+    eq_([False, True, False, False, False, False], [residual(t) for t in TWEETS])
+
+def test_mongo_query_untranslatable_or():
+    query, residual = mongo_query({"or": [["field_contains", "text", "ice"],
+                                          ["field_contains_case_sensitive", "text", "ICE"]]})
+    eq_({}, query)
+    passes = compile_filter({"or": [["field_contains", "text", "ice"],
+                                    ["field_contains_case_sensitive", "text", "ICE"]]})
+    eq_([passes(t) for t in TWEETS], [residual(t) for t in TWEETS])
+
+def test_empty_or_matches_nothing_in_mongo():
+    """find_matching and mongo_query agree with compile_filter on empty "or"s"""
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    collection = mongomock.MongoClient().db.tweets
+    collection.insert_many([dict(t, id=i) for i, t in enumerate(TWEETS)])
+    for spec in ({"or": []},
+                 {"and": [["field_contains", "text", "maidan"], {"or": []}]},
+                 {"or": [["field_contains", "text", "maidan"], {"or": []}]},
+                 {"or": [["field_contains", "text", "maidan"], {"and": []}]}):
+        passes = compile_filter(spec)
+        expected = [i for i, t in enumerate(TWEETS) if passes(t)]
+        eq_(expected, sorted(t["id"] for t in find_matching(collection, spec)))
+
+        query, residual = mongo_query(spec)
+        eq_(expected, sorted(t["id"] for t in collection.find(query) if residual is None or residual(t)))
@@ -0,0 +1,74 @@
+"""
+Unit tests for `geo_tweet` module (geobox classification).
+"""
+
+import os
+import tempfile
+import numpy as np
+from nose.tools import *
+from smappPy.geo_tweet import GeoBoxSet, GeoIndex, GeoboxException, ContinentsGeoBoxes, USTopTen_DiftStates, \
+    get_tweet_region, get_tweet_regions, get_coordinate_arrays
+
+def _tweet(lon, lat):
+    return {"coordinates": {"type": "Point", "coordinates": [lon, lat]}}
+
+TWEETS = [_tweet(-73.99, 40.73), _tweet(29.0, 41.0), _tweet(0.0, -80.0), {"coordinates": None},
+          {"geo": {"coordinates": [-87.6, 41.8]}}, _tweet(100.0, 30.0)]
+
+def test_classify_matches_get_tweet_region():
+    for regions in [ContinentsGeoBoxes, USTopTen_DiftStates]:
+        expected = [get_tweet_region(t, regions) for t in TWEETS]
+        eq_(expected, get_tweet_regions(TWEETS, regions).tolist())
+        eq_(expected, get_tweet_regions(TWEETS, GeoBoxSet(regions)).tolist())
+
+def test_region_matches_get_tweet_region():
+    boxes = GeoBoxSet(ContinentsGeoBoxes)
+    eq_([get_tweet_region(t) for t in TWEETS], [get_tweet_region(t, boxes) for t in TWEETS])
+
+def test_coordinate_arrays_nan_when_not_geocoded():
+    lons, lats = get_coordinate_arrays(TWEETS)
+    eq_(len(TWEETS), len(lons))
+    ok_(np.isnan(lons[3]) and np.isnan(lats[3]))
+
+def test_classify_in_chunks():
+    boxes = GeoBoxSet(ContinentsGeoBoxes)
+    lons, lats = get_coordinate_arrays(TWEETS * 10)
+    eq_(boxes.classify(lons, lats).tolist(), boxes.classify(lons, lats, chunk_size=7).tolist())
+
+@raises(GeoboxException)
+def test_invalid_box():
+    GeoBoxSet([[10, 0, 5, 1]])
+
+# Unit square with a hole, and a triangle overlapping it
+SQUARE = {"type": "Polygon", "coordinates": [[[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]],
+                                             [[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]]}
+TRIANGLE = [[3, 3], [6, 3], [3, 6]]
+
+def test_index_matches_box_set():
+    rng = np.random.RandomState(0)
+    boxes = [[x, y, x + w, y + h] for x, y, w, h in
+             zip(rng.uniform(-50, 50, 200), rng.uniform(-50, 50, 200), rng.uniform(1, 10, 200), rng.uniform(1, 10, 200))]
+    lons, lats = rng.uniform(-60, 60, 5000), rng.uniform(-60, 60, 5000)
+    eq_(GeoBoxSet(boxes).classify(lons, lats).tolist(), GeoIndex(boxes).classify(lons, lats).tolist())
+
+def test_index_polygons():
+    index = GeoIndex(polygons=[SQUARE, TRIANGLE])
+    eq_([0, -1, 0, 1, 1, -1], index.classify([0.5, 1.5, 3.5, 4.5, 3.2, 5.5], [0.5, 1.5, 3.2, 3.5, 4.5, 5.5]).tolist())
+    eq_(-1, index.region(float("nan"), 1.0))
+
+def test_index_save_load():
+    index = GeoIndex(polygons=[SQUARE, TRIANGLE])
+    fd, path = tempfile.mkstemp(suffix=".npz")
+    os.close(fd)
+    try:
+        index.save(path)
+        loaded = GeoIndex.load(path)
+        lons, lats = np.random.RandomState(1).uniform(-1, 7, (2, 1000))
+        eq_(index.classify(lons, lats).tolist(), loaded.classify(lons, lats).tolist())
+    finally:
+        os.remove(path)
+
+def test_geo_tweet_module_does_not_import_numpy():
+    import subprocess, sys
+    code = "import sys, smappPy.geo_tweet; sys.exit('numpy' in sys.modules)"
+    eq_(0, subprocess.call([sys.executable, "-c", code]))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for `keyword_matcher` module (Aho-Corasick term matching).
+"""
+
+import random
+from nose.tools import *
+from smappPy.keyword_matcher import KeywordMatcher
+from smappPy.tweet_filter import field_contains
+from smappPy.filter_compiler import compile_filter
+
+def test_matches_substring_search():
+    rng = random.Random(0)
+    terms = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(40)]
+    matcher = KeywordMatcher(terms)
+    for _ in range(200):
+        text = u"".join(rng.choice(u"abcABd ") for _ in range(rng.randint(0, 30)))
+        eq_(any(t in text.lower() for t in terms), matcher.search(text))
+        eq_(set(t for t in terms if t in text.lower()), set(matcher.matches(text)))
+
+def test_case_sensitive():
+    matcher = KeywordMatcher(["ICE", "IRA"], case_sensitive=True)
+    eq_(["ICE"], matcher.matches(u"ICE and ice, ira"))
+
+def test_word_boundaries():
+    matcher = KeywordMatcher(["kiev", "#maidan", "@kyivpost", "new york"], word_boundaries=True)
+    eq_(["kiev", "#maidan", "@kyivpost"], matcher.matches(u"Kiev! #Maidan via @KyivPost_"[:-1]))
+    eq_([], matcher.matches(u"kievan #maidans newyork"))
+    eq_(["new york"], matcher.matches(u"NEW YORK"))
+
+def test_finditer_positions_and_utf8_terms():
+    matcher = KeywordMatcher(["caf\xc3\xa9", u"he", u"she", u"hers"])
+    eq_([(0, 4, u"caf\xe9"), (5, 8, u"she"), (6, 8, u"he"), (6, 10, u"hers")],
+        list(matcher.finditer(u"Caf\xe9 shers")))
+
+def test_used_by_filters():
+    terms = ["term{0}".format(i) for i in range(200)] + ["ukraine"]
+    tweet = {"text": u"News from UKRAINE", "user": {"location": u"nowhere"}}
+    ok_(field_contains(tweet, "text", KeywordMatcher(terms)))
+    ok_(compile_filter(["field_contains", "text"] + terms)(tweet))
+    ok_(not compile_filter(["user_location_contains"] + terms)(tweet))
+    ok_(compile_filter(["field_contains", "text", KeywordMatcher(terms)])(tweet))
+
+def test_not_exposed_as_filter():
+    """The dashboard offers every public callable of tweet_filter as a filter"""
+    from smappPy import tweet_filter
+    public = [name for name in dir(tweet_filter) if not name.startswith("_") and
+        callable(getattr(tweet_filter, name))]
+    ok_(public)
+    ok_(all(getattr(tweet_filter, name).__module__ == tweet_filter.__name__ for name in public))
+    assert_raises(ValueError, compile_filter, ["KeywordMatcher", "ukraine"])
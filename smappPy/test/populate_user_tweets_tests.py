@@ -0,0 +1,261 @@
+"""
+Unit tests for `populate_user_tweets` module (parallel, checkpointed timeline harvester).
+"""
+
+import os
+import time
+import Queue
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy.tweepy_pool import APIPool
+from smappPy.user_collection import populate_user_tweets as harvester
+from smappPy.user_collection.populate_user_tweets import _write_harvest_results, UserTweetWriter, \
+    user_tweet_update
+from smappPy.user_collection.userdocs import create_userdoc
+
+OAUTH_DICT = {
+        "consumer_key"        : "12345",
+        "consumer_secret"     : "23456",
+        "access_token"        : "34567",
+        "access_token_secret" : "45678"
+    }
+
+
+class _RecordingWriter(object):
+    """Stands in for UserTweetWriter, recording calls (flushing every batch_size adds)"""
+
+    def __init__(self, calls, batch_size):
+        self.calls = calls
+        self.batch_size = batch_size
+        self.buffered = []
+
+    def add(self, user, tweets):
+        self.buffered.append(user["_id"])
+        if len(self.buffered) >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        self.calls.append(("flush", self.buffered))
+        self.buffered = []
+
+
+class _RecordingProgress(object):
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.count = 0
+
+    def stored_users(self, user_ids):
+        self.calls.append(("stored", list(user_ids)))
+        self.count += len(user_ids)
+
+
+def _run_writer(results, batch_size):
+    calls = []
+    result_queue = Queue.Queue()
+    for user_id, tweets in results:
+        result_queue.put(({"_id": user_id, "id": user_id}, tweets))
+    result_queue.put(None)
+    _write_harvest_results(result_queue, 1, _RecordingWriter(calls, batch_size),
+        _RecordingProgress(calls))
+    return calls
+
+def _flushed_before_stored(calls):
+    """True if every user marked stored had been flushed (or had no tweets) before"""
+    flushed = set()
+    for kind, ids in calls:
+        if kind == "flush":
+            flushed.update(ids)
+        elif kind == "stored":
+            for user_id in ids:
+                if user_id not in flushed and user_id % 2 == 0:
+                    return False
+    return True
+
+def test_skipped_users_checkpoint_after_flush():
+    """
+    A run of skipped users (tweets None) must not move the checkpoint past users whose
+    tweets are still buffered in the writer.
+    """
+    # Even users have tweets, odd users are skipped
+    results = [(i, [] if i % 2 == 0 else None) for i in range(20)]
+    calls = _run_writer(results, batch_size=3)
+    ok_(_flushed_before_stored(calls))
+    eq_(range(20), sorted(i for kind, ids in calls if kind == "stored" for i in ids))
+
+def test_all_users_stored_at_end():
+    calls = _run_writer([(i, []) for i in range(5)], batch_size=100)
+    eq_([("flush", range(5)), ("stored", range(5))], calls)
+
+
+class _Status(object):
+    """Stands in for a tweepy Status"""
+
+    def __init__(self, tweet_id):
+        self.id = tweet_id
+        self.created_at = datetime(2015, 1, 1)
+        self._json = {"id": tweet_id, "id_str": str(tweet_id),
+            "created_at": "Thu Jan 01 00:00:00 +0000 2015", "text": "tweet {0}".format(tweet_id)}
+
+
+class _FailingCursor(object):
+    """Cursor over given users that raises once they are exhausted"""
+
+    def __init__(self, users):
+        self.users = users
+
+    def __iter__(self):
+        for user in self.users:
+            yield user
+        raise IOError("cursor lost")
+
+    def count(self, with_limit_and_skip=False):
+        return len(self.users)
+
+    def close(self):
+        pass
+
+
+def _collections():
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    db = mongomock.MongoClient().db
+    db.users.insert_many([create_userdoc(i) for i in range(1, 21)])
+    return db.users, db.tweets
+
+def _fake_fetch(calls=None, delay=0):
+    def fetch(api, user, tweets_per_user, requery=True):
+        if calls is not None:
+            calls.append((threading.current_thread().name, api))
+        time.sleep(delay)
+        return [_Status(user["id"] * 10 + i) for i in range(tweets_per_user)][::-1]
+    return fetch
+
+def _harvest(users, tweets, fetch, api=None, **kwargs):
+    original = harvester.fetch_user_tweets
+    harvester.fetch_user_tweets = fetch
+    try:
+        harvester.populate_user_tweets_parallel(api, users, tweets, 2, num_workers=2,
+            read_batch_size=4, write_batch_size=5, ensure_indexes=False, **kwargs)
+    finally:
+        harvester.fetch_user_tweets = original
+
+def test_parallel_harvest_clears_checkpoint():
+    """
+    A completed harvest stores every user's tweets and removes its checkpoint, so the
+    next run given the same checkpoint file considers every user again.
+    """
+    users, tweets = _collections()
+    directory = tempfile.mkdtemp()
+    checkpoint_file = os.path.join(directory, "checkpoint")
+    try:
+        _harvest(users, tweets, _fake_fetch(), checkpoint_file=checkpoint_file)
+        eq_(40, tweets.count())
+        ok_(not os.path.exists(checkpoint_file))
+        eq_(20, users.find({"latest_tweet_id": {"$ne": None}}).count())
+
+        calls = []
+        _harvest(users, tweets, _fake_fetch(calls), checkpoint_file=checkpoint_file)
+        eq_(20, len(calls))
+    finally:
+        shutil.rmtree(directory)
+
+def test_failed_read_keeps_checkpoint():
+    users, tweets = _collections()
+    directory = tempfile.mkdtemp()
+    checkpoint_file = os.path.join(directory, "checkpoint")
+
+    class _FailingUsers(object):
+        def find(self, *args, **kwargs):
+            return _FailingCursor(list(users.find(*args, **kwargs).limit(8)))
+        def __getattr__(self, name):
+            return getattr(users, name)
+
+    try:
+        assert_raises(IOError, _harvest, _FailingUsers(), tweets, _fake_fetch(),
+            checkpoint_file=checkpoint_file)
+        eq_(users.find().sort("_id", 1)[7]["_id"], harvester._read_checkpoint(checkpoint_file))
+
+        # Resumed run only considers users after the checkpoint
+        calls = []
+        _harvest(users, tweets, _fake_fetch(calls), checkpoint_file=checkpoint_file)
+        eq_(12, len(calls))
+        ok_(not os.path.exists(checkpoint_file))
+    finally:
+        shutil.rmtree(directory)
+
+def test_workers_get_own_apis():
+    users, tweets = _collections()
+    pool = APIPool([OAUTH_DICT, OAUTH_DICT], use_appauth=False)
+    calls = []
+    _harvest(users, tweets, _fake_fetch(calls, delay=0.01), api=pool)
+    apis_by_thread = dict((name, api._apis[0][0]) for name, api in calls)
+    eq_(len(apis_by_thread), len(set(apis_by_thread.values())))
+    ok_(all(len(api._apis) == 1 for _, api in calls))
+
+
+def _statuses(tweet_ids):
+    """Statuses of given tweet ids, newest first (as from Twitter)"""
+    return [_Status(i) for i in sorted(tweet_ids, reverse=True)]
+
+def _write(writer, users, user_id, tweet_ids):
+    writer.add(users.find_one({"id": user_id}), _statuses(tweet_ids))
+    writer.flush()
+
+def test_writer_upserts_tweets_and_user():
+    """
+    Re-harvested tweets are not duplicated or overwritten, and userdocs only move forward:
+    $max of latest_tweet_id, $addToSet of tweet_ids
+    """
+    users, tweets = _collections()
+    writer = UserTweetWriter(tweets, users, batch_size=100)
+    _write(writer, users, 1, [11, 12, 13])
+    eq_([11, 12, 13], sorted(t["id"] for t in tweets.find()))
+    tweets.update_one({"id": 12}, {"$set": {"text": "stored"}})
+
+    _write(writer, users, 1, [10, 12, 13])
+    eq_([10, 11, 12, 13], sorted(t["id"] for t in tweets.find()))
+    eq_("stored", tweets.find_one({"id": 12})["text"])
+
+    user = users.find_one({"id": 1})
+    eq_(13, user["latest_tweet_id"])
+    eq_([10, 11, 12, 13], sorted(user["tweet_ids"]))
+    ok_(user["tweets_updated"] is not None)
+
+    # Other users are untouched
+    eq_(None, users.find_one({"id": 2})["latest_tweet_id"])
+
+def test_writer_tweet_id_collection():
+    users, tweets = _collections()
+    tweet_id_collection = tweets.database.tweet_ids
+    harvester.ensure_user_tweet_id_indexes(tweet_id_collection)
+    writer = UserTweetWriter(tweets, users, tweet_id_collection=tweet_id_collection, batch_size=100)
+    _write(writer, users, 1, [11, 12])
+    _write(writer, users, 1, [12, 13])
+    _write(writer, users, 2, [21])
+
+    eq_([(1, 11), (1, 12), (1, 13), (2, 21)],
+        sorted((d["user_id"], d["tweet_id"]) for d in tweet_id_collection.find()))
+    user = users.find_one({"id": 1})
+    eq_(13, user["latest_tweet_id"])
+    ok_(not user.get("tweet_ids"))
+
+def test_user_tweet_update_is_partial():
+    update = user_tweet_update({"tweet_ids": [1], "tweet_frequency": 2.0}, 5, 4.0, [2, 3, 2])
+    eq_(["$addToSet", "$max", "$set"], sorted(update))
+    eq_({"latest_tweet_id": 5}, update["$max"])
+    eq_([2, 3], sorted(update["$addToSet"]["tweet_ids"]["$each"]))
+    eq_(3.0, update["$set"]["tweet_frequency"])
+
+    # No tweets: neither latest_tweet_id nor tweet_ids change
+    update = user_tweet_update({"tweet_ids": [1]}, None, 0, [])
+    eq_(["$set"], sorted(update))
+    ok_("tweet_ids" not in update["$set"])
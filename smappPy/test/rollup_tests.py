@@ -0,0 +1,107 @@
+"""
+Unit tests for `rollup` module (hourly tweet count rollups).
+"""
+
+from datetime import datetime, timedelta
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy.rollup import TweetRollup, DIMENSIONS
+from smappPy.aggregation import bucket_counts_by
+
+START = datetime(2015, 1, 1, 10, 0)
+HOUR = timedelta(hours=1)
+
+
+def _tweet(i):
+    """Tweet i, 7 minutes after tweet i - 1. Every 3rd is Spanish, 5th a retweet, etc"""
+    tweet = {"id": i, "timestamp": START + timedelta(minutes=7 * i),
+             "entities": {"urls": [{"url": "http://t.co"}] if i % 2 else []}}
+    if i % 3:
+        tweet["lang"] = "en" if i % 3 == 1 else None
+    else:
+        tweet["lang"] = "es"
+    if i % 5 == 0:
+        tweet["retweeted_status"] = {"id": 1}
+    if i % 4 == 0:
+        tweet["coordinates"] = {"type": "Point", "coordinates": [1.0, 2.0]}
+    return tweet
+
+def _rollup(num_tweets=30):
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    db = mongomock.MongoClient().db
+    db.tweets.insert_many([_tweet(i) for i in range(num_tweets)])
+    return TweetRollup(db.rollup, db.tweets), db.tweets
+
+def _expected(tweets, start, end, predicate=lambda t: True):
+    return sum(1 for t in tweets if start <= t["timestamp"] < end and predicate(t))
+
+def test_counts_match_tweets():
+    rollup, collection = _rollup()
+    tweets = list(collection.find())
+    end = START + 4 * HOUR
+    ok_(rollup.update(until=end) > 0)
+    eq_((START, end), rollup.covered_range())
+
+    eq_(30, rollup.count(START, end))
+    eq_(_expected(tweets, START, end, lambda t: t["lang"] == "es"), rollup.count(START, end, lang="es"))
+    eq_(_expected(tweets, START, end, lambda t: t["lang"] is None), rollup.count(START, end, lang="unk"))
+    eq_(_expected(tweets, START, end, lambda t: "retweeted_status" in t), rollup.count(START, end, retweet=True))
+    eq_(_expected(tweets, START, end, lambda t: "coordinates" in t), rollup.count(START, end, geocoded=True))
+    eq_(_expected(tweets, START, end, lambda t: t["entities"]["urls"]),
+        rollup.count(START, end, has_url=True, retweet=None))
+    eq_([_expected(tweets, START + i * HOUR, START + (i + 1) * HOUR) for i in range(4)],
+        rollup.bucket_counts(START, HOUR, 4))
+
+def test_update_is_incremental():
+    rollup, collection = _rollup()
+    rollup.update(until=START + 2 * HOUR)
+    eq_(0, rollup.update(until=START + 2 * HOUR))
+    rollup.update(until=START + 4 * HOUR)
+    eq_((START, START + 4 * HOUR), rollup.covered_range())
+    eq_(30, rollup.count(START, START + 4 * HOUR))
+
+    # Late inserts before the high-water mark are only counted by rebuild()
+    collection.insert_one(_tweet(3))
+    eq_(30, rollup.count(START, START + 4 * HOUR))
+    rollup.rebuild(START, START + HOUR)
+    eq_(31, rollup.count(START, START + 4 * HOUR))
+
+def test_covers():
+    rollup, _ = _rollup()
+    ok_(not rollup.covers(START, START + HOUR))
+    rollup.update(until=START + 3 * HOUR)
+    ok_(rollup.covers(START, START + 3 * HOUR))
+    ok_(rollup.covers(START + HOUR, START + 2 * HOUR, step=2 * HOUR))
+    ok_(not rollup.covers(START, START + 4 * HOUR))
+    ok_(not rollup.covers(START + timedelta(minutes=30), START + 2 * HOUR))
+    ok_(not rollup.covers(START, START + 2 * HOUR, step=timedelta(minutes=30)))
+
+def test_bucket_counts_by_dimension():
+    rollup, collection = _rollup()
+    tweets = list(collection.find())
+    rollup.update(until=START + 4 * HOUR)
+    counts = rollup.bucket_counts_by(START, 2 * HOUR, 2, "lang", values=["en"])
+    eq_(["en", "other"], list(counts))
+    eq_([_expected(tweets, START + i * 2 * HOUR, START + (i + 1) * 2 * HOUR, lambda t: t["lang"] == "en")
+        for i in range(2)], counts["en"])
+    eq_(30, sum(counts["en"]) + sum(counts["other"]))
+
+def test_bucket_counts_by_matches_without_rollup():
+    """Counts by each dimension are the same from the rollup, the collection and a stream"""
+    rollup, collection = _rollup()
+    tweets = list(collection.find())
+    rollup.update(until=START + 4 * HOUR)
+    for dimension in DIMENSIONS:
+        expected = dict(rollup.bucket_counts_by(START, HOUR, 4, dimension))
+        eq_(expected, dict(bucket_counts_by(collection, START, HOUR, 4, dimension, rollup=rollup)))
+        eq_(expected, dict(bucket_counts_by(collection, START, HOUR, 4, dimension)))
+        eq_(expected, dict(bucket_counts_by(tweets, START, HOUR, 4, dimension)))
+        ok_(len(expected) > 1)
+
+@raises(ValueError)
+def test_unknown_dimension():
+    rollup, _ = _rollup()
+    rollup.count(START, START + HOUR, color="red")
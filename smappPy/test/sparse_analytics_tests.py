@@ -0,0 +1,61 @@
+"""
+Unit tests for `networks.sparse_analytics`: results should match networkx equivalents.
+"""
+
+import numpy as np
+import networkx as nx
+from nose.tools import *
+from smappPy.networks import sparse_analytics as sa
+
+
+def _graph():
+    G = nx.gnp_random_graph(200, 0.03, seed=7, directed=True)
+    G.add_edges_from([(200, 201), (201, 200), (202, 203), (5, 5)])
+    return G
+
+def test_pagerank_matches_networkx():
+    G = _graph()
+    A, nodes = sa.adjacency_from_networkx(G)
+    ranks = sa.pagerank(A, tol=1e-10)
+    expected = nx.pagerank(G, tol=1e-10)
+    ok_(np.allclose(ranks, [expected[n] for n in nodes], atol=1e-8))
+
+def test_degrees_match_networkx():
+    G = _graph()
+    A, nodes = sa.adjacency_from_networkx(G)
+    eq_([G.in_degree(n) for n in nodes], list(sa.in_degree(A)))
+    eq_([G.out_degree(n) for n in nodes], list(sa.out_degree(A)))
+
+def test_weakly_connected_components_match_networkx():
+    G = _graph()
+    A, nodes = sa.adjacency_from_networkx(G)
+    num, labels = sa.weakly_connected_components(A)
+    components = list(nx.weakly_connected_components(G))
+    eq_(len(components), num)
+    largest = max(components, key=len)
+    eq_(set(largest), set(n for n, l in zip(nodes, labels) if l == 0))
+
+def test_core_number_matches_networkx():
+    G = _graph()
+    A, nodes = sa.adjacency_from_networkx(G)
+    U = G.to_undirected()
+    U.remove_edges_from(U.selfloop_edges())
+    expected = nx.core_number(U)
+    eq_([expected[n] for n in nodes], list(sa.core_number(A)))
+
+def test_core_number_matches_networkx_on_dense_and_chain_graphs():
+    for G in [nx.gnp_random_graph(300, 0.1, seed=3), nx.path_graph(3000),
+              nx.barabasi_albert_graph(500, 4, seed=1), nx.complete_graph(12), nx.empty_graph(4)]:
+        A, nodes = sa.adjacency_from_networkx(G)
+        expected = nx.core_number(G)
+        eq_([expected[n] for n in nodes], list(sa.core_number(A)))
+
+def test_core_number_empty():
+    eq_(0, len(sa.core_number(sa.adjacency_from_networkx(nx.DiGraph())[0])))
+
+def test_reciprocity_matches_networkx():
+    G = _graph()
+    A, nodes = sa.adjacency_from_networkx(G)
+    G.remove_edges_from(G.selfloop_edges())
+    reciprocated = sum(1 for u, v in G.edges() if G.has_edge(v, u))
+    ok_(abs(reciprocated / float(G.number_of_edges()) - sa.reciprocity(A)) < 1e-12)
@@ -0,0 +1,124 @@
+"""
+Unit tests for `store_tweets` module (rotating, compressed tweet writers).
+"""
+
+import os
+import time
+import gzip
+import json
+import shutil
+import tempfile
+from bson import decode_file_iter
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy import store_tweets
+from smappPy.store_tweets import JsonTweetWriter, BsonTweetWriter
+
+TWEETS = [{"id": i, "text": u"tweet number {0} \xe9".format(i)} for i in range(100)]
+
+def _read_gzip_json(paths):
+    tweets = []
+    for path in paths:
+        handle = gzip.open(path)
+        tweets.extend(json.loads(line) for line in handle)
+        handle.close()
+    return tweets
+
+def test_rotates_by_size():
+    directory = tempfile.mkdtemp()
+    try:
+        with JsonTweetWriter(os.path.join(directory, "tweets_"), max_bytes=1000, buffer_size=300) as writer:
+            writer.write_all(TWEETS)
+        ok_(len(writer.files) > 1)
+        eq_(sorted(writer.files), sorted(os.path.join(directory, f) for f in os.listdir(directory)))
+        ok_(all(f.endswith(".json.gz") for f in writer.files))
+        eq_(TWEETS, _read_gzip_json(writer.files))
+    finally:
+        shutil.rmtree(directory)
+
+def test_background_compression():
+    directory = tempfile.mkdtemp()
+    try:
+        with JsonTweetWriter(os.path.join(directory, "tweets_"), max_bytes=2000, background=True) as writer:
+            writer.write_all(TWEETS)
+        eq_(sorted(writer.files), sorted(os.path.join(directory, f) for f in os.listdir(directory)))
+        eq_(TWEETS, _read_gzip_json(sorted(writer.files)))
+    finally:
+        shutil.rmtree(directory)
+
+
+class _Clock(object):
+    """Stands in for the time module, at a settable time"""
+
+    strftime = staticmethod(time.strftime)
+    gmtime = staticmethod(time.gmtime)
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_rotates_by_time():
+    """flush() finishes a file whose hourly window has ended, also with no further writes"""
+    for background in (False, True):
+        directory = tempfile.mkdtemp()
+        clock = _Clock(1000 * 3600 + 10)
+        store_tweets.time = clock
+        try:
+            with JsonTweetWriter(os.path.join(directory, "tweets_"), max_seconds=3600,
+                background=background) as writer:
+                # The file being written, not the background compressor's output
+                writing = ".json.raw.tmp" if background else ".json.gz.tmp"
+                writer.write_all(TWEETS[:50])
+                clock.now += 3000
+                writer.flush()
+                ok_(any(f.endswith(writing) for f in os.listdir(directory)))
+                clock.now += 600
+                writer.flush()
+                ok_(not any(f.endswith(writing) for f in os.listdir(directory)))
+                ok_(not any(f.endswith(".json") for f in os.listdir(directory)))
+                writer.write_all(TWEETS[50:])
+            eq_([os.path.join(directory, "tweets_19700211-160010_0000.json.gz"),
+                 os.path.join(directory, "tweets_19700211-170010_0001.json.gz")], sorted(writer.files))
+            eq_(sorted(writer.files), sorted(os.path.join(directory, f) for f in os.listdir(directory)))
+            eq_(TWEETS, _read_gzip_json(sorted(writer.files)))
+        finally:
+            store_tweets.time = time
+            shutil.rmtree(directory)
+
+def test_uncompressed_bson():
+    directory = tempfile.mkdtemp()
+    try:
+        with BsonTweetWriter(os.path.join(directory, "tweets_"), compression=None) as writer:
+            writer.write_all(TWEETS)
+        eq_(1, len(writer.files))
+        with open(writer.files[0], "rb") as handle:
+            eq_(TWEETS, list(decode_file_iter(handle)))
+    finally:
+        shutil.rmtree(directory)
+
+def _check_compression(compression, decompress):
+    directory = tempfile.mkdtemp()
+    try:
+        with JsonTweetWriter(os.path.join(directory, "tweets_"), compression=compression) as writer:
+            writer.write_all(TWEETS)
+        with open(writer.files[0], "rb") as handle:
+            eq_(TWEETS, [json.loads(line) for line in decompress(handle.read()).splitlines()])
+    finally:
+        shutil.rmtree(directory)
+
+def test_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise SkipTest("zstandard not installed")
+    _check_compression("zstd", zstandard.ZstdDecompressor().decompressobj().decompress)
+
+def test_lz4():
+    try:
+        import lz4.frame
+    except ImportError:
+        raise SkipTest("lz4 not installed")
+    _check_compression("lz4", lz4.frame.decompress)
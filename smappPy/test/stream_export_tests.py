@@ -0,0 +1,93 @@
+"""
+Unit tests for `networks.stream_export` module (streaming GraphML, GEXF, CSV and CSR export).
+"""
+
+import os
+import csv
+import tempfile
+import networkx as nx
+from StringIO import StringIO
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from smappPy.networks.stream_export import stream_network
+from smappPy.networks.adjacency_store import AdjacencyStore, load_csr, IN, OUT
+
+USERS = [{"id": 1, "screen_name": u"caf\xe9", "followers_count": 2, "protected": False},
+         {"id": 2, "screen_name": "b<&>\"", "followers_count": 0, "protected": True},
+         {"id": 3, "screen_name": "c", "lang": "en"}]
+# 1 -> 2 is recorded from both ends; 4 has no user doc
+EDGES = set([(1, 2), (2, 1), (3, 1), (1, 4)])
+
+
+def _network():
+    try:
+        import mongomock
+    except ImportError:
+        raise SkipTest("mongomock not installed")
+    db = mongomock.MongoClient().db
+    db.users.insert_many([dict(u) for u in USERS])
+    store = AdjacencyStore(db.adjacency)
+    store.add_neighbors(1, [2, 4], OUT)
+    store.add_neighbors(2, [1], IN)
+    store.add_neighbors(1, [2, 3], IN)
+    db.edges.insert_many([{"from": s, "to": t} for s, t in EDGES])
+    return db.users, store, db.edges
+
+def _graph_edges(graph):
+    return set((int(s), int(t)) for s, t in graph.edges())
+
+def _export(fmt, edges_name, keep_empty_nodes, **kwargs):
+    users, store, edges = _network()
+    out = StringIO()
+    stream_network(users, store if edges_name == "adjacency" else edges, out, fmt=fmt,
+        keep_empty_nodes=keep_empty_nodes, **kwargs)
+    return out.getvalue()
+
+def test_adjacency_edges_written_once():
+    for fmt in ("graphml", "gexf", "csv"):
+        data = _export(fmt, "adjacency", True)
+        eq_(len(EDGES), data.count('source="') if fmt != "csv" else len(data.splitlines()) - 1)
+
+def test_graphml_roundtrip():
+    for edges_name in ("adjacency", "edges"):
+        graph = nx.read_graphml(StringIO(_export("graphml", edges_name, False)))
+        eq_(set(["1", "2", "3"]), set(graph.nodes()))
+        eq_(set([(1, 2), (2, 1), (3, 1)]), _graph_edges(graph))
+        eq_(u"caf\xe9", graph.node["1"]["screen_name"])
+        eq_('b<&>"', graph.node["2"]["screen_name"])
+        eq_(True, graph.node["2"]["protected"])
+        eq_(2, graph.node["1"]["followers_count"])
+
+        graph = nx.read_graphml(StringIO(_export("graphml", edges_name, True)))
+        eq_(EDGES, _graph_edges(graph))
+        eq_({}, graph.node["4"])
+
+def test_gexf_roundtrip():
+    for edges_name in ("adjacency", "edges"):
+        graph = nx.read_gexf(StringIO(_export("gexf", edges_name, True)))
+        eq_(EDGES, _graph_edges(graph))
+        eq_(u"caf\xe9", graph.node["1"]["label"])
+        eq_("en", graph.node["3"]["lang"])
+
+def test_csv_roundtrip():
+    for edges_name in ("adjacency", "edges"):
+        users, store, edges = _network()
+        out, node_out = StringIO(), StringIO()
+        stream_network(users, store if edges_name == "adjacency" else edges, out, fmt="csv",
+            node_outhandle=node_out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        eq_(["source", "target"], rows[0])
+        eq_(set([(1, 2), (2, 1), (3, 1)]), set((int(s), int(t)) for s, t in rows[1:]))
+
+        nodes = list(csv.DictReader(StringIO(node_out.getvalue())))
+        eq_(["1", "2", "3"], [n["id"] for n in nodes])
+        eq_(u"caf\xe9", nodes[0]["screen_name"].decode("utf8"))
+
+def test_csr_roundtrip():
+    users, store, edges = _network()
+    filename = os.path.join(tempfile.mkdtemp(), "net.npz")
+    stream_network(users, store, None, fmt="csr", keep_empty_nodes=True, csr_filename=filename)
+    matrix, node_ids = load_csr(filename)
+    eq_([1, 2, 3, 4], list(node_ids))
+    rows, cols = matrix.nonzero()
+    eq_(EDGES, set((int(node_ids[r]), int(node_ids[c])) for r, c in zip(rows, cols)))
@@ -0,0 +1,61 @@
+"""
+Unit tests for `tweepy_pool_state` module.
+"""
+
+import os
+import time
+import tempfile
+from nose.tools import *
+from smappPy.tweepy_pool_state import SharedThrottleState, token_key
+
+OAUTH_DICT = {
+        "consumer_key"        : "12345",
+        "consumer_secret"     : "23456",
+        "access_token"        : "34567",
+        "access_token_secret" : "45678"
+    }
+
+
+def _state_file():
+    handle, filename = tempfile.mkstemp(suffix=".sqlite")
+    os.close(handle)
+    return filename
+
+def test_token_key_differs_for_oauth_and_appauth():
+    ok_(token_key(OAUTH_DICT) != token_key(OAUTH_DICT, appauth=True))
+    ok_("12345" not in token_key(OAUTH_DICT))
+
+def test_reserve_round_robins_over_free_tokens():
+    """
+    With no throttles recorded, consecutive reservations should spread over tokens.
+    """
+    state = SharedThrottleState(_state_file())
+    picked = [state.reserve(["a", "b", "c"], "user_timeline", 900)[0] for _ in range(3)]
+    eq_([0, 1, 2], sorted(picked))
+
+def test_reserve_avoids_throttled_token_seen_by_other_pool():
+    """
+    A throttle recorded through one state object is seen by another on the same file.
+    """
+    filename = _state_file()
+    state_1 = SharedThrottleState(filename)
+    state_2 = SharedThrottleState(filename)
+
+    state_1.record_throttle("a", "followers_ids")
+    for _ in range(3):
+        index, throttled = state_2.reserve(["a", "b"], "followers_ids", 900)
+        eq_(1, index)
+        eq_(0.0, throttled)
+
+def test_reserve_ignores_expired_throttles():
+    state = SharedThrottleState(_state_file())
+    state.record_throttle("a", "friends_ids", time.time() - 1000)
+    index, throttled = state.reserve(["a", "b"], "friends_ids", 900)
+    eq_(0, index)
+    ok_(throttled > 0)
+
+def test_throttles_are_per_method():
+    state = SharedThrottleState(_state_file())
+    state.record_throttle("a", "friends_ids")
+    eq_(["a"], state.throttle_times(["a", "b"], "friends_ids").keys())
+    eq_({}, state.throttle_times(["a", "b"], "followers_ids"))
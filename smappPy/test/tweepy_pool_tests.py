@@ -273,3 +273,19 @@ def test_with_per_method_throttling_sets_throttle_time_for_method_when_88_error(
     api_pool._call_with_throttling_per_method(METHOD_NAME, id=666)
 
     assert api_pool._apis[0][1][METHOD_NAME] > datetime.min
+
+def test_partition_deals_disjoint_apis():
+    """
+    Partitioning a pool should give each share different apis, reusing shares when
+    there are more shares than apis.
+    """
+    api_pool = tweepy_pool.APIPool([OAUTH_DICT, OAUTH_DICT, OAUTH_DICT], use_appauth=False)
+    apis = [a[0] for a in api_pool._apis]
+
+    shares = api_pool.partition(2)
+    eq_([[apis[0], apis[2]], [apis[1]]], [[a[0] for a in s._apis] for s in shares])
+    eq_(api_pool.time_to_wait, shares[1].time_to_wait)
+
+    shares = api_pool.partition(5)
+    eq_(5, len(shares))
+    eq_([apis[0], apis[1], apis[2], apis[0], apis[1]], [s._apis[0][0] for s in shares])
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for `tools.tweet_json2csv` (CSV export of JSON tweets).
+"""
+
+import os
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+from nose.tools import *
+from smappPy.tools.tweet_json2csv import export_csv, parse_columns, compile_columns, _ordered_results
+
+TWEETS = [{"id_str": str(i), "created_at": "Wed Aug 27 13:08:45 +0000 2008",
+           "text": u"line one\nline \xe9 {0}, \"quoted\"".format(i),
+           "user": {"id_str": str(100 + i), "screen_name": u"user{0}".format(i)},
+           "entities": {"hashtags": [{"text": u"a"}, {"text": u"b{0}".format(i)}]}} for i in range(50)]
+for i in range(0, 50, 3):
+    TWEETS[i]["retweeted_status"] = {"id_str": "9{0}".format(i)}
+    TWEETS[i]["coordinates"] = {"coordinates": [29.0, 41.5]}
+
+def _export(infile_name, outfile_name, **kwargs):
+    directory = tempfile.mkdtemp()
+    try:
+        infile, outfile = os.path.join(directory, infile_name), os.path.join(directory, outfile_name)
+        with (gzip.open if infile.endswith(".gz") else open)(infile, "wb") as handle:
+            for tweet in TWEETS:
+                handle.write(json.dumps(tweet) + "\n")
+        eq_(len(TWEETS), export_csv(infile, outfile, counter=None, **kwargs))
+        with (gzip.open if outfile.endswith(".gz") else open)(outfile, "rb") as handle:
+            return list(csv.reader(handle))
+    finally:
+        shutil.rmtree(directory)
+
+def test_default_columns():
+    rows = _export("tweets.json", "tweets.csv", processes=1)
+    eq_(["TweetId", "UserID", "UserScreenName", "TweetDate", "TweetText", "IsRetweet", "RetweetedID"], rows[0])
+    eq_(["0", "100", "user0", "Wed Aug 27 13:08:45 +0000 2008", "line one line \xc3\xa9 0, \"quoted\"", "True", "90"],
+        rows[1])
+    eq_(["False", "NA"], rows[2][5:])
+
+def test_parallel_byte_ranges_in_order():
+    eq_(_export("tweets.json", "tweets.csv", processes=1),
+        _export("tweets.json", "tweets.csv", processes=2, chunk_bytes=500))
+
+def test_gzip_and_computed_columns():
+    columns = parse_columns(["Id=id_str", "Tags=hashtags", "Lon=longitude", "user.screen_name"])
+    rows = _export("tweets.json.gz", "tweets.csv.gz", columns=columns, processes=2, batch_lines=7)
+    eq_(["Id", "Tags", "Lon", "user.screen_name"], rows[0])
+    eq_(["0", "a b0", "29.0", "user0"], rows[1])
+    eq_(["1", "a b1", "NA", "user1"], rows[2])
+    eq_(len(TWEETS) + 1, len(rows))
+
+def test_missing_path():
+    eq_(["NA"], compile_columns([("X", "user.location.name")])(TWEETS[0]))
+
+
+class _Result(object):
+
+    def __init__(self, value, pending):
+        self.value = value
+        self.pending = pending
+
+    def get(self):
+        self.pending.remove(self)
+        return self.value
+
+
+class _RecordingPool(object):
+    """Stands in for a multiprocessing.Pool, recording the most tasks pending at once"""
+
+    def __init__(self):
+        self.pending = []
+        self.max_pending = 0
+
+    def apply_async(self, func, args):
+        self.pending.append(_Result(func(*args), self.pending))
+        self.max_pending = max(self.max_pending, len(self.pending))
+        return self.pending[-1]
+
+def test_ordered_results_bounded():
+    pool = _RecordingPool()
+    eq_([i * i for i in range(20)], list(_ordered_results(pool, lambda i: i * i, iter(range(20)), 3)))
+    eq_(3, pool.max_pending)
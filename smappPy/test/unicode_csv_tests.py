@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for `unicode_csv` module (UnicodeWriter).
+"""
+
+import os
+import tempfile
+from StringIO import StringIO
+from nose.tools import *
+from smappPy.unicode_csv import UnicodeWriter, UnicodeReader
+from smappPy.iter_util import it_to_csv
+
+ROWS = [[u"id", u"text", u"score"], [1, u"caf\xe9, \"ok\"", 0.5], [2L, "plain", None], [True, u"İstanbul\n", 3]]
+EXPECTED = [[u"id", u"text", u"score"], [u"1", u"caf\xe9, \"ok\"", u"0.5"], [u"2", u"plain", u"None"],
+            [u"True", u"İstanbul\n", u"3"]]
+
+def test_writerow_and_writerows_agree():
+    single, batched = StringIO(), StringIO()
+    writer = UnicodeWriter(single)
+    for row in ROWS:
+        writer.writerow(row)
+    UnicodeWriter(batched, batch_size=3).writerows(iter(ROWS))
+    eq_(single.getvalue(), batched.getvalue())
+    eq_(EXPECTED, list(UnicodeReader(StringIO(single.getvalue()))))
+
+def test_other_encoding():
+    out = StringIO()
+    UnicodeWriter(out, encoding="utf-16").writerows(ROWS)
+    eq_(EXPECTED, list(UnicodeReader(StringIO(out.getvalue()), encoding="utf-16")))
+
+def test_it_to_csv():
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        it_to_csv(iter(ROWS), path)
+        with open(path) as handle:
+            eq_(EXPECTED, list(UnicodeReader(handle)))
+    finally:
+        os.remove(path)
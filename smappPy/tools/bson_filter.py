@@ -8,28 +8,13 @@ import pytz
 import argparse
 from datetime import datetime
 from bson import BSON, decode_file_iter
-
-MONTHS={
-    'Jan': 1,
-    'Feb': 2,
-    'Mar': 3,
-    'Apr': 4,
-    'May': 5,
-    'Jun': 6,
-    'Jul': 7,
-    'Aug': 8,
-    'Sep': 9,
-    'Oct': 10,
-    'Nov': 11,
-    'Dec': 12,
-}
+from smappPy.date import MONTHS, mongodate_to_datetime
 
 def parsedate(s):
-    t = s.split()
-    tt = t[3].split(":")
-    if t[4] != "+0000":
-        raise "Only works for utc"
-    return datetime(int(t[-1]), MONTHS[t[1]], int(t[2]), int(tt[0]), int(tt[1]), int(tt[2])).replace(tzinfo=pytz.utc)
+    """Parses a twitter 'created_at' string (must be UTC) to a UTC-aware datetime"""
+    if s[20:25] != "+0000":
+        raise ValueError("Only works for utc")
+    return mongodate_to_datetime(s).replace(tzinfo=pytz.utc)
 
 def tweet_date(tweet):
     """
@@ -12,64 +12,127 @@ import csv
 import argparse
 import simplejson as json
 
-from collections import defaultdict
+from datetime import datetime
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
+from smappPy.collection_util import tweet_cursor
 
+# Tweet fields read by extract_user_data
+USER_DATA_FIELDS = ["user.id_str", "user.screen_name", "user.name", "user.lang",
+    "user.friends_count", "user.followers_count", "user.location", "timestamp"]
 
-def extract_user_data(collection, outfile, start_date=None, end_date=None, update=10000):
+
+CSV_HEADER = ["ScreenName", "Name", "UserId", "Lang", "FriendsCount", "FollowersCount", "Location",
+    "NumTweets"]
+
+
+def extract_user_data(collection, outfile, start_date=None, end_date=None, update=10000,
+    rollup=None, aggregate=False):
     """
     Extracts user aggregate information from the given collection OF TWEETS, prints basic
     data and outputs a CSV. Fields: ScreenName,Name,UserId,Lang,FriendsCount,FollowersCount,
     Location,NumTweets.
     Takes optional date ranges to constrain query (gte start, lte end. ie, inclusive).
     If only one term specified, take everything before end or after start.
+    Takes optional rollup (smappPy.rollup.TweetRollup of collection): when it covers the
+    date range (hour-aligned start and end), the number of tweets considered is summed
+    from the rollup instead of counted in the collection. User rows always need a scan
+    of the tweets (or aggregation), as the rollup has no per-user counts.
+    User data is from each user's latest tweet (by timestamp). If aggregate is True,
+    tweets are sorted by timestamp and grouped by user in Mongo (the sort uses the
+    timestamp index) and user rows streamed straight to the CSV (no per-user state is
+    kept client-side); otherwise tweets are scanned here, keeping one compact tuple per
+    user.
     """
-    csv_header = ["ScreenName", "Name", "UserId", "Lang", "FriendsCount", "FollowersCount", "Location", "NumTweets"]
-
     if start_date and not end_date:
-        tweets = collection.find({"timestamp": {"$gte": start_date}})
+        query = {"timestamp": {"$gte": start_date}}
     elif not start_date and end_date:
-        tweets = collection.find({"timestamp": {"$lte": end_date}})
+        query = {"timestamp": {"$lte": end_date}}
     elif start_date and end_date:
-        tweets = collection.find({"timestamp": {"$gte": start_date, "$lte": end_date}})
+        query = {"timestamp": {"$gte": start_date, "$lte": end_date}}
     else:
-        tweets = collection.find()
+        query = {}
 
-    user_tweet_count = defaultdict(int)
-    user_data = {}
-    counter = 1
-    num_tweets = tweets.count()
-    print "Total collection tweets: {0}".format(collection.count())
-    print "Total tweets considered: {0}".format(num_tweets)
-    
-    print "Compiling user data..."
-    for tweet in tweets:
-        if counter % update: 
-            print ".. Progress: {0:.2%}\r".format(float(counter)/num_tweets),
-        counter += 1
+    if aggregate:
+        print "Grouping tweets by user (in DB)..."
+        users = _aggregate_user_rows(collection, query)
+    else:
+        tweets = tweet_cursor(collection, query, USER_DATA_FIELDS)
+        if rollup and start_date and end_date and rollup.covers(start_date, end_date):
+            # Rollup ranges exclude the end, the query includes it
+            num_tweets = (rollup.count(start_date, end_date) +
+                collection.find({"timestamp": end_date}).count())
+        else:
+            num_tweets = tweets.count()
+        print "Total collection tweets: {0}".format(collection.count())
+        print "Total tweets considered: {0}".format(num_tweets)
 
-        if "user" not in tweet or "id_str" not in tweet["user"]:
-            continue
-        uid = tweet["user"]["id_str"]
-        user_tweet_count[uid] += 1
-        user_data[uid] = [tweet['user']['screen_name'].encode("utf8"),
-                          tweet['user']['name'].replace(",","").replace("\n","").encode("utf8"),
-                          tweet['user']['id_str'],
-                          tweet['user']['lang'],
-                          tweet['user']['friends_count'],
-                          tweet['user']['followers_count'],
-                          tweet['user']['location'].replace(",","").replace("\n","").encode("utf8"),
-                          user_tweet_count[uid]]
+        print "Compiling user data..."
+        users = _scan_user_rows(tweets, num_tweets, update)
 
     print "Writing aggregate data to file: '{0}'".format(outfile)
     with open(outfile, "wb") as out_handle:
         csv_handle = csv.writer(out_handle)
-        csv_handle.writerow(csv_header)
-        for uid, udata in user_data.items():
-            csv_handle.writerow(udata)
+        csv_handle.writerow(CSV_HEADER)
+        written = 0
+        for screen_name, name, uid, lang, friends, followers, location, count in users:
+            csv_handle.writerow([_encode(screen_name), _sanitize(name), uid, lang, friends,
+                followers, _sanitize(location), count])
+            written += 1
+            if aggregate and written % update == 0:
+                print ".. {0} users written\r".format(written),
     print "Complete"
 
+def _scan_user_rows(tweets, num_tweets, update):
+    """
+    Compiles user rows from tweets, keeping one unsanitized tuple (ScreenName, Name, UserId,
+    Lang, FriendsCount, FollowersCount, Location, NumTweets) per user, from the user's
+    latest tweet. Returns list of rows.
+    """
+    user_data = {}
+    counter = 0
+    for tweet in tweets:
+        counter += 1
+        if counter % update == 0:
+            print ".. Progress: {0:.2%}\r".format(float(counter) / num_tweets),
+
+        user = tweet.get("user")
+        if not user or "id_str" not in user:
+            continue
+        uid = user["id_str"]
+        previous = user_data.get(uid)
+        timestamp = tweet.get("timestamp")
+        # Rows end with (NumTweets, timestamp of the tweet the row is from)
+        if previous and timestamp < previous[-1]:
+            user_data[uid] = previous[:-2] + (previous[-2] + 1, previous[-1])
+            continue
+        user_data[uid] = (user.get("screen_name"), user.get("name"), uid, user.get("lang"),
+            user.get("friends_count"), user.get("followers_count"), user.get("location"),
+            previous[-2] + 1 if previous else 1, timestamp)
+    return (row[:-1] for row in user_data.itervalues())
+
+def _aggregate_user_rows(collection, query):
+    """Groups tweets matching query by user in Mongo. Yields user rows (as _scan_user_rows)"""
+    match = dict(query)
+    match["user.id_str"] = {"$exists": True}
+    group = {"_id": "$user.id_str", "count": {"$sum": 1}}
+    for field in ("screen_name", "name", "lang", "friends_count", "followers_count", "location"):
+        group[field] = {"$last": "$user." + field}
+    # $last is only the latest tweet if tweets reach $group in timestamp order
+    pipeline = [{"$match": match}, {"$sort": {"timestamp": 1}}, {"$group": group}]
+    for u in collection.aggregate(pipeline, allowDiskUse=True, batchSize=10000):
+        yield (u.get("screen_name"), u.get("name"), u["_id"], u.get("lang"),
+            u.get("friends_count"), u.get("followers_count"), u.get("location"), u["count"])
+
+def _encode(value):
+    return value.encode("utf8") if isinstance(value, unicode) else value
+
+def _sanitize(value):
+    """Strips commas and newlines from a text field and encodes it for the CSV"""
+    if value is None:
+        return ""
+    return _encode(value.replace(",", "").replace("\n", ""))
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract and compile user information")
@@ -89,7 +152,19 @@ if __name__ == "__main__":
         help="File to store CSV user data to")
     parser.add_argument("--update", action="store", type=int, dest="update", default=10000,
         help="Update counter for print output (progress indicator)")
+    parser.add_argument("-r", "--rollup_collection", action="store", dest="rollup_collection",
+        default=None, help="Rollup collection of tweet collection (see smappPy.rollup), if any. " \
+        "Used to count tweets in the start/end date range")
+    parser.add_argument("-sd", "--start_date", type=int, nargs=5, default=None,
+        help="Only tweets with timestamp at or after given date. Format is five numbers, " \
+        "space-separated: Year Month Day Hour Minute. EG: 2014 3 15 12 0 [None]")
+    parser.add_argument("-ed", "--end_date", type=int, nargs=5, default=None,
+        help="Only tweets with timestamp at or before given date (format as start_date) [None]")
+    parser.add_argument("-a", "--aggregate", action="store_true", dest="aggregate", default=False,
+        help="Group tweets by user in the database (aggregation) instead of client-side")
     args = parser.parse_args()
+    start_date = datetime(*args.start_date) if args.start_date else None
+    end_date = datetime(*args.end_date) if args.end_date else None
 
     mc = MongoClient(args.host, args.port)
     db = mc[args.database]
@@ -98,6 +173,11 @@ if __name__ == "__main__":
             raise ConnectionFailure(
                 "Mongo DB Authentication for User {0}, DB {1} failed".format(args.user, args.database))
     collection = db[args.collection]
-    
-    extract_user_data(collection, args.outfile, update=args.update)
+    rollup = None
+    if args.rollup_collection:
+        from smappPy.rollup import TweetRollup
+        rollup = TweetRollup(db[args.rollup_collection], ensure_indexes=False)
+
+    extract_user_data(collection, args.outfile, start_date, end_date, update=args.update,
+        rollup=rollup, aggregate=args.aggregate)
 
@@ -6,6 +6,8 @@ import argparse
 from pymongo import MongoClient
 from datetime import datetime, timedelta
 from seaborn import color_palette
+from smappPy.aggregation import bucket_counts
+from smappPy.rollup import TweetRollup
 import matplotlib.pyplot as plt
 
 ## COMMANDLINE ################################################################
@@ -22,6 +24,7 @@ num_steps = 181
 client = MongoClient("smapp-data.bio.nyu.edu", 27011)
 database = client["RandomUsers"]
 collection = database["tweets"]
+rollup_collection = None    # Rollup of collection, if any (eg: database["tweets_rollup"])
 
 plot_super_title = "Random User Collection - Tweets per day"
 plot_sub_title = "Tweets per day through 2014"
@@ -59,12 +62,10 @@ if not database.authenticate(args.user, args.password):
     raise Exception("DB authentication failed")
 
 # Get tweets per day
-tweets_per_day = []
-for step in range(num_steps):
+rollup = TweetRollup(rollup_collection, ensure_indexes=False) if rollup_collection else None
+tweets_per_day = bucket_counts(collection, start, step_size, num_steps, rollup=rollup)
+for step, total in enumerate(tweets_per_day):
     query_start = start + (step * step_size)
-    tweets = collection.find({"timestamp": {"$gte": query_start, "$lt": query_start + step_size}})
-    total = tweets.count(with_limit_and_skip=True)
-    tweets_per_day.append(total)
     print "{0}: {1} - {2}: {3}".format(step, query_start, query_start + step_size, total)
 
 # Plot
@@ -9,6 +9,8 @@ from collections import OrderedDict
 from datetime import datetime, timedelta
 from seaborn import color_palette
 import matplotlib.pyplot as plt
+from smappPy.aggregation import bucket_counts_by
+from smappPy.rollup import TweetRollup
 
 ## COMMANDLINE ################################################################
 parser = argparse.ArgumentParser()
@@ -24,6 +26,7 @@ num_steps = 31
 client = MongoClient("smapp-data.bio.nyu.edu", 27011)
 database = client["TurkeyParkProtests"]
 collection = database["tweets"]
+rollup_collection = None    # Rollup of collection, if any (eg: database["tweets_rollup"])
 
 languages = ["tr", "en", "other"]
 language_colors = ["red", "royalblue", "grey"]
@@ -36,48 +39,22 @@ bar_width = 0.8
 # How often to show a date label on x-axis
 x_label_step = 2
 
-print_progress_every = 100000
-
 ## MAIN #######################################################################
 
 # Auth to DB
 if not database.authenticate(args.user, args.password):
     raise Exception("DB authentication failed")
 
-# Set up language count dict
+# Count tweets per time step and language (one aggregation query). Languages not in
+# the languages list (and tweets without a language) are counted as "other"
+rollup = TweetRollup(rollup_collection, ensure_indexes=False) if rollup_collection else None
+by_language = bucket_counts_by(collection, start, step_size, num_steps, field="lang",
+    values=[l for l in languages if l != "other"], other="other", rollup=rollup)
 language_counts = OrderedDict()
-for p in range(num_steps):
-    language_counts[p] = OrderedDict()
-    for l in languages:
-        language_counts[p][l] = 0
-
-# Iterate over time period, querying for tweets and storing counts
-# NOTE: Could do this with a few mapreduce queries
 for step in range(num_steps):
     query_start = start + (step * step_size)
+    language_counts[step] = OrderedDict((l, by_language[l][step]) for l in languages)
     print "{0}: {1} - {2}".format(step, query_start, query_start + step_size)
-    
-    tweets = collection.find({"timestamp": {"$gte": query_start, "$lt": query_start + step_size}})
-    total = tweets.count(with_limit_and_skip=True)
-    
-    counter = 0
-    for tweet in tweets:
-        if counter % print_progress_every == 0:
-            print "\t{0} of {1}".format(counter, total)
-        counter += 1
-
-        if "lang" not in tweet:
-            tweet["lang"] = "unk"
-        if tweet["lang"] in languages:
-            language_counts[step][tweet["lang"]] += 1
-        else:
-            language_counts[step]["other"] += 1
-        
-    count_total = 0
-    for l in languages:
-        count_total += language_counts[step][l]
-    assert count_total == total, "Error: Tweet by-language count does not match query total"
-    print "\tQuery total: {0}, Count total: {1}".format(total, count_total)
     print "\t{0}".format(language_counts[step])
 
 # Plot tweets in bars by language (in order of languages list)
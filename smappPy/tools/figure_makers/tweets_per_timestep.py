@@ -7,6 +7,8 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 from pymongo import MongoClient
 from datetime import datetime, timedelta
+from smappPy.aggregation import bucket_counts
+from smappPy.rollup import TweetRollup
 
 ## COMMANDLINE ################################################################
 parser = argparse.ArgumentParser()
@@ -22,6 +24,7 @@ num_steps = 200                    # Number of steps to plot
 client = MongoClient("smapp-politics", 27011)   # Dataserver host, port
 database = client["USLegislator"]                            # Database
 collection = database["tweets"]                         # Tweet collection
+rollup_collection = None      # Rollup of collection, if any (database["tweets_rollup"])
 
 plot_title = "USLEG: Tweets per 10-day"
 x_label = "Time"
@@ -38,10 +41,8 @@ if not database.authenticate(args.user, args.password):
 
 
 times = [start + (i * step_size) for i in range(num_steps)]
-counts = []
-for step in times:
-    tweets = collection.find({"timestamp": {"$gte": step, "$lt": step + step_size}})
-    counts.append(tweets.count())
+rollup = TweetRollup(rollup_collection, ensure_indexes=False) if rollup_collection else None
+counts = bucket_counts(collection, start, step_size, num_steps, rollup=rollup)
 
 sns.set_style("darkgrid")
 sns.set_palette("husl")
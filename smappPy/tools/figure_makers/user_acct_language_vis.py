@@ -10,6 +10,7 @@ from pymongo import MongoClient
 from seaborn import color_palette
 from collections import OrderedDict
 from datetime import datetime, timedelta
+from smappPy.collection_util import tweet_cursor
 
 
 # In[2]:
@@ -59,7 +60,8 @@ for day in days:
 
 # Run: Query for all day tweets, build up language dict counts
 for day in days:
-    tweets = collection.find({"timestamp": {"$gte": day, "$lt": day + step}})
+    tweets = tweet_cursor(collection, {"timestamp": {"$gte": day, "$lt": day + step}},
+        ["user.lang", "lang", "retweeted_status.lang"])
     print "Considering day {0}, {1} tweets".format(day, tweets.count(with_limit_and_skip=True))
     
     for tweet in tweets:
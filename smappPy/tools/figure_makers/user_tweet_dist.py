@@ -7,7 +7,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 from datetime import datetime
 from pymongo import MongoClient
-from collections import defaultdict
+from smappPy.aggregation import user_counts
 
 ## COMMANDLINE ################################################################
 parser = argparse.ArgumentParser()
@@ -27,33 +27,16 @@ plot_super_title = "Random User Collection - User Tweet Distribution"
 plot_sub_title = "User tweets 6/01/2014 to 6/10/2014"
 transparency = 0.5
 
-print_progress_every = 100000
-
 ## MAIN #######################################################################
 
 # Auth to DB
 if not database.authenticate(args.user, args.password):
     raise Exception("DB authentication failed")
 
-# Init user tweet count dict
-user_tweet_count = defaultdict(int)
-
-# Query DB for tweets, iterate to count
-tweets = collection.find({"timestamp": {"$gte": start, "$lt": end}})
-total_count = tweets.count(with_limit_and_skip=True)
-print "Considering {0} tweets in range {1} - {2}".format(
-    total_count, start, end)
-
-i = 0
-for tweet in tweets:
-    if i % print_progress_every == 0:
-        print "Considering {0} of {1}".format(i, total_count)
-    i += 1
-
-    if "user" not in tweet or "id" not in tweet["user"]:
-        continue
-    
-    user_tweet_count[tweet["user"]["id"]] += 1
+# Count tweets per user server-side (only per-user counts are transferred)
+user_tweet_count = user_counts(collection, start, end, user_field="user.id")
+print "Counted tweets of {0} users in range {1} - {2}".format(
+    len(user_tweet_count), start, end)
 
 # Plot and show
 n, bins, patches = plt.hist(user_tweet_count.values(), 
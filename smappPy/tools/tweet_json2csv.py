@@ -1,84 +1,237 @@
 """
 Simple script to extract fields from tweets, writing to CSV
 
-For all fields of a tweet, see the Twitter documentation: 
+For all fields of a tweet, see the Twitter documentation:
 https://dev.twitter.com/docs/platform-objects/tweets
+
+Columns are given as "Header=field" specs, where field is a dotted path into the tweet
+(eg: user.screen_name) or one of the computed COLUMN_FUNCTIONS (eg: hashtags). Eg:
+
+    python tweet_json2csv.py -i tweets.json.gz -o tweets.csv.gz -p 8 \
+        -c TweetId=id_str Text=text Hashtags=hashtags Lon=longitude Lat=latitude
+
+Input (JSON, tweet-per-line) is split into byte ranges parsed by a pool of processes
+(gzipped input is read by the main process and handed out in batches of lines), and
+CSV output is written in input order, with at most two chunks per process in flight
+(so memory stays bounded when output is written slower than input is parsed). Files
+ending in .gz are read/written gzipped.
 """
 
+import os
 import csv
-import json
+import gzip
 import argparse
+import cStringIO
+import multiprocessing
+from collections import deque
+from itertools import imap
+from simplejson import loads as json_loads
+
+MISSING = "NA"
+
+## ADD FIELDS HERE. These are the default CSV columns: (header, field) pairs, where
+## field is a dotted path into the tweet or the name of a computed column below
+DEFAULT_COLUMNS = [
+    ("TweetId", "id_str"),
+    ("UserID", "user.id_str"),
+    ("UserScreenName", "user.screen_name"),
+    ("TweetDate", "created_at"),
+    ("TweetText", "text"),
+    ("IsRetweet", "is_retweet"),
+    ("RetweetedID", "retweeted_id"),
+]
+
+def _entity_texts(tweet, entity, key):
+    entities = tweet.get("entities") or {}
+    return " ".join(e[key] for e in entities.get(entity) or [])
+
+def _point(tweet):
+    point = tweet.get("coordinates")
+    return point["coordinates"] if point else None
+
+## Computed columns: name -> function of tweet (returning None if missing)
+COLUMN_FUNCTIONS = {
+    "is_retweet": lambda t: "True" if "retweeted_status" in t else "False",
+    "retweeted_id": lambda t: t["retweeted_status"]["id_str"] if "retweeted_status" in t else None,
+    "hashtags": lambda t: _entity_texts(t, "hashtags", "text"),
+    "mentions": lambda t: _entity_texts(t, "user_mentions", "screen_name"),
+    "urls": lambda t: _entity_texts(t, "urls", "expanded_url"),
+    "longitude": lambda t: _point(t) and _point(t)[0],
+    "latitude": lambda t: _point(t) and _point(t)[1],
+}
+
+
+def parse_columns(specs):
+    """Takes list of "Header=field" strings (or field alone). Returns (header, field) list"""
+    columns = []
+    for spec in specs:
+        header, _, field = spec.partition("=")
+        columns.append((header, field or header))
+    return columns
+
+def _path_accessor(field):
+    path = field.split(".")
+    def get(tweet):
+        value = tweet
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+def compile_columns(columns):
+    """
+    Takes list of (header, field) columns. Returns function of a tweet returning its CSV
+    row: utf8 strings with whitespace (eg: newlines in text) collapsed, MISSING for
+    missing values.
+    """
+    accessors = [COLUMN_FUNCTIONS.get(field) or _path_accessor(field) for _, field in columns]
+    def row(tweet):
+        values = []
+        for get in accessors:
+            value = get(tweet)
+            if value is None:
+                values.append(MISSING)
+            elif isinstance(value, basestring):
+                if isinstance(value, unicode):
+                    value = value.encode("utf8")
+                values.append(" ".join(value.split()))
+            else:
+                values.append(str(value))
+        return values
+    return row
+
+
+def _open(filename, mode):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+def _byte_ranges(filename, chunk_bytes):
+    """Returns list of (start, end) byte ranges of file, each starting at a line"""
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, "rb") as handle:
+        while starts[-1] + chunk_bytes < size:
+            handle.seek(starts[-1] + chunk_bytes)
+            handle.readline()
+            if handle.tell() >= size:
+                break
+            starts.append(handle.tell())
+    return zip(starts, starts[1:] + [size])
+
+def _read_range(filename, start, end):
+    with open(filename, "rb") as handle:
+        handle.seek(start)
+        return handle.read(end - start).splitlines()
+
+def _batches(filename, batch_lines):
+    """Yields lists of batch_lines lines of (gzipped) file"""
+    batch = []
+    with _open(filename, "rb") as handle:
+        for line in handle:
+            batch.append(line)
+            if len(batch) >= batch_lines:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# Row function of each worker process, set by _init_worker
+_row = None
+
+def _init_worker(columns):
+    global _row
+    _row = compile_columns(columns)
+
+def _convert(task):
+    """Takes a list of lines or (filename, start, end). Returns (num tweets, CSV string)"""
+    lines = _read_range(*task) if isinstance(task, tuple) else task
+    buf = cStringIO.StringIO()
+    rows = [_row(json_loads(line)) for line in lines if line.strip()]
+    csv.writer(buf).writerows(rows)
+    return len(rows), buf.getvalue()
+
+def _ordered_results(pool, func, tasks, window):
+    """
+    Yields results of func on each task, in order, run in pool. At most 'window' tasks
+    are submitted and not yet yielded at any time (unlike pool.imap, which submits all)
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def export_csv(infile, outfile, columns=DEFAULT_COLUMNS, processes=None, chunk_bytes=16 << 20,
+    batch_lines=20000, counter=100000):
+    """
+    Takes JSON (tweet-per-line) input filename and CSV output filename (either may end in
+    .gz). Writes a header row and one row per tweet of the given (header, field)
+    columns, converting in 'processes' processes (default: number of cpus; 1 converts
+    in this process). Returns number of tweets written.
+    """
+    if infile.endswith(".gz"):
+        tasks = _batches(infile, batch_lines)
+    else:
+        tasks = [(infile, start, end) for start, end in _byte_ranges(infile, chunk_bytes)]
 
-
-def write_csv(inhandle, outhandle, counter=10000):
+    processes = processes or multiprocessing.cpu_count()
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, _init_worker, (columns,))
+        results = _ordered_results(pool, _convert, tasks, 2 * processes)
+    else:
+        _init_worker(columns)
+        results = imap(_convert, tasks)
+
+    total, reported = 0, 0
+    try:
+        with _open(outfile, "wb") as outhandle:
+            csv.writer(outhandle).writerow([header for header, _ in columns])
+            for count, data in results:
+                outhandle.write(data)
+                total += count
+                if counter and total - reported >= counter:
+                    print "Processed {0} tweets".format(total)
+                    reported = total
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return total
+
+def write_csv(inhandle, outhandle, columns=DEFAULT_COLUMNS, counter=10000):
     """Takes json infile handle and csv outfile handle. Writes CSV from JSON"""
-
-    ## ADD FIELDS HERE. These are the CSV column headers. Should reflect the
-    ## fields chosen below, so that the CSV contains accurate column labels
-    csv_header = [
-        "TweetId",
-        "UserID",
-        "UserScreenName",
-        "TweetDate",
-        "TweetText",
-        "IsRetweet",
-        "RetweetedID",
-    ]
-
+    row = compile_columns(columns)
     csv_writer = csv.writer(outhandle)
-    csv_writer.writerow(csv_header)
+    csv_writer.writerow([header for header, _ in columns])
     line_count = 0
     for line in inhandle:
         if line_count % counter == 0:
             print "Processing tweet {0}".format(line_count)
         line_count += 1
-
-        json_tweet = json.loads(line)
-        row = []
-
-        ## ADD FIELDS HERE. For all available fields, refer to the Twitter doc
-        ## page above. Note that tweet fields are accessed via the ["FIELD"]
-        ## notation. Nested fields (eg: user) can be chained together, as in
-        ## json_tweet["user"]["screen_name"]
-        add_field_to_row(row, json_tweet["id_str"])
-        add_field_to_row(row, json_tweet["user"]["id_str"])
-        add_field_to_row(row, json_tweet["user"]["screen_name"])
-        add_field_to_row(row, json_tweet["created_at"])
-        add_field_to_row(row, json_tweet["text"])
-
-        # Check whether tweet is an official Retweet
-        if "retweeted_status" in json_tweet:
-            add_field_to_row(row, "True")
-            add_field_to_row(row, json_tweet["retweeted_status"]["id_str"])
-        else:
-            add_field_to_row(row, "False")
-            add_field_to_row(row, "NA")
-
-        # ... etc:
-        # add_field_to_row(row, json_tweet["SOME FIELD"])
-
-        csv_writer.writerow(row)
+        csv_writer.writerow(row(json_loads(line)))
     print "Complete. CSV Outfile: {0}".format(outhandle.name)
 
 
-## IGNORE THIS. Simple code to clean tweet fields
-def add_field_to_row(row, field):
-    """Adds field to row list, making sure field is safe"""
-    if type(field) == unicode:
-        field = field.encode("utf8")
-    else:
-        field = str(field)
-    field = " ".join(field.split())
-    row.append(field)
-
 ## IGNORE THIS. Code to read command-line arguments
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Reads JSON tweet file, exports simple CSV")
-    parser.add_argument("-i", "--infile", type=argparse.FileType("r"), required=True,
-        dest="inhandle", help="Input file of tweets. JSON format, tweet-per-line")
-    parser.add_argument("-o", "--outfile", type=argparse.FileType("wb"), required=True,
-        dest="outhandle", help="Tweet CSV output file to create")
+    parser.add_argument("-i", "--infile", required=True, dest="infile",
+        help="Input file of tweets. JSON format, tweet-per-line (.gz for gzipped)")
+    parser.add_argument("-o", "--outfile", required=True, dest="outfile",
+        help="Tweet CSV output file to create (.gz for gzipped)")
+    parser.add_argument("-c", "--columns", nargs="+", dest="columns", default=None,
+        help="Columns, as Header=field (dotted path, or one of: {0}). Default: {1}".format(
+            ", ".join(sorted(COLUMN_FUNCTIONS)), " ".join("=".join(c) for c in DEFAULT_COLUMNS)))
+    parser.add_argument("-p", "--processes", type=int, dest="processes", default=None,
+        help="Number of processes (default: number of cpus)")
     args = parser.parse_args()
-    write_csv(args.inhandle, args.outhandle)
-
-
+    total = export_csv(args.infile, args.outfile,
+        parse_columns(args.columns) if args.columns else DEFAULT_COLUMNS, args.processes)
+    print "Complete. Wrote {0} tweets to CSV Outfile: {1}".format(total, args.outfile)
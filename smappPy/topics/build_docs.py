@@ -7,10 +7,16 @@ from smappPy.MT import is_MT
 from smappPy.retweet import is_retweet
 from smappPy.text_clean import clean_whitespace
 from smappPy.entities import remove_entities_from_text
+from smappPy.collection_util import tweet_cursor
 
 
 COUNTER = 10000
 
+# Tweet fields read by build_tweet_time_docs: text, entity indices (for entity removal),
+# and whether the tweet is an official retweet
+TIME_DOC_FIELDS = ["text", "retweeted_status.id"] + ["entities.{0}.indices".format(e)
+    for e in ("urls", "media", "symbols", "hashtags", "user_mentions")]
+
 
 def build_tweet_user_docs(collection, outhandle, remove_hashtags, remove_mentions, 
         remove_RTs, remove_MTs, start=None, end=None):
@@ -36,7 +42,8 @@ def build_tweet_time_docs(collection, outhandle, start, num_periods, time_step,
     for period in [start + (time_step * x) for x in range(num_periods)]:
         print "Processing {0}".format(period)
         
-        tweets = collection.find({"timestamp": {"$gte": period, "$lt": period + time_step}})
+        tweets = tweet_cursor(collection, {"timestamp": {"$gte": period, "$lt": period + time_step}},
+            TIME_DOC_FIELDS)
         tweet_count = tweets.count(with_limit_and_skip=True)
         count = 0
         
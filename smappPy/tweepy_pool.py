@@ -9,6 +9,7 @@ import logging
 from datetime import datetime
 from tweepy import TweepError
 from tweepy_error_handling import parse_tweepy_error
+from tweepy_pool_state import SharedThrottleState, token_key
 
 
 OVER_CAP_ERROR = 130
@@ -34,27 +35,35 @@ class APIPool(object):
     If 'use_appauth' is True, stores additional application-only auth objects in self._apis list
     (such that there is one oauth and one appauth API for each given token).
     (https://dev.twitter.com/oauth/application-only)
+
+    If 'state_file' is given, throttle times are also recorded in (and read from) a
+    SharedThrottleState at that path, so that all pools on a host using the same tokens
+    (eg: concurrent populate_user_tweets and build_friends_followers jobs) route around
+    each other's rate limits. Each entry of self._apis is [api, throttle dict, token key].
     """
 
     def __init__(self, oauths=None, oauths_filename=None, time_to_wait=15*60,
-            use_appauth=True, debug=False):
+            use_appauth=True, debug=False, state_file=None):
         """
         Instantiate APIPool using either a list of oauths (which are dicts with keys
         secrets and tokens) or using a file which contains these in JSON format.
         """
 
         self.time_to_wait = time_to_wait
+        self.shared_state = SharedThrottleState(state_file) if state_file else None
 
         if oauths_filename:
             with open(oauths_filename) as file:
                 oauths = json.load(file)
 
         oauth_handlers = [self._get_tweepy_oauth_handler(oauth_dict) for oauth_dict in oauths]
-        self._apis =[[tweepy.API(oauth_handler), dict()] for oauth_handler in oauth_handlers]
+        self._apis = [[tweepy.API(oauth_handler), dict(), token_key(oauth_dict)]
+            for oauth_handler, oauth_dict in zip(oauth_handlers, oauths)]
 
         if use_appauth:
             appauth_handlers = [self._get_tweepy_appauth_handler(oauth_dict) for oauth_dict in oauths]
-            self._apis += [[tweepy.API(appauth_handler), dict()] for appauth_handler in appauth_handlers]
+            self._apis += [[tweepy.API(appauth_handler), dict(), token_key(oauth_dict, appauth=True)]
+                for appauth_handler, oauth_dict in zip(appauth_handlers, oauths)]
 
         self.parser = self._apis[0][0].parser
 
@@ -69,6 +78,24 @@ class APIPool(object):
         else:
             return object.__getattribute__(self, name)
 
+    def partition(self, n):
+        """
+        Returns list of 'n' pools over disjoint shares of this pool's apis (dealt round-
+        robin), eg: one per worker thread, so concurrent callers don't all pick the same
+        api. With fewer apis than 'n', shares are reused. Shares keep this pool's settings
+        and shared state (if any).
+        """
+        # '__dict__' is in tweepy.API's class dict, so __getattribute__ would wrap it
+        state = object.__getattribute__(self, "__dict__")
+        k = min(n, len(self._apis))
+        pools = []
+        for j in range(k):
+            pool = object.__new__(type(self))
+            object.__getattribute__(pool, "__dict__").update(state)
+            pool._apis = self._apis[j::k]
+            pools.append(pool)
+        return [pools[i % k] for i in range(n)]
+
     def _get_tweepy_oauth_handler(self, oauth_dict):
         try:
             auth = tweepy.OAuthHandler(oauth_dict["consumer_key"], oauth_dict["consumer_secret"])
@@ -84,6 +111,8 @@ class APIPool(object):
             print TweepError
 
     def _pick_api_with_shortest_waiting_time_for_method(self, method_name):
+        if self.shared_state:
+            return self._reserve_shared_api_for_method(method_name)
         ret_api_struct = self._apis[0]
         for api_struct in self._apis:
             if api_struct[1].get(method_name, datetime.min) < ret_api_struct[1].get(
@@ -91,6 +120,28 @@ class APIPool(object):
                 ret_api_struct = api_struct
         return ret_api_struct
 
+    def _reserve_shared_api_for_method(self, method_name):
+        """
+        Picks (and reserves, for other pools to see) the api with the shortest wait for
+        method_name according to shared state. Syncs the picked api's local throttle time
+        with the shared one, so waiting logic sees throttles recorded by other processes.
+        """
+        index, throttled = self.shared_state.reserve([a[2] for a in self._apis], method_name,
+            self.time_to_wait)
+        api_struct = self._apis[index]
+        if throttled:
+            shared_time = datetime.fromtimestamp(throttled)
+            if shared_time > api_struct[1].get(method_name, datetime.min):
+                api_struct[1][method_name] = shared_time
+        return api_struct
+
+    def _set_throttle_time(self, api_struct, method_name, when):
+        """Notes throttle time for method on api, locally and in shared state (if any)"""
+        api_struct[1][method_name] = when
+        if self.shared_state:
+            self.shared_state.record_throttle(api_struct[2], method_name,
+                time.mktime(when.timetuple()))
+
     def _call_with_throttling_per_method(self, method_name, *args, **kwargs):
         api_struct = self._pick_api_with_shortest_waiting_time_for_method(method_name)
         now = datetime.now()
@@ -108,7 +159,7 @@ class APIPool(object):
         except TweepError as e:
             error_dict = parse_tweepy_error(e)
             if error_dict["code"] in [RATE_LIMIT_ERROR, TOO_MANY_REQUESTS, OVER_CAP_ERROR]:
-                api_struct[1][method_name] = now
+                self._set_throttle_time(api_struct, method_name, now)
                 logger.debug("Received limit message: {0}".format(error_dict["message"]))
                 return self._call_with_throttling_per_method(method_name, *args, **kwargs)
             else:
@@ -152,14 +203,14 @@ class APIBreakPool(APIPool):
             error_dict = parse_tweepy_error(e)
 
             if error_dict["code"] in [RATE_LIMIT_ERROR, TOO_MANY_REQUESTS]:
-                api_struct[1][method_name] = now
+                self._set_throttle_time(api_struct, method_name, now)
                 logger.debug("Received limit message: {0}".format(error_dict["message"]))
                 if self.break_on_rate_limit:
                     raise RateLimitException(error_dict["message"], error_dict)
                 else:
                     return self._call_with_throttling_per_method(method_name, *args, **kwargs)
             elif error_dict["code"] == OVER_CAP_ERROR:
-                api_struct[1][method_name] = now
+                self._set_throttle_time(api_struct, method_name, now)
                 logger.debug("Received over cap.: {0}".format(error_dict["message"]))
                 return self._call_with_throttling_per_method(method_name, *args, **kwargs)
             else:
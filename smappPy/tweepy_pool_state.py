@@ -0,0 +1,129 @@
+"""
+Shared rate-limit state for APIPool. Lets every APIPool on a host (across processes)
+see which tokens are throttled on which endpoints, so concurrent jobs using the same
+oauths file spread their calls over the token budget instead of colliding on it.
+
+State lives in a local SQLite file (one row per token, per method). SQLite handles
+the cross-process file locking; writes are done in IMMEDIATE transactions so that
+picking a token and reserving it is atomic.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS throttles (
+    token TEXT NOT NULL,
+    method TEXT NOT NULL,
+    throttled REAL NOT NULL DEFAULT 0,
+    reserved REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (token, method)
+)
+"""
+
+
+def token_key(oauth_dict, appauth=False):
+    """
+    Returns a stable, secret-free key identifying a token (and auth type) for use
+    in shared state. Keys are hashes of the consumer key and access token.
+    """
+    if appauth:
+        raw = "appauth:{0}".format(oauth_dict["consumer_key"])
+    else:
+        raw = "oauth:{0}:{1}".format(oauth_dict["consumer_key"], oauth_dict["access_token"])
+    return hashlib.sha1(raw).hexdigest()
+
+
+class SharedThrottleState(object):
+    """
+    SQLite-backed store of per-token, per-method throttle and reservation times.
+    'throttled' is the epoch time a token last hit a rate limit on a method,
+    'reserved' is the epoch time any pool last picked that token for that method.
+    Safe to use from multiple threads and processes (connections are reopened
+    after a fork).
+    """
+
+    def __init__(self, filename, timeout=30):
+        self.filename = filename
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        with self._lock:
+            self._connection().execute(CREATE_TABLE)
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                isolation_level=None, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def throttle_times(self, tokens, method):
+        """Returns dict of token -> epoch throttle time for given tokens and method"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT token, throttled FROM throttles WHERE method = ?", (method,)).fetchall()
+        wanted = set(tokens)
+        return dict((t, th) for t, th in rows if t in wanted)
+
+    def record_throttle(self, token, method, when=None):
+        """Records that token hit a rate limit on method at epoch time 'when' (default now)"""
+        when = when or time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT OR IGNORE INTO throttles (token, method) VALUES (?, ?)",
+                    (token, method))
+                conn.execute("UPDATE throttles SET throttled = MAX(throttled, ?) "
+                    "WHERE token = ? AND method = ?", (when, token, method))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def reserve(self, tokens, method, time_to_wait):
+        """
+        Atomically picks the best token for 'method' from 'tokens' and marks it
+        reserved. Tokens whose throttle is older than 'time_to_wait' seconds count
+        as unthrottled. Ties are broken by least-recently reserved, so concurrent
+        pools round-robin over free tokens.
+        Returns tuple: (index into tokens, epoch throttle time of picked token)
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("SELECT token, throttled, reserved FROM throttles "
+                    "WHERE method = ?", (method,)).fetchall()
+                state = dict((t, (th, res)) for t, th, res in rows)
+
+                def sort_key(i):
+                    throttled, reserved = state.get(tokens[i], (0.0, 0.0))
+                    if now - throttled >= time_to_wait:
+                        throttled = 0.0
+                    return (throttled, reserved, i)
+                best = min(range(len(tokens)), key=sort_key)
+
+                conn.execute("INSERT OR IGNORE INTO throttles (token, method) VALUES (?, ?)",
+                    (tokens[best], method))
+                conn.execute("UPDATE throttles SET reserved = ? WHERE token = ? AND method = ?",
+                    (now, tokens[best], method))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return best, state.get(tokens[best], (0.0, 0.0))[0]
+
+    def clear(self):
+        """Removes all recorded state"""
+        with self._lock:
+            self._connection().execute("DELETE FROM throttles")
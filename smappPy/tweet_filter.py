@@ -7,6 +7,9 @@ Functions and docstrings parsed directly by the web dashboard for adding these t
 2014/11/19 @jonathanronen
 """
 
+# Imported privately: the dashboard lists this module's public callables as filters
+from smappPy import keyword_matcher as _keyword_matcher
+
 def field_contains(tweet, field, *terms, **kwargs):
     """
     Returns true if the text in tweet[field] contains any of the terms given.
@@ -24,11 +27,16 @@ def field_contains(tweet, field, *terms, **kwargs):
     ========
     field_contains(tweet, 'user.screen_name', 'obama', 'putin')
     # true if the user's handle contains 'obama' or 'putin'
+
+    For long term lists, a smappPy.keyword_matcher.KeywordMatcher built once from the
+    terms may be given as the only term (its own case-sensitivity applies).
     """
     path = field.split('.')
     value = tweet
     for p in path:
         value = value[p]
+    if len(terms) == 1 and isinstance(terms[0], _keyword_matcher.KeywordMatcher):
+        return terms[0].search(value)
     if kwargs.get("case_sensitive", False):
         return any(term in value for term in terms)
     else:
@@ -25,6 +25,15 @@ def add_timestamp_to_tweet(tweet):
         raise Exception("Tweet (id_str: {0}) has no 'created_at' field".format(tweet['id_str']))
     tweet[TIMESTAMP_FIELD] = mongodate_to_datetime(tweet['created_at'])
 
+def get_timestamp(tweet):
+    """
+    Returns tweet's native datetime timestamp field, if set; otherwise parses and returns
+    its 'created_at' field (without modifying the tweet)
+    """
+    if tweet.get(TIMESTAMP_FIELD) is not None:
+        return tweet[TIMESTAMP_FIELD]
+    return mongodate_to_datetime(tweet["created_at"])
+
 def contains_place(tweet):
     """
     Returns True if tweet contains a populated 'place' field
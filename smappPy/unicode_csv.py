@@ -38,20 +38,27 @@ class UnicodeReader:
     def __iter__(self):
         return self
 
+# Cell types written as they are by UnicodeWriter.writerows (not floats: csv writes repr)
+_PASS_THROUGH = frozenset([str, int, long, bool])
+
 class UnicodeWriter:
     """
     A CSV writer which will write rows to CSV file "f",
     which is encoded in the given encoding.
     NOTE: Change from normal CSV writer: every element of row must be a string 
     or UNICODE string
+    For UTF-8 files, rows are written without the decode/re-encode round trip.
+    writerows formats up to 'batch_size' rows at a time and writes each batch at once.
     """
 
-    def __init__(self, f, dialect=csv.excel, encoding="utf-8", **kwds):
+    def __init__(self, f, dialect=csv.excel, encoding="utf-8", batch_size=10000, **kwds):
         # Redirect output to a queue
         self.queue = cStringIO.StringIO()
         self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
         self.stream = f
         self.encoder = codecs.getincrementalencoder(encoding)()
+        self.utf8 = codecs.lookup(encoding).name == "utf-8"
+        self.batch_size = batch_size
 
     def writerow(self, row):
         try:
@@ -62,21 +69,47 @@ class UnicodeWriter:
         except UnicodeEncodeError:
             print row
             raise
+        self._write_queue()
+
+    def writerows(self, rows):
+        batch, encode = [], self.utf8_encode
+        for row in rows:
+            try:
+                # Inline the common cases of utf8_encode; csv formats ints as str() does
+                batch.append([c.encode("utf-8") if type(c) is unicode else
+                              c if type(c) in _PASS_THROUGH else encode(c) for c in row])
+            except UnicodeDecodeError:
+                print row
+                raise
+            except UnicodeEncodeError:
+                print row
+                raise
+            if len(batch) >= self.batch_size:
+                self.writer.writerows(batch)
+                self._write_queue()
+                batch = []
+        if batch:
+            self.writer.writerows(batch)
+            self._write_queue()
+
+    def _write_queue(self):
         # Fetch UTF-8 output from the queue ...
         data = self.queue.getvalue()
-        data = data.decode("utf-8")
-        # ... and reencode it into the target encoding
-        data = self.encoder.encode(data)
+        if not self.utf8:
+            data = data.decode("utf-8")
+            # ... and reencode it into the target encoding
+            data = self.encoder.encode(data)
         # write to the target stream
         self.stream.write(data)
         # empty queue
         self.queue.truncate(0)
 
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
-
     def utf8_encode(self, thing):
-        if not isinstance(thing, basestring):
-            thing = unicode(thing)
-        return thing.encode("utf-8")
+        if isinstance(thing, unicode):
+            return thing.encode("utf-8")
+        elif isinstance(thing, str):
+            # Byte strings are taken to be UTF-8 (or ascii) already
+            return thing
+        elif isinstance(thing, (int, long, float)):
+            return str(thing)
+        return unicode(thing).encode("utf-8")
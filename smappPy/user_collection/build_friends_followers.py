@@ -11,14 +11,18 @@ import argparse
 import warnings
 from tweepy import Cursor
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne
 from pymongo.errors import DuplicateKeyError
+from smappPy.iter_util import grouper
 from smappPy.tweepy_pool import APIPool
+from smappPy.collection_util import bulk_write_ignore_duplicates
 from smappPy.tweepy_error_handling import call_with_error_handling
+from smappPy.networks.adjacency_store import AdjacencyStore, IN, OUT
 from smappPy.user_collection.userdocs import ensure_userdoc_indexes, create_userdoc
 from smappPy.user_collection.network_edges import create_edge_doc, ensure_edge_indexes
 
 BSON_NULL = 10
+ID_PAGE_SIZE = 5000
 
 logger = logging.getLogger(__name__)
 
@@ -37,49 +41,45 @@ logger = logging.getLogger(__name__)
 #TODO: based on twitter response (so can skip these users)
 
 
-def get_friends_ids(api, user_id):
+def fetch_and_store_ids(api_method, user_id, user_collection, edge_collection=None,
+    seed_is_source=True, chunk_size=ID_PAGE_SIZE):
     """
-    Given a Tweepy/smappPy TweepyPool api, query twitter's rest API for friends of
-    given user_id. Returns IDs only (much faster / more per request).
-    Parameters:
-        api     - fully authenticated Tweepy api or smappPy TweepyPool api
-        user_id - twitter user id
-    Returns tuple: return code, list of IDs or None (if API call fails)
-    """
-    cursor = Cursor(api.friends_ids, user_id=user_id)
-    user_list, ret_code = call_with_error_handling(list, cursor.items())
-   
-    if ret_code != 0:
-        logger.warning("User {0}: Friends request failed".format(user_id))
-    
-    # Return user list from API or None (call_with_error_handling returns None if
-    # call fail)
-    return ret_code, user_list
-
-
-def get_followers_ids(api, user_id):
-    """
-    Given a Tweepy/smappPy TweepyPool api, query twitter's rest API for followers of
-    given user_id. Returns IDs only (much faster / more per request).
-    Parameters:
-        api     - fully authenticated Tweepy api or smappPy TweepyPool api
-        user_id - twitter user id
-    Returns tuple: return code, list of IDs or None (if API call fails)
+    Streams friend or follower IDs of user_id from given api method (eg: api.friends_ids),
+    storing a userdoc per ID in user_collection (and optionally an edge doc per ID in
+    edge_collection) with bulk inserts, every 'chunk_size' IDs as the cursor pages,
+    rather than after the full list is fetched.
+    edge_collection may also be an AdjacencyStore, in which case all fetched IDs are merged
+    into user_id's neighbor list once the cursor is done (or fails).
+    seed_is_source - True if edges go from user_id to fetched IDs (friends), False if
+                     edges go from fetched IDs to user_id (followers)
+    Returns tuple: return code (0 on success), list of IDs fetched (kept for the seed
+    userdoc's ID list; partial if a page failed, the pages before it are stored)
     """
-    cursor = Cursor(api.followers_ids, user_id=user_id)
-    user_list, ret_code = call_with_error_handling(list, cursor.items())
-
+    fetched_ids = []
+    use_adjacency = isinstance(edge_collection, AdjacencyStore)
+    def stream():
+        cursor = Cursor(api_method, user_id=user_id)
+        for chunk in grouper(chunk_size, cursor.items(), pad=False):
+            _save_userdocs(chunk, user_collection)
+            if edge_collection and not use_adjacency:
+                if seed_is_source:
+                    _save_friend_edges(user_id, chunk, edge_collection)
+                else:
+                    _save_follower_edges(user_id, chunk, edge_collection)
+            fetched_ids.extend(chunk)
+
+    _, ret_code = call_with_error_handling(stream)
+    if use_adjacency and fetched_ids:
+        edge_collection.add_neighbors(user_id, fetched_ids, OUT if seed_is_source else IN)
     if ret_code != 0:
-        logger.warning("User {0}: Followers request failed".format(user_id))
-    
-    # Return user list from API or None (call_with_error_handling returns None if
-    # call fail)
-    return ret_code, user_list
+        logger.warning("User {0}: IDs request failed after {1} IDs".format(user_id,
+            len(fetched_ids)))
+    return ret_code, fetched_ids
 
 
 def populate_friends_from_collection(api, seed_collection, friend_collection, edge_collection=None,
     user_sample=1.0, friends_threshold=20000, update_threshold=None, requery=True,
-    print_progress_every=1000):
+    print_progress_every=1000, chunk_size=ID_PAGE_SIZE):
     """
     Populates given 'friends_collection' with local user documents representing the friends
     of each user in given 'seed_collection'.
@@ -92,17 +92,19 @@ def populate_friends_from_collection(api, seed_collection, friend_collection, ed
         seed_collection    - fully authenticated (read/write) mongo collection
         friend_collection  - fully authenticated (read/write) mongo collection
         edge_collection    - [OPTIONAL] collection to store simple edge: {to: ID, from: ID}
+                             or AdjacencyStore (compact per-user neighbor lists)
         user_sample        - proportion of seed users to fetch friends for
         requery            - If False, only query for user's friends if 'friend_ids' field is empty
         friends_threshold  - If user has > friends_threshold, DO NOT QUERY for friends. If user's
                            - doc does not contain 'friends_count', ignore and query anyway
         update_threshold   - Datetime threshold on users to update. Only queries friends of users
                              with 'friends_updated' field LT 'update_threshold'
+        chunk_size         - Number of friend IDs to bulk-store at a time, as they are fetched
     """
     # Ensure indexes
     ensure_userdoc_indexes(seed_collection)
     ensure_userdoc_indexes(friend_collection)
-    if edge_collection:
+    if edge_collection and not isinstance(edge_collection, AdjacencyStore):
         ensure_edge_indexes(edge_collection)
 
     # Create cursor over users (sample and date restriction possible)
@@ -140,12 +142,14 @@ def populate_friends_from_collection(api, seed_collection, friend_collection, ed
                 user["id"], user["friends_count"], friends_threshold))
             continue
 
-        r, friend_ids = get_friends_ids(api, user["id"])
+        # Fetch IDs, saving userdocs (and optionally "edge" documents) as they page in
+        r, friend_ids = fetch_and_store_ids(api.friends_ids, user["id"], friend_collection,
+            edge_collection, seed_is_source=True, chunk_size=chunk_size)
         if _check_return_set_user(r, user, seed_collection):
             logging.info("User {0} unreachable, skipping".format(user["id"]))
             continue
 
-        if friend_ids == None:
+        if r != 0:
             friend_request_failed_for.append(user["id"])
             continue
 
@@ -155,13 +159,6 @@ def populate_friends_from_collection(api, seed_collection, friend_collection, ed
         else:
             user["friend_ids"] = list(set(user["friend_ids"] + friend_ids))
 
-        # Save all friends as userdocs in friends collection
-        _save_userdocs(friend_ids, friend_collection)
-
-        # Optionally save "edge" documents
-        if edge_collection:
-            _save_friend_edges(user["id"], friend_ids, edge_collection)
-
         # Update user doc's timestamps and save
         user["updated_timestamp"] = datetime.now()
         user["friends_updated"] = datetime.now()
@@ -173,14 +170,14 @@ def populate_friends_from_collection(api, seed_collection, friend_collection, ed
 
 def populate_followers_from_collection(api, seed_collection, follower_collection, edge_collection=None,
     user_sample=1.0, followers_threshold=20000, update_threshold=None, requery=True,
-    print_progress_every=1000):
+    print_progress_every=1000, chunk_size=ID_PAGE_SIZE):
     """
     See 'populate_friends_from_collection'. Exactly the same, but for followers
     """
     # Ensure indexes
     ensure_userdoc_indexes(seed_collection)
     ensure_userdoc_indexes(follower_collection)
-    if edge_collection:
+    if edge_collection and not isinstance(edge_collection, AdjacencyStore):
         ensure_edge_indexes(edge_collection)
 
     # Create cursor over users (sample and date restriction possible)
@@ -218,12 +215,14 @@ def populate_followers_from_collection(api, seed_collection, follower_collection
             continue
 
 
-        r, follower_ids = get_followers_ids(api, user["id"])
+        # Fetch IDs, saving userdocs (and optionally "edge" documents) as they page in
+        r, follower_ids = fetch_and_store_ids(api.followers_ids, user["id"], follower_collection,
+            edge_collection, seed_is_source=False, chunk_size=chunk_size)
         if _check_return_set_user(r, user, seed_collection):
             logging.info("User {0} unreachable, skipping".format(user["id"]))
             continue
 
-        if follower_ids == None:
+        if r != 0:
             follower_request_failed_for.append(user["id"])
             continue
 
@@ -232,13 +231,6 @@ def populate_followers_from_collection(api, seed_collection, follower_collection
             user["follower_ids"] = list(set(follower_ids))
         else:
             user["follower_ids"] = list(set(user["follower_ids"] + follower_ids))
-        
-        # Save all followers as userdocs in followers collection
-        _save_userdocs(follower_ids, follower_collection)
-
-        # Optionally save "edge" documents
-        if edge_collection:
-            _save_follower_edges(user["id"], follower_ids, edge_collection)
 
         # Update user doc's timestamps and save
         user["updated_timestamp"] = datetime.now()
@@ -289,40 +281,28 @@ def _check_return_set_user(ret_val, user_doc, collection):
 
 
 def _save_userdocs(user_ids, collection):
-    """Given a list of user IDs, save userdocs built from IDs to given collection"""
-    for uid in user_ids:
-        user_doc = create_userdoc(uid)
-        try:
-            collection.save(user_doc)
-        except DuplicateKeyError:
-            logger.warn("User {0} already in collection {1}".format(uid, collection.full_name))
-        except Exception as e:
-            logger.error("Storing User {0} in DB {1} failed".format(uid, collection.full_name))
-            logger.error("Exception: {0}".format(e))
+    """
+    Given a list of user IDs, save userdocs built from IDs to given collection, in one
+    unordered bulk insert (users already in collection are skipped)
+    """
+    result = bulk_write_ignore_duplicates(collection,
+        [InsertOne(create_userdoc(uid)) for uid in user_ids])
+    logger.debug("Stored {0} of {1} users in {2}".format(result["nInserted"], len(user_ids),
+        collection.full_name))
 
 def _save_friend_edges(seed_id, friend_ids, collection):
-    """Given the seed user and a list of friends, save all 'edges' to collection"""
-    for fid in friend_ids:
-        edge_doc  = create_edge_doc(seed_id, fid)
-        try:
-            edge_collection.save(edge_doc)
-        except DuplicateKeyError:
-            logger.warn("Edge {0} alread in DB {1}, skipping".format(edge_doc, collection.full_name))
-        except Exception as e:
-            logger.error("Storing Edge {0} in DB {1} failed".format(edge_doc, collection.full_name))
-            logger.error("Exception: {0}".format(e))
+    """Given the seed user and a list of friends, save all 'edges' to collection (bulk)"""
+    _save_edges([create_edge_doc(seed_id, fid) for fid in friend_ids], collection)
 
 def _save_follower_edges(seed_id, follower_ids, collection):
-    """Given the seed user and a list of followers, save all 'edges' to collection"""
-    for fid in follower_ids:
-        edge_doc  = create_edge_doc(fid, seed_id)
-        try:
-            edge_collection.save(edge_doc)
-        except DuplicateKeyError:
-            logger.warn("Edge {0} alread in DB {1}, skipping".format(edge_doc, collection.full_name))
-        except Exception as e:
-            logger.error("Storing Edge {0} in DB {1} failed".format(edge_doc, collection.full_name))
-            logger.error("Exception: {0}".format(e))
+    """Given the seed user and a list of followers, save all 'edges' to collection (bulk)"""
+    _save_edges([create_edge_doc(fid, seed_id) for fid in follower_ids], collection)
+
+def _save_edges(edge_docs, collection):
+    """Stores edge docs in one unordered bulk insert. Edges already in DB are skipped"""
+    result = bulk_write_ignore_duplicates(collection, [InsertOne(e) for e in edge_docs])
+    logger.debug("Stored {0} of {1} edges in {2}".format(result["nInserted"], len(edge_docs),
+        collection.full_name))
 
 
 if __name__ == "__main__":
@@ -345,11 +325,19 @@ if __name__ == "__main__":
         help="Collection in which to store followers [None]")
     parser.add_argument("-ec", "--edge_collection", default=None,
         help="Collection in which to store network edges [None]")
+    parser.add_argument("-ac", "--adjacency_collection", default=None,
+        help="Collection in which to store network edges as compact per-user neighbor " \
+        "lists (AdjacencyStore). Use instead of -ec [None]")
     parser.add_argument("-o", "--oauthsfile", required=True,
         help="Twitter oauths file. JSON file w/ LIST of app documents")
+    parser.add_argument("-rs", "--rate_state_file", default=None,
+        help="Local file for rate-limit state shared by all jobs on this host using " \
+        "the same oauths [None - state kept per process]")
     parser.add_argument("-rq", "--requery", action="store_true", default=False,
         help="Whether to query Twitter for frs/fols of users that already have" \
         "frs/fols [False]")
+    parser.add_argument("-cs", "--chunk_size", type=int, default=ID_PAGE_SIZE,
+        help="Number of fetched IDs to store per bulk insert [{0}]".format(ID_PAGE_SIZE))
     parser.add_argument("-ppe", "--print_progress_every", type=int,
         default=1000, help="Print progress every Nth user [1000]")
     parser.add_argument("-frt", "--friends_threshold", type=int, default=20000,
@@ -386,7 +374,8 @@ if __name__ == "__main__":
 
     # Set up TweepyPool API
     logger.debug("Loading twitter OAUTHs from {0}".format(args.oauthsfile))
-    api = APIPool(oauths_filename=args.oauthsfile, debug=True)
+    api = APIPool(oauths_filename=args.oauthsfile, debug=True,
+        state_file=args.rate_state_file)
 
     # Set up DB connection
     logger.debug("Connecting to MongoDB")
@@ -396,6 +385,8 @@ if __name__ == "__main__":
         database.authenticate(args.user, args.password)
     seed_collection = database[args.seed_collection]
     edge_collection = database[args.edge_collection] if args.edge_collection else None
+    if args.adjacency_collection:
+        edge_collection = AdjacencyStore(database[args.adjacency_collection])
 
     # Attempt friends
     if args.friends_collection:
@@ -405,7 +396,8 @@ if __name__ == "__main__":
             edge_collection=edge_collection, user_sample=1.0, requery=args.requery,
             friends_threshold=args.friends_threshold,
             update_threshold=args.update_threshold,
-            print_progress_every=args.print_progress_every)
+            print_progress_every=args.print_progress_every,
+            chunk_size=args.chunk_size)
         logger.info("Friends complete")
     
     # Attempt followers
@@ -416,7 +408,8 @@ if __name__ == "__main__":
             edge_collection=edge_collection, user_sample=1.0, requery=args.requery,
             followers_threshold=args.followers_threshold,
             update_threshold=args.update_threshold,
-            print_progress_every=args.print_progress_every)
+            print_progress_every=args.print_progress_every,
+            chunk_size=args.chunk_size)
         logger.info("Followers complete")
 
 
@@ -6,20 +6,25 @@ user collection.
 @date 12/04/2014
 """
 
+import os
 import time
+import Queue
 import tweepy
 import random
 import logging
 import argparse
+import threading
 
+from collections import deque
 from pymongo import MongoClient
 from datetime import datetime, timedelta
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from bson.json_util import dumps as bson_dumps, loads as bson_loads
 from pymongo.errors import DuplicateKeyError, ConnectionFailure, CursorNotFound
 
 from smappPy.oauth import tweepy_auth
 from smappPy.tweepy_pool import APIPool
-from smappPy.collection_util import create_tweet_indexes
+from smappPy.collection_util import create_tweet_indexes, bulk_write_ignore_duplicates
 from smappPy.tweepy_error_handling import call_with_error_handling
 from smappPy.tweet_util import add_random_to_tweet, add_timestamp_to_tweet
 
@@ -29,135 +34,390 @@ logger = logging.getLogger(__name__)
 
 
 def populate_user_tweets(api, user_collection, tweet_collection, tweets_per_user,
-    ensure_indexes=True, requery=True, update_threshold=None):
+    ensure_indexes=True, requery=True, update_threshold=None, tweet_id_collection=None,
+    write_batch_size=1000):
     """
     Iterates through user_collection, querying Twitter API for last 'tweets_per_user'
     tweets. Considers last tweet fetched for each user. Updates user access time and last
     tweet fetched. Calculates and stores user tweet frequency.
     If requery is False, does not query for tweets of user that already has tweet ids in
-    'tweet_ids' field.
+    'tweet_ids' field (or a 'latest_tweet_id').
+    Tweets and userdoc updates are written in bulk, every 'write_batch_size' tweets (see
+    UserTweetWriter). If 'tweet_id_collection' is given, user tweet IDs are stored there
+    instead of in userdocs' 'tweet_ids' lists.
     """
     if ensure_indexes:
         logger.info("Ensuring indexes on tweet collection")
         create_tweet_indexes(tweet_collection)
+        if tweet_id_collection:
+            ensure_user_tweet_id_indexes(tweet_id_collection)
+    writer = UserTweetWriter(tweet_collection, user_collection, tweet_id_collection,
+        write_batch_size)
     
     # Get DB cursor over users according to parameters
-    if update_threshold:
-        users = user_collection.find({"$or": [
-                                        {"tweets_updated": {"$lt": update_threshold}},
-                                        {"tweets_updated": {"$type": BSON_NULL}}
-                                     ]},
-                                     no_cursor_timeout=True,)
-                                     # Remove sort for now. Can not execute on field without index
-                                     # sort=[("tweets_updated", ASCENDING)])
-    else:
-        users = user_collection.find(no_cursor_timeout=True,)
-                                     # Remove sort (see above)
-                                     # sort=[("tweets_updated", ASCENDING)])
+    # Note: no sort on "tweets_updated". Can not execute on field without index
+    users = user_collection.find(_user_query(update_threshold), no_cursor_timeout=True)
     logger.info("Considering {0} users total".format(users.count(with_limit_and_skip=True)))
 
     # Iterate over users, attempting to fetch and store tweets for each
     for user in users:
         logger.info("Considering user {0}".format(user["id"]))
+        tweets = fetch_user_tweets(api, user, tweets_per_user, requery)
 
-        # Check requery and user tweets. If requery False and user has tweets, skip user
-        if not requery and user["tweet_ids"]:
-            logger.debug(".. User {0} has tweets, not re-querying".format(user["id"]))
+        # Do a final check of tweet population. If None, there was an error that waiting
+        # and retrying could not fix (or user skipped). If tweets is merely an empty list,
+        # still want to update user's 'updated_timestamp' field.
+        if tweets == None:
             continue
 
-        if user["latest_tweet_id"]:
-            cursor = tweepy.Cursor(api.user_timeline, 
-                                   user_id=user["id"], 
-                                   since_id=user["latest_tweet_id"], 
-                                   include_rts=True)
-        else:
-            cursor = tweepy.Cursor(api.user_timeline, 
-                                   user_id=user["id"], 
-                                   include_rts=True)
-
-        # While return is error, keep trying to get tweets depending on error type.
-        # If error not well-understood, move on to next user
-        return_code = -1
-        while return_code != 0:
-            tweets, return_code = call_with_error_handling(list, cursor.items(tweets_per_user))
-
-            # User no longer exists. Move on
-            if return_code == 34:
-                logger.warn(".. User {0} no longer exists, skipping".format(user["id"]))
-                break
-            elif return_code == 179:
-                logger.warn(".. User {0}'s account is private, skipping".format(user["id"]))
-                break
-            elif return_code != 0:
-                logger.warn(".. Error {0} for user {1}, skipping".format(return_code, user["id"]))
-                break
+        writer.add(user, tweets)
+        logger.info(".. {0} tweets found".format(len(tweets)))
+    writer.flush()
 
-        # Do a final check of tweet population. If None, there was an error that waiting
-        # and retrying could not fix. If tweets is merely an empty list, still want to update
-        # user's 'updated_timestamp' field.
-        if tweets == None:
+def populate_user_tweets_parallel(api, user_collection, tweet_collection, tweets_per_user,
+    num_workers=8, read_batch_size=100, write_batch_size=1000, checkpoint_file=None,
+    ensure_indexes=True, requery=True, update_threshold=None, tweet_id_collection=None):
+    """
+    Parallel version of populate_user_tweets (same parameters and userdoc updates).
+    A producer reads userdocs in _id order, 'read_batch_size' at a time; 'num_workers'
+    threads fetch user timelines through 'api' (pass an APIPool: each worker is given its
+    own share of the pool's tokens); a single writer thread stores tweets and userdoc
+    updates through a UserTweetWriter, flushing every 'write_batch_size' tweets.
+    If 'checkpoint_file' is given, the _id up to which every user has been stored is saved
+    there after each flush, and a run given the same file resumes from that point. The
+    checkpoint is removed once every user has been considered, so the next run given
+    the same file starts over.
+    """
+    if ensure_indexes:
+        logger.info("Ensuring indexes on tweet collection")
+        create_tweet_indexes(tweet_collection)
+        if tweet_id_collection:
+            ensure_user_tweet_id_indexes(tweet_id_collection)
+
+    query = _user_query(update_threshold)
+    last_id = _read_checkpoint(checkpoint_file)
+    if last_id is not None:
+        logger.info("Resuming from checkpoint, after user _id {0}".format(last_id))
+        query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+    users = user_collection.find(query, no_cursor_timeout=True, sort=[("_id", ASCENDING)],
+        batch_size=read_batch_size)
+    logger.info("Considering {0} users total".format(users.count(with_limit_and_skip=True)))
+
+    user_queue = Queue.Queue(maxsize=num_workers * read_batch_size)
+    result_queue = Queue.Queue(maxsize=num_workers * read_batch_size)
+    progress = _HarvestProgress(checkpoint_file)
+    producer_errors = []
+
+    def produce():
+        try:
+            for user in users:
+                progress.dispatched(user["_id"])
+                user_queue.put(user)
+        except Exception as e:
+            logger.error("Reading users failed: {0}".format(e))
+            producer_errors.append(e)
+        finally:
+            users.close()
+            for _ in range(num_workers):
+                user_queue.put(None)
+
+    def work(api):
+        while True:
+            user = user_queue.get()
+            if user is None:
+                result_queue.put(None)
+                return
+            try:
+                tweets = fetch_user_tweets(api, user, tweets_per_user, requery)
+            except Exception as e:
+                logger.error("Fetching tweets for user {0} failed: {1}".format(user["id"], e))
+                tweets = None
+            result_queue.put((user, tweets))
+
+    # Without shared throttle state, every worker calling one pool would pick the same
+    # token until it is throttled
+    if isinstance(api, APIPool):
+        worker_apis = api.partition(num_workers)
+    else:
+        worker_apis = [api] * num_workers
+
+    threads = [threading.Thread(target=produce, name="user-producer")]
+    threads += [threading.Thread(target=work, args=(worker_apis[i],),
+        name="timeline-worker-{0}".format(i)) for i in range(num_workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    writer = UserTweetWriter(tweet_collection, user_collection, tweet_id_collection,
+        write_batch_size)
+    _write_harvest_results(result_queue, num_workers, writer, progress)
+    for t in threads:
+        t.join()
+
+    # Keep the checkpoint to resume from if users could not all be read
+    if producer_errors:
+        raise producer_errors[0]
+    _clear_checkpoint(checkpoint_file)
+
+def fetch_user_tweets(api, user, tweets_per_user, requery=True):
+    """
+    Queries Twitter API for up to 'tweets_per_user' tweets of given userdoc, newer than
+    the userdoc's 'latest_tweet_id'. Returns list of tweepy Status objects (newest first),
+    or None if user was skipped (requery False and user has tweets) or the query failed.
+    """
+    # Check requery and user tweets. If requery False and user has tweets, skip user
+    if not requery and (user["tweet_ids"] or user["latest_tweet_id"]):
+        logger.debug(".. User {0} has tweets, not re-querying".format(user["id"]))
+        return None
+
+    if user["latest_tweet_id"]:
+        cursor = tweepy.Cursor(api.user_timeline, 
+                               user_id=user["id"], 
+                               since_id=user["latest_tweet_id"], 
+                               include_rts=True)
+    else:
+        cursor = tweepy.Cursor(api.user_timeline, 
+                               user_id=user["id"], 
+                               include_rts=True)
+
+    # While return is error, keep trying to get tweets depending on error type.
+    # If error not well-understood, move on to next user
+    tweets, return_code = None, -1
+    while return_code != 0:
+        tweets, return_code = call_with_error_handling(list, cursor.items(tweets_per_user))
+
+        # User no longer exists. Move on
+        if return_code == 34:
+            logger.warn(".. User {0} no longer exists, skipping".format(user["id"]))
+            break
+        elif return_code == 179:
+            logger.warn(".. User {0}'s account is private, skipping".format(user["id"]))
+            break
+        elif return_code != 0:
+            logger.warn(".. Error {0} for user {1}, skipping".format(return_code, user["id"]))
+            break
+
+    return tweets
+
+def user_tweet_frequency(tweets):
+    """Returns tweets per day over given list of tweepy Status objects (newest first)"""
+    if len(tweets) < 2:
+        return 0
+    first_tweet_date = tweets[-1].created_at
+    last_tweet_date = tweets[0].created_at
+    return len(tweets) / float((last_tweet_date - first_tweet_date).days or 1)
+
+def _user_query(update_threshold):
+    """Returns query for users whose tweets were last updated before threshold (if any)"""
+    if not update_threshold:
+        return {}
+    return {"$or": [
+                {"tweets_updated": {"$lt": update_threshold}},
+                {"tweets_updated": {"$type": BSON_NULL}}
+            ]}
+
+def _read_checkpoint(checkpoint_file):
+    """Returns last stored user _id from checkpoint file, or None if no checkpoint"""
+    if not checkpoint_file or not os.path.isfile(checkpoint_file):
+        return None
+    with open(checkpoint_file) as handle:
+        return bson_loads(handle.read())["last_id"]
+
+def _write_checkpoint(checkpoint_file, last_id):
+    """Atomically writes last stored user _id to checkpoint file"""
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, "w") as handle:
+        handle.write(bson_dumps({"last_id": last_id}))
+    os.rename(tmp_file, checkpoint_file)
+
+def _clear_checkpoint(checkpoint_file):
+    """Removes checkpoint file (if any), once a harvest has completed"""
+    if checkpoint_file and os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
+
+
+class _HarvestProgress(object):
+    """
+    Tracks which users (by _id, in read order) have been stored, so a checkpoint can be
+    placed below the first user still in flight (workers finish out of order).
+    """
+
+    def __init__(self, checkpoint_file):
+        self.checkpoint_file = checkpoint_file
+        self.lock = threading.Lock()
+        self.in_order = deque()
+        self.stored = set()
+        self.last_id = None
+        self.count = 0
+
+    def dispatched(self, user_id):
+        with self.lock:
+            self.in_order.append(user_id)
+
+    def stored_users(self, user_ids):
+        with self.lock:
+            self.stored.update(user_ids)
+            self.count += len(user_ids)
+            while self.in_order and self.in_order[0] in self.stored:
+                self.last_id = self.in_order.popleft()
+                self.stored.remove(self.last_id)
+        if self.checkpoint_file and self.last_id is not None:
+            _write_checkpoint(self.checkpoint_file, self.last_id)
+
+
+def _write_harvest_results(result_queue, num_workers, writer, progress):
+    """
+    Writer loop for populate_user_tweets_parallel. Consumes (userdoc, tweets) results
+    until every worker has signalled completion, storing them through given writer.
+    """
+    done_ids = []
+    workers_done = 0
+    while workers_done < num_workers:
+        result = result_queue.get()
+        if result is None:
+            workers_done += 1
             continue
 
+        user, tweets = result
+        done_ids.append(user["_id"])
+        if tweets is not None:
+            if writer.add(user, tweets):
+                progress.stored_users(done_ids)
+                done_ids = []
+            logger.info("User {0}: {1} tweets found".format(user["id"], len(tweets)))
+        elif len(done_ids) >= writer.batch_size:
+            # Skipped users need nothing written, but still move the checkpoint; users
+            # buffered before them must be stored before the checkpoint passes them
+            writer.flush()
+            progress.stored_users(done_ids)
+            done_ids = []
+
+    writer.flush()
+    progress.stored_users(done_ids)
+    logger.info("Harvest complete, {0} users considered".format(progress.count))
+
+
+class UserTweetWriter(object):
+    """
+    Batched persistence for user timelines. Buffers tweet upserts (keyed on tweet 'id', so
+    tweets already stored are left untouched without raising duplicate key errors) and
+    partial userdoc updates ($set of timestamps and frequency, $max of 'latest_tweet_id',
+    $addToSet of 'tweet_ids'), and sends each as one unordered bulk write once
+    'batch_size' tweets or users are buffered, or on flush().
+    If 'tweet_id_collection' is given, user tweet IDs are stored there as
+    {"user_id", "tweet_id"} docs instead of in the userdoc 'tweet_ids' list (which grows
+    without bound for prolific accounts).
+    """
+
+    def __init__(self, tweet_collection, user_collection, tweet_id_collection=None,
+        batch_size=1000):
+        self.tweet_collection = tweet_collection
+        self.user_collection = user_collection
+        self.tweet_id_collection = tweet_id_collection
+        self.batch_size = batch_size
+        self.tweet_ops, self.user_ops, self.tweet_id_ops = [], [], []
+
+    def add(self, user, tweets):
+        """
+        Buffers given tweepy Status objects (newest first, as returned by Twitter) and the
+        matching update of userdoc 'user'. Returns True if this triggered a flush.
+        """
         # Reverse tweets when storing (given order is newest to oldest)
-        saved_tweet_ids = []
         for tweet in tweets[::-1]:
-            saved_id = save_tweet(tweet_collection, tweet)
-            if saved_id:
-                saved_tweet_ids.append(saved_id)
-
-        # Calculate frequency
-        if len(tweets) < 2:
-            frequency = 0
-        else:
-            first_tweet_date = tweets[-1].created_at
-            last_tweet_date = tweets[0].created_at
-            frequency = len(tweets) / float((last_tweet_date - first_tweet_date).days or 1)
+            json_tweet = prepare_tweet(tweet)
+            self.tweet_ops.append(
+                UpdateOne({"id": json_tweet["id"]}, {"$setOnInsert": json_tweet}, upsert=True))
 
+        tweet_ids = [t.id for t in tweets]
         latest_tweet_id = tweets[0].id if tweets else None
-        update_user(user_collection, user, latest_tweet_id, frequency, saved_tweet_ids)
-        logger.info(".. {0} tweets found, {1} saved".format(len(tweets), len(saved_tweet_ids)))
+        frequency = user_tweet_frequency(tweets)
+        if self.tweet_id_collection:
+            self.tweet_id_ops += [UpdateOne({"user_id": user["id"], "tweet_id": tid},
+                {"$setOnInsert": {"user_id": user["id"], "tweet_id": tid}}, upsert=True)
+                for tid in tweet_ids]
+            tweet_ids = []
+        self.user_ops.append(UpdateOne({"_id": user["_id"]},
+            user_tweet_update(user, latest_tweet_id, frequency, tweet_ids)))
 
-def save_tweet(tweet_collection, tweet):
-    """
-    Saves a tweet to mongo collection, adds random number for sampling. Returns number
-    of tweets saved (1 or 0)
-    """
+        if len(self.tweet_ops) >= self.batch_size or len(self.user_ops) >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """Writes all buffered tweets, then tweet IDs and userdoc updates"""
+        result = bulk_write_ignore_duplicates(self.tweet_collection, self.tweet_ops)
+        if self.tweet_id_collection:
+            bulk_write_ignore_duplicates(self.tweet_id_collection, self.tweet_id_ops)
+        bulk_write_ignore_duplicates(self.user_collection, self.user_ops)
+        logger.info(".. Stored {0} new tweets of {1} ({2} users)".format(result["nUpserted"],
+            len(self.tweet_ops), len(self.user_ops)))
+        self.tweet_ops, self.user_ops, self.tweet_id_ops = [], [], []
+
+
+def ensure_user_tweet_id_indexes(collection):
+    """Ensures indexes for a collection of {"user_id", "tweet_id"} docs"""
+    collection.ensure_index("user_id", name="user_id", background=True)
+    collection.ensure_index([("user_id", ASCENDING), ("tweet_id", ASCENDING)],
+        name="compound_unique", unique=True, background=True)
+
+def prepare_tweet(tweet):
+    """Returns tweet's JSON doc with random number (for sampling) and timestamp added"""
     json_tweet = tweet._json
     add_random_to_tweet(json_tweet)
     add_timestamp_to_tweet(json_tweet)
-    try:
-        tweet_collection.save(json_tweet)
-    except DuplicateKeyError:
+    return json_tweet
+
+def save_tweet(tweet_collection, tweet):
+    """
+    Saves a tweet to mongo collection (upsert on tweet 'id', existing tweets are left as
+    they are), adds random number for sampling. Returns tweet ID if the tweet was new,
+    None if it was already in the collection.
+    """
+    json_tweet = prepare_tweet(tweet)
+    result = tweet_collection.update_one({"id": json_tweet["id"]},
+        {"$setOnInsert": json_tweet}, upsert=True)
+    if result.upserted_id is None:
         logger.warn("Tweet {0} duplicate in DB".format(tweet.id))
         return None
     return json_tweet["id"]
 
 def update_user(user_collection, user, latest_tweet_id, frequency, tweet_ids):
     """
-    Updates a user's 'latest_tweet_id' and 'updated_timestamp'
+    Updates a user's 'latest_tweet_id' and 'updated_timestamp' (partial update, see
+    user_tweet_update)
+    """
+    try:
+        user_collection.update_one({"_id": user["_id"]},
+            user_tweet_update(user, latest_tweet_id, frequency, tweet_ids))
+    except Exception as e:
+        logger.error("Couldn't save user: {0}".format(e))
+
+def user_tweet_update(user, latest_tweet_id, frequency, tweet_ids):
+    """
+    Returns a mongo update document for userdoc's tweet fields: timestamps, frequency
+    (compound average with 'user's current value), latest tweet ID ($max) and tweet
+    IDs ($addToSet). Only new values are sent, not the full userdoc.
     """
     updated_at = datetime.now()
-    user["updated_timestamp"] = updated_at
-    user["tweets_updated"] = updated_at
-    
+    update = {"$set": {"updated_timestamp": updated_at, "tweets_updated": updated_at}}
+
     # Frequency is a compound average of frequencies
     if "tweet_frequency" in user and user["tweet_frequency"]:
-        user["tweet_frequency"] = (user["tweet_frequency"] + frequency) / 2
+        update["$set"]["tweet_frequency"] = (user["tweet_frequency"] + frequency) / 2
     else:
-        user["tweet_frequency"] = frequency
+        update["$set"]["tweet_frequency"] = frequency
 
     if latest_tweet_id:
-        user["latest_tweet_id"] = latest_tweet_id
+        update["$max"] = {"latest_tweet_id": latest_tweet_id}
 
-    if "tweet_ids" not in user or not user["tweet_ids"]:
-        user["tweet_ids"] = list(set(tweet_ids))
-    else:
-        user["tweet_ids"] = list(set(user["tweet_ids"] + tweet_ids))
+    # $addToSet can not be applied to a null field (default userdoc 'tweet_ids')
+    if "tweet_ids" not in user or user["tweet_ids"] is None:
+        update["$set"]["tweet_ids"] = list(set(tweet_ids))
+    elif tweet_ids:
+        update["$addToSet"] = {"tweet_ids": {"$each": list(set(tweet_ids))}}
 
-    try:
-        user_collection.save(user)
-    except Exception as e:
-        logger.error("Couldn't save user: {0}".format(e))
+    return update
 
 
 if __name__ == "__main__":
@@ -178,12 +438,22 @@ if __name__ == "__main__":
         help="Collection to hold user tweets")
     parser.add_argument("-a", "--oauthsfile", required=True,
         help="JSON file w/ LIST of Twitter OAuth keys")
+    parser.add_argument("-rs", "--rate_state_file", default=None,
+        help="Local file for rate-limit state shared by all jobs on this host using " \
+        "the same oauths [None - state kept per process]")
     parser.add_argument("-n", "--num_tweets", type=int, default=100,
         help="Number of tweets per user to store [100]")
     parser.add_argument("-ni", "--no_indexes", action="store_true", default=False,
         help="Flag for whether or not to create indexes (add to skip index creation)")
     parser.add_argument("-rq", "--requery", action="store_true", default=False,
         help="Whether to query Twitter for tweets of users that already have them in DB [False]")
+    parser.add_argument("-nw", "--num_workers", type=int, default=1,
+        help="Number of threads fetching timelines. More than 1 uses the parallel " \
+        "harvester (bulk writes, checkpointing) [1]")
+    parser.add_argument("-tic", "--tweet_id_collection", default=None,
+        help="Collection to hold user tweet IDs, instead of userdoc 'tweet_ids' [None]")
+    parser.add_argument("-cf", "--checkpoint_file", default=None,
+        help="Parallel harvester checkpoint file. Resumes from it if it exists [None]")
     parser.add_argument("-ut", "--update_threshold", type=int, nargs=5, default=None,
         help="If present, only users with friends/followers_updated timestamp BEFORE " \
         "given value will be updated. Format is five numbers, space-separated: " \
@@ -216,17 +486,32 @@ if __name__ == "__main__":
                     args.user, args.database))
     user_col = db[args.user_collection]
     tweet_col = db[args.tweet_collection]
+    tweet_id_col = db[args.tweet_id_collection] if args.tweet_id_collection else None
 
     # Create Tweepy API
     logger.debug("Loading Twitter OAUTHs from {0}".format(args.oauthsfile))
-    api = APIPool(oauths_filename=args.oauthsfile, debug=True)
+    api = APIPool(oauths_filename=args.oauthsfile, debug=True,
+        state_file=args.rate_state_file)
 
     # Populate DB with user data
-    populate_user_tweets(api,
-                         user_col,
-                         tweet_col,
-                         args.num_tweets,
-                         ensure_indexes=not args.no_indexes,
-                         requery=args.requery,
-                         update_threshold=args.update_threshold)
+    if args.num_workers > 1:
+        populate_user_tweets_parallel(api,
+                                      user_col,
+                                      tweet_col,
+                                      args.num_tweets,
+                                      num_workers=args.num_workers,
+                                      checkpoint_file=args.checkpoint_file,
+                                      ensure_indexes=not args.no_indexes,
+                                      requery=args.requery,
+                                      update_threshold=args.update_threshold,
+                                      tweet_id_collection=tweet_id_col)
+    else:
+        populate_user_tweets(api,
+                             user_col,
+                             tweet_col,
+                             args.num_tweets,
+                             ensure_indexes=not args.no_indexes,
+                             requery=args.requery,
+                             update_threshold=args.update_threshold,
+                             tweet_id_collection=tweet_id_col)
 